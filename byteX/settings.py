@@ -34,10 +34,26 @@ LOGIN_URL = '/login/'
 
 SESSION_COOKIE_AGE = 86400
 CART_SESSION_ID = 'cart'
+CART_FRAGMENT_CACHE_TIMEOUT = 600
 
 STRIPE_API_KEY_PUBLISHABLE = 'pk_test_51NygnCHkylqnmIj12gSaIt3cmAGJW8b4b7HqqzlrqQr5BJsXi8Gn0zyXY7UUyc6Q732eMMi8GUbJpA81wwUvxnDB002auvKIf6'
 STRIPE_API_KEY_HIDDEN = 'sk_test_51NygnCHkylqnmIj1NU99JcrEXzqlQ3eQdvfOntHWekMJbPpOY1Ky0GyOBBzdwvCGoU84xIIT8J5KexpvQc2KOhTf00m5bCLrP8'
 
+# Route the cart and checkout endpoints to their async views, for ASGI deployments (byteX/asgi.py).
+# Under WSGI the sync views avoid running an event loop per request.
+ASYNC_VIEWS = False
+
+# Payment gateway (order/payments.py). Use 'order.payments.StubGateway' to run checkouts
+# without network access, e.g. for load tests.
+PAYMENT_GATEWAY = 'order.payments.StripeGateway'
+PAYMENT_CONNECT_TIMEOUT = 3
+PAYMENT_READ_TIMEOUT = 10
+PAYMENT_MAX_RETRIES = 1
+PAYMENT_POOL_SIZE = 10
+PAYMENT_BREAKER_THRESHOLD = 5
+PAYMENT_BREAKER_RESET_TIMEOUT = 30
+PAYMENT_STUB_LATENCY = 0
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -54,11 +70,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cart.middleware.CartMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,7 +86,8 @@ ROOT_URLCONF = 'byteX.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing template renders for the metrics (core/metrics.py).
+        'BACKEND': 'core.metrics.MetricsDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -96,6 +116,52 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The catalog cache (product/catalog.py) and its version key live here. Use a backend that is
+# shared between workers (file based, Redis, Memcached) when running more than one process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CATALOG_CACHE_TIMEOUT = 300
+CATALOG_STALE_TIMEOUT = 3600
+
+# How long the catalog pages rendered for anonymous visitors are cached (core/cache.py).
+PAGE_CACHE_TIMEOUT = 300
+
+# Prometheus scrapes the metrics at /metrics/ with this value in an "Authorization: Bearer" header
+# (staff users need no token). None: only staff users can read them.
+METRICS_TOKEN = None
+# Client addresses allowed without a token. They are checked against REMOTE_ADDR, which is the
+# proxy's address behind nginx: only list addresses here when Django is reached directly.
+METRICS_ALLOWED_IPS = []
+
+# Sampled request profiles (core/profiling.py), turned on and off with `manage.py profiling`.
+PROFILING_DIR = BASE_DIR / 'profiles'
+# Requests sending this value in the X-Profile header are profiled; staff users need no token.
+PROFILING_TOKEN = None
+
+# Multiplies every latency budget of core/budgets.py, for slow test machines.
+BUDGET_LATENCY_FACTOR = 1
+
+
+# Search
+# 'auto' uses the SQLite FTS5 index when it exists and an in-memory inverted index otherwise.
+
+SEARCH_BACKEND = 'auto'
+SEARCH_MAX_RESULTS = 1000
+
+# Number of products per page (and per "load more") in the shop.
+SHOP_PAGE_SIZE = 24
+
+# Number of orders per page in the account page.
+ORDERS_PAGE_SIZE = 10
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -131,9 +197,38 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = 'static/'
+# Where collectstatic writes the hashed, precompressed assets (core/storage.py) for the front-end server.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_DIRS = [BASE_DIR / 'assets']
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 MEDIA_URL =  '/media/'
 MEDIA_ROOT = BASE_DIR / 'media/'
 
+# How long browsers cache media files that are not content-hashed, in seconds (core/media.py).
+MEDIA_MAX_AGE = 3600
+# Let the front-end server send the media files: None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache).
+MEDIA_SENDFILE = None
+# The internal nginx location aliasing MEDIA_ROOT, for 'x-accel-redirect'.
+MEDIA_ACCEL_PREFIX = '/internal-media/'
+
+# Number of "frequently bought together" products kept per product (order/recommendations.py).
+RECOMMENDATIONS_TOP_K = 8
+# Count the co-purchases of each new order in a background thread. Off by default: on SQLite
+# that writer competes with the request writes. Run `manage.py build_recommendations --update`
+# periodically instead, which counts every new order in one transaction.
+RECOMMENDATIONS_ON_ORDER = False
+
+# Number of background threads building product thumbnails (product/thumbnails.py).
+THUMBNAIL_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
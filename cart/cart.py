@@ -1,7 +1,146 @@
-from django.conf import settings
+import uuid
+from decimal import Decimal
 
+from product import catalog
 from product.models import Product
 
+from .storage import aget_storage, get_storage
+
+
+def get_cart(request):
+    """
+    Returns the Cart for the given request, creating it on first use.
+
+    The cart is memoized on the request object so the context processor, the views and the
+    HTMX partials all share one instance (and therefore one batched product lookup) per request.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        Cart: The cart bound to this request.
+    """
+    cart = getattr(request, '_cart', None)
+
+    if cart is None:
+        cart = request._cart = Cart(request)
+
+    return cart
+
+
+async def aget_cart(request):
+    """
+    The async version of get_cart, for async views. The cart is loaded with the async session
+    and ORM APIs and memoized on the request like get_cart does.
+
+    Async views must load what their templates need before rendering (`aget_products`,
+    `aget_etag`), since the templates are rendered synchronously.
+    """
+    cart = getattr(request, '_cart', None)
+
+    if cart is None:
+        cart = request._cart = await Cart.acreate(request)
+
+    return cart
+
+
+class CartLine(object):
+    """
+    A single line of the cart as it is stored in the session.
+
+    Only the product ID, the quantity and a snapshot of the unit price are kept, so the session
+    payload stays small. Display data (the Product instance, line totals) is never stored here.
+    """
+    __slots__ = ('product_id', 'quantity', 'price')
+
+    def __init__(self, product_id, quantity=1, price=None):
+        self.product_id = int(product_id)
+        self.quantity = int(quantity)
+        self.price = price
+
+    def __repr__(self):
+        return 'CartLine(%r, %r, %r)' % (self.product_id, self.quantity, self.price)
+
+    def to_payload(self):
+        """
+        Serializes the line to a compact list: [product_id, quantity, price].
+
+        Returns:
+            list: The serialized line. The price is a string (or None if not yet known).
+        """
+        return [self.product_id, self.quantity, None if self.price is None else str(self.price)]
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Builds a line from the list produced by `to_payload`.
+
+        Args:
+            payload (list): The serialized line.
+
+        Returns:
+            CartLine: The deserialized line.
+        """
+        product_id, quantity, price = payload
+        return cls(product_id, quantity, None if price is None else Decimal(price))
+
+
+def parse_payload(payload):
+    """
+    Deserializes a stored cart into its catalog version and its lines.
+
+    Carts stored in the old format ({product_id: {'quantity': ..., 'id': ...}}) are converted
+    on the fly; their prices are refreshed the next time the products are loaded.
+
+    Args:
+        payload (dict or None): The stored cart.
+
+    Returns:
+        tuple: The catalog version (or None) and a dict of CartLine objects keyed by product ID.
+    """
+    lines = {}
+
+    if not payload:
+        return None, lines
+
+    if 'l' not in payload:
+        for product_id, item in payload.items():
+            line = CartLine(product_id, item['quantity'])
+            lines[line.product_id] = line
+
+        return None, lines
+
+    for line_payload in payload['l']:
+        line = CartLine.from_payload(line_payload)
+        lines[line.product_id] = line
+
+    return payload.get('v'), lines
+
+
+def build_payload(version, lines, revision=0, token=None):
+    """
+    Serializes a cart to the compact form kept in the storage:
+    {'v': catalog_version, 'l': [[product_id, quantity, price], ...], 'n': revision, 't': token}.
+
+    Args:
+        version (int or None): The catalog version the price snapshots were taken at.
+        lines (dict): The CartLine objects keyed by product ID.
+        revision (int, optional): The version counter of the cart, bumped on every write.
+        token (str, optional): A random identifier of the cart, so revisions of different carts never collide.
+
+    Returns:
+        dict: The serialized cart.
+    """
+    return {'v': version, 'l': [line.to_payload() for line in lines.values()], 'n': revision, 't': token}
+
+
+def new_token():
+    """
+    Returns a new random cart identifier.
+    """
+    return uuid.uuid4().hex[:12]
+
+
 class Cart(object):
     def __init__(self, request):
         """
@@ -10,19 +149,75 @@ class Cart(object):
         Args:
             request (HttpRequest): The HTTP request object.
 
-        Initializes the session attribute with the session from the request object.
-        Retrieves the cart from the session using the CART_SESSION_ID setting.
-        If the cart is not found, creates a new empty cart in the session.
-        Sets the cart attribute to the retrieved or created cart.
+        Picks the storage for the request (the session for anonymous visitors, the UserCart table
+        for signed-in users), loads the stored cart and deserializes it into CartLine objects keyed
+        by product ID.
+
+        The stored cart has the form {'v': catalog_version, 'l': [[product_id, quantity, price], ...]},
+        where 'v' is the catalog version the price snapshots were taken at.
 
         """
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
+        self.setup(get_storage(request))
+        self._stored = self.storage.load()
+        self.load(self._stored)
 
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        
-        self.cart = cart
+    @classmethod
+    async def acreate(cls, request):
+        """
+        Creates the Cart of a request from an async view, see `aget_cart`.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            Cart: The loaded cart.
+        """
+        cart = cls.__new__(cls)
+        cart.setup(await aget_storage(request))
+        cart._stored = await cart.storage.aload()
+        cart.load(cart._stored)
+        return cart
+
+    def setup(self, storage):
+        """
+        Binds an empty cart to its storage.
+
+        Args:
+            storage (SessionCartStorage or DatabaseCartStorage): Where the cart is loaded from and written to.
+
+        Returns:
+            None
+        """
+        self.storage = storage
+        self.lines = {}
+        self.version = None
+        self.modified = False
+        self._products = None
+        # The product IDs whose lines were dropped because the product no longer exists.
+        self.missing = set()
+
+    def load(self, payload):
+        """
+        Loads the cart lines from a stored payload.
+
+        Args:
+            payload (dict or None): The stored cart.
+
+        Returns:
+            None
+        """
+        self.version, self.lines = parse_payload(payload)
+        self.revision = payload.get('n', 0) if payload else 0
+        self.token = payload.get('t') if payload else None
+
+    def to_payload(self):
+        """
+        Serializes the cart to the compact form kept in the storage.
+
+        Returns:
+            dict: The serialized cart.
+        """
+        return build_payload(self.version, self.lines, self.revision, self.token)
     
     def __iter__(self):
         """
@@ -32,21 +227,28 @@ class Cart(object):
             dict: A dictionary representing an item in the cart. The dictionary contains the following keys:
                 - 'product' (Product): The product object associated with the item.
                 - 'quantity' (int): The quantity of the product in the item.
-                - 'total_price' (float): The total price of the item, calculated as the product price multiplied by the quantity.
+                - 'total_price' (Decimal): The total price of the item, calculated as the product price multiplied by the quantity.
 
-        This method retrieves the product objects associated with each item in the cart and calculates the total price of each item. It then yields each item as a dictionary.
+        The items are built on the side for display and are never written back to the session.
 
         Note:
-            The 'product' key in each item dictionary is populated by retrieving the product object from the database using the product ID stored in the item dictionary.
+            The products are loaded with a single batched query the first time they are needed
+            and reused for the rest of the request. Items whose product no longer exists are skipped.
 
         """
-        for p in self.cart.keys():
-            self.cart[str(p)]['product'] = Product.objects.get(pk=p)
-        
-        for item in self.cart.values():
-            item['total_price'] = int(item['product'].price * item['quantity']) / 100
+        products = self.get_products()
+
+        for line in list(self.lines.values()):
+            product = products.get(line.product_id)
+
+            if product is None:
+                continue
 
-            yield item
+            yield {
+                'product': product,
+                'quantity': line.quantity,
+                'total_price': product.price * line.quantity,
+            }
     
     def __len__(self):
         """
@@ -54,23 +256,178 @@ class Cart(object):
 
         :return: An integer representing the total quantity of items in the cart.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        return sum(line.quantity for line in self.lines.values())
+
+    def is_fresh(self):
+        """
+        Checks whether the price snapshots in the cart are still current.
+
+        The snapshots are fresh when they were taken at the current catalog version and every
+        line has a price. This costs a single cache lookup and no database query.
+
+        Returns:
+            bool: True if the snapshots can be used as they are.
+        """
+        if not self.lines:
+            return True
+
+        return (
+            self.version == catalog.get_version()
+            and all(line.price is not None for line in self.lines.values())
+        )
+
+    def get_products(self):
+        """
+        Returns the products in the cart, keyed by product ID.
+
+        The products are fetched with one `in_bulk` query on first access and memoized on the cart
+        until `add`, `remove` or `clear` change its contents. Loading the products also refreshes
+        the price snapshots and drops lines whose product no longer exists (their IDs are kept in
+        `missing`).
+
+        Returns:
+            dict: A mapping of product ID (int) to Product instance.
+        """
+        if self._products is None:
+            if self.lines:
+                self._products = Product.objects.in_bulk(list(self.lines))
+            else:
+                self._products = {}
+
+            self.refresh(self._products)
+
+        return self._products
+
+    async def aget_products(self):
+        """
+        The async version of `get_products`.
+        """
+        if self._products is None:
+            if self.lines:
+                self._products = await Product.objects.ain_bulk(list(self.lines))
+            else:
+                self._products = {}
+
+            self.refresh(self._products)
+
+        return self._products
+
+    def refresh(self, products):
+        """
+        Updates the price snapshots from freshly loaded products.
+
+        The cart is saved only if a snapshot, a line or the catalog version actually changed.
+
+        Args:
+            products (dict): A mapping of product ID to Product instance.
+
+        Returns:
+            None
+        """
+        changed = False
+        version = catalog.get_version()
+
+        for product_id, line in list(self.lines.items()):
+            product = products.get(product_id)
+
+            if product is None:
+                del self.lines[product_id]
+                self.missing.add(product_id)
+                changed = True
+            elif line.price != product.price:
+                line.price = product.price
+                changed = True
+
+        if self.lines and self.version != version:
+            self.version = version
+            changed = True
+
+        if changed:
+            self.save(keep_products=True)
+
+    def get_product(self, product_id):
+        """
+        Retrieves a product in the cart without running an extra query.
+
+        Args:
+            product_id (str): The ID of the product to retrieve.
+
+        Returns:
+            Product or None: The product, or None if it is not in the cart or no longer exists.
+        """
+        return self.get_products().get(int(product_id))
     
-    def save(self):
+    def save(self, keep_products=False):
         """
-        Save the cart data to the session.
+        Marks the cart as modified.
 
-        This function saves the cart data to the session using the `CART_SESSION_ID` setting as the key.
-        It updates the `modified` flag of the session to indicate that the session has been modified.
+        Nothing is written here: all the changes made during a request are coalesced and written
+        once by `flush`, which CartMiddleware calls when the response is ready.
+        It also drops the memoized products so they are reloaded the next time they are needed.
 
         Parameters:
-            None
+            keep_products (bool, optional): Keep the memoized products. Defaults to False.
 
         Returns:
             None
         """
-        self.session[settings.CART_SESSION_ID] = self.cart
-        self.session.modified = True
+        self.modified = True
+
+        if not keep_products:
+            self._products = None
+
+    def flush(self):
+        """
+        Writes the cart to its storage if it changed during the request.
+
+        The write is skipped when the cart was not modified, or when the serialized cart is
+        identical to what was loaded (for example after adding and removing the same product).
+        Every write bumps the revision of the cart, which its ETag is derived from.
+
+        Returns:
+            bool: True if the cart was written.
+        """
+        payload = self.get_pending_payload()
+
+        if payload is None:
+            return False
+
+        self.storage.save(payload)
+        self._stored = payload
+
+        return True
+
+    async def aflush(self):
+        """
+        The async version of `flush`.
+        """
+        payload = self.get_pending_payload()
+
+        if payload is None:
+            return False
+
+        await self.storage.asave(payload)
+        self._stored = payload
+
+        return True
+
+    def get_pending_payload(self):
+        """
+        Returns the payload `flush` has to write, with the revision bumped, or None if there is
+        nothing to write.
+        """
+        if not self.modified:
+            return None
+
+        self.modified = False
+        payload = self.to_payload()
+
+        if payload == self._stored or (not payload['l'] and not self._stored):
+            return None
+
+        self.revision += 1
+        self.token = self.token or new_token()
+        return self.to_payload()
     
     def add(self, product_id, quantity=1, update_quantity=False):
         """
@@ -85,15 +442,15 @@ class Cart(object):
         Returns:
             None
         """
-        product_id = str(product_id)
+        product_id = int(product_id)
 
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 1, 'id': product_id}
+        if product_id not in self.lines:
+            self.lines[product_id] = CartLine(product_id)
         
         if update_quantity:
-            self.cart[product_id]['quantity'] += int(quantity)
+            self.lines[product_id].quantity += int(quantity)
 
-            if self.cart[product_id]['quantity'] == 0:
+            if self.lines[product_id].quantity <= 0:
                 self.remove(product_id)
             
         self.save()
@@ -108,15 +465,18 @@ class Cart(object):
         Returns:
             None
         """
-        if product_id in self.cart:
-            del self.cart[product_id]
+        product_id = int(product_id)
+
+        if product_id in self.lines:
+            del self.lines[product_id]
             self.save()
             
     def clear(self):
         """
-        Clears the cart session by deleting the cart session ID from the session dictionary and setting the modified flag to True.
+        Removes all items from the cart.
 
-        This function is used to remove all items from the cart and clear the cart session. It deletes the cart session ID from the session dictionary using the `CART_SESSION_ID` setting as the key. It then sets the modified flag of the session to True to indicate that the session has been modified.
+        This function is used to empty the cart, for example once an order has been placed.
+        The empty cart is written to the storage by the next `flush`.
 
         Parameters:
             None
@@ -124,38 +484,74 @@ class Cart(object):
         Returns:
             None
         """
-        del self.session[settings.CART_SESSION_ID]
-        self.session.modified = True
+        self.lines = {}
+        self.version = None
+        self._products = None
+        self.save()
 
     
     def get_total_cost(self):
         """
         Calculates the total cost of all items in the cart.
 
-        This function iterates over the keys of the cart dictionary and retrieves the corresponding product object using the product ID. It then calculates the total cost of each item by multiplying the product price with the quantity and sums up all the costs. The result is returned as a float.
+        When the price snapshots are fresh the total is computed from them without touching the
+        product table. Otherwise the products are loaded (one batched query) and the snapshots
+        are refreshed first. The result is returned as a float.
 
         Returns:
             float: The total cost of all items in the cart.
         """
-        for p in self.cart.keys():
-            self.cart[str(p)]['product'] = Product.objects.get(pk=p)
+        if not self.is_fresh():
+            self.get_products()
+
+        return float(sum(line.price * line.quantity for line in self.lines.values()))
+    
+    def get_etag(self):
+        """
+        Returns the entity tag of everything rendered from the cart.
+
+        It combines the cart identity and revision with the catalog version (prices shown in the
+        cart come from the catalog), so it changes whenever a cart fragment could change. All
+        empty carts render the same way and share one tag.
+
+        Stale price snapshots are refreshed and pending changes written first, so the tag
+        describes the cart as it will be rendered and stored.
+
+        Returns:
+            str: The entity tag, without quotes.
+        """
+        if not self.is_fresh():
+            self.get_products()
+
+        self.flush()
+
+        return self.format_etag()
+
+    async def aget_etag(self):
+        """
+        The async version of `get_etag`.
+        """
+        if not self.is_fresh():
+            await self.aget_products()
+
+        await self.aflush()
+
+        return self.format_etag()
 
-        return float(sum(item['product'].price * item['quantity'] for item in self.cart.values()))
+    def format_etag(self):
+        if not self.lines:
+            return 'empty.%s' % catalog.get_version()
+
+        return '%s.%s.%s' % (self.token or 'new', self.revision, catalog.get_version())
     
     def get_item(self, product_id):
         """
-        Retrieves the item with the given product ID from the cart.
+        Retrieves the line with the given product ID from the cart.
 
         Args:
             product_id (str): The ID of the product to retrieve.
 
         Returns:
-            dict or None: The item with the given product ID, or None if the product ID is not in the cart.
-            The item is represented as a dictionary with the following keys:
-                - 'quantity' (int): The quantity of the product in the item.
-                - 'id' (str): The ID of the product.
+            CartLine or None: The line with the given product ID, or None if the product ID is not in the cart.
         """
-        if str(product_id) in self.cart:
-            return self.cart[str(product_id)]
-        else:
-            return None
\ No newline at end of file
+        return self.lines.get(int(product_id))
\ No newline at end of file
@@ -1,4 +1,6 @@
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
 
 
 def cart(request):
@@ -9,6 +11,8 @@ def cart(request):
         request (HttpRequest): The HTTP request object.
     
     Returns:
-        dict: A dictionary with a single key 'cart' containing the user's Cart instance.
+        dict: A dictionary with a single key 'cart' containing the user's Cart instance,
+              shared with the views for the rest of the request. The cart is only loaded if the
+              template actually uses it, so cached and hole-punched pages never touch it.
     """
-    return {'cart': Cart(request)}
\ No newline at end of file
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
\ No newline at end of file
@@ -0,0 +1,43 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class CartMiddleware(object):
+    """
+    Writes the cart of the request back to its storage once, after the view has run.
+
+    Cart mutations only mark the cart as modified, so several of them in one request
+    (or a change that is undone in the same request) result in at most one write.
+    This middleware must come after SessionMiddleware and AuthenticationMiddleware.
+    Under ASGI it runs async and writes the cart with the async session and ORM APIs.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+
+        cart = getattr(request, '_cart', None)
+
+        if cart is not None:
+            cart.flush()
+
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+
+        cart = getattr(request, '_cart', None)
+
+        if cart is not None:
+            await cart.aflush()
+
+        return response
@@ -1,3 +1,13 @@
+from django.contrib.auth.models import User
 from django.db import models
 
-# Create your models here.
+
+# Define the UserCart model.
+# A user cart stores the cart of a signed-in user so it survives logouts and is shared between devices.
+class UserCart(models.Model):
+    user = models.OneToOneField(User, related_name='cart', on_delete=models.CASCADE)  # The owner of the cart (unique, so indexed).
+    data = models.JSONField(default=dict)  # The serialized cart, in the same compact format as the session cart.
+    updated_at = models.DateTimeField(auto_now=True)  # The date and time the cart was last written.
+
+    def __str__(self):
+        return 'Cart of %s' % self.user  # Return the owner of the cart when it is converted to a string.
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .cart import build_payload, new_token, parse_payload
+from .storage import DatabaseCartStorage
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    """
+    Merges the anonymous session cart into the user's persistent cart at login.
+
+    Quantities of products present in both carts are added up. The session cart is removed
+    afterwards so the user's cart is the only copy left.
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+
+    # Drop the cart memoized for the anonymous part of this request.
+    request.__dict__.pop('_cart', None)
+
+    session_payload = request.session.pop(settings.CART_SESSION_ID, None)
+
+    if not session_payload:
+        return
+
+    storage = DatabaseCartStorage(user)
+    _, lines = parse_payload(storage.load())
+    _, session_lines = parse_payload(session_payload)
+
+    for product_id, line in session_lines.items():
+        if product_id in lines:
+            lines[product_id].quantity += line.quantity
+        else:
+            lines[product_id] = line
+
+    # The merged prices come from two snapshots, so have them refreshed on next use.
+    storage.save(build_payload(None, lines, token=new_token()))
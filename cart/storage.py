@@ -0,0 +1,137 @@
+from django.conf import settings
+
+from .models import UserCart
+
+
+class SessionCartStorage(object):
+    """
+    Stores the cart of an anonymous visitor in the session.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+
+    def load(self):
+        """
+        Returns the stored cart payload, or None if there is none.
+        """
+        return self.session.get(settings.CART_SESSION_ID)
+
+    async def aload(self):
+        return await self.session.aget(settings.CART_SESSION_ID)
+
+    def save(self, payload):
+        """
+        Writes the cart payload to the session. An empty payload removes the cart from the session.
+
+        Args:
+            payload (dict or None): The serialized cart.
+
+        Returns:
+            None
+        """
+        if payload and payload.get('l'):
+            self.session[settings.CART_SESSION_ID] = payload
+        else:
+            self.session.pop(settings.CART_SESSION_ID, None)
+
+        self.session.modified = True
+
+    async def asave(self, payload):
+        if payload and payload.get('l'):
+            await self.session.aset(settings.CART_SESSION_ID, payload)
+        else:
+            await self.session.apop(settings.CART_SESSION_ID, None)
+
+        self.session.modified = True
+
+
+class DatabaseCartStorage(object):
+    """
+    Stores the cart of a signed-in user in the UserCart table.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.cart = None
+
+    def load(self):
+        """
+        Returns the stored cart payload, or None if the user has no cart yet.
+        """
+        self.cart = UserCart.objects.filter(user=self.user).first()
+
+        if self.cart is None:
+            return None
+
+        return self.cart.data
+
+    async def aload(self):
+        self.cart = await UserCart.objects.filter(user=self.user).afirst()
+
+        if self.cart is None:
+            return None
+
+        return self.cart.data
+
+    def save(self, payload):
+        """
+        Writes the cart payload to the user's cart row, creating the row on first write.
+
+        The first write goes through update_or_create, so a row written by a concurrent request
+        since the load (another tab adding its first item, say) is updated instead of failing on
+        the unique user column.
+
+        Args:
+            payload (dict or None): The serialized cart.
+
+        Returns:
+            None
+        """
+        payload = payload or {}
+
+        if self.cart is None:
+            self.cart, _ = UserCart.objects.update_or_create(user=self.user, defaults={'data': payload})
+        else:
+            self.cart.data = payload
+            self.cart.save(update_fields=['data', 'updated_at'])
+
+    async def asave(self, payload):
+        payload = payload or {}
+
+        if self.cart is None:
+            self.cart, _ = await UserCart.objects.aupdate_or_create(user=self.user, defaults={'data': payload})
+        else:
+            self.cart.data = payload
+            await self.cart.asave(update_fields=['data', 'updated_at'])
+
+
+def get_storage(request):
+    """
+    Returns the cart storage for the given request: the database for signed-in users and the
+    session for everybody else.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        SessionCartStorage or DatabaseCartStorage: The storage to read and write the cart with.
+    """
+    user = getattr(request, 'user', None)
+
+    if user is not None and user.is_authenticated:
+        return DatabaseCartStorage(user)
+
+    return SessionCartStorage(request)
+
+
+async def aget_storage(request):
+    """
+    The async version of get_storage: the user is loaded with the async session API.
+    """
+    user = await request.auser() if hasattr(request, 'auser') else None
+
+    if user is not None and user.is_authenticated:
+        return DatabaseCartStorage(user)
+
+    return SessionCartStorage(request)
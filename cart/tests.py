@@ -1,3 +1,278 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+
+from product import catalog
+from product.models import Category, Product
+
+from . import urls
+from .cart import CartLine, build_payload, get_cart, parse_payload
+from .models import UserCart
+from .storage import DatabaseCartStorage
+from .views import ahx_cart_total, ahx_menu_cart, aupdate_cart
+
+
+class CartTestMixin(object):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.products = Product.objects.bulk_create([
+            Product(category=category, name='Laptop %d' % i, slug='laptop-%d' % i, price=100 + i) for i in range(5)
+        ])
+
+    def add(self, product):
+        return self.client.get(reverse('cart:add_to_cart', args=[product.pk]))
+
+    def update(self, product_id, action):
+        return self.client.get(reverse('cart:update_cart', args=[product_id, action]))
+
+    def get_cart(self):
+        return get_cart(self.client.get(reverse('cart:cart')).wsgi_request)
+
+
+class BatchedLookupTests(CartTestMixin, TestCase):
+    def test_products_are_loaded_with_one_query(self):
+        for product in self.products:
+            self.add(product)
+
+        request = self.client.get(reverse('frontpage')).wsgi_request
+        cart = get_cart(request)
+        del request._cart
+
+        with self.assertNumQueries(1):
+            cart = get_cart(request)
+            items = list(cart)
+            self.assertEqual(cart.get_total_cost(), sum(product.price for product in self.products))
+            self.assertEqual(cart.get_product(self.products[0].pk), self.products[0])
+
+        self.assertEqual([item['product'] for item in items], self.products)
+
+    def test_deleted_products_are_dropped(self):
+        self.add(self.products[0])
+        self.add(self.products[1])
+        Product.objects.filter(pk=self.products[0].pk).delete()
+
+        self.assertEqual([item['product'] for item in self.get_cart()], [self.products[1]])
+
+    def test_update_cart(self):
+        self.add(self.products[0])
+
+        response = self.update(self.products[0].pk, 'increment')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['HX-Trigger'], 'update-menu-cart')
+        self.assertEqual(response.context['item']['quantity'], 2)
+
+        self.update(self.products[0].pk, 'decrement')
+        response = self.update(self.products[0].pk, 'decrement')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['item'])
+        self.assertEqual(len(self.get_cart()), 0)
+
+    def test_update_cart_invalid_action(self):
+        self.assertEqual(self.update(self.products[0].pk, 'double').status_code, 400)
+
+    def test_update_cart_missing_product(self):
+        response = self.update(999999, 'increment')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'Product does not exist'})
+        self.assertNotIn('HX-Trigger', response)
+        self.assertEqual(len(self.get_cart()), 0)
+
+
+class AsyncBatchedLookupTests(BatchedLookupTests):
+    """
+    Runs the same checks against aupdate_cart, the view routed when ASYNC_VIEWS is on.
+    """
+
+    def update(self, product_id, action):
+        pattern = next(pattern for pattern in urls.urlpatterns if pattern.name == 'update_cart')
+
+        with mock.patch.object(pattern, 'callback', aupdate_cart):
+            return super().update(product_id, action)
+
+
+class StorageFormatTests(CartTestMixin, TestCase):
+    def session_payload(self):
+        return self.client.session.get(settings.CART_SESSION_ID)
+
+    def test_payload_round_trip(self):
+        lines = {7: CartLine(7, 2, Decimal('10.50')), 9: CartLine(9, 1)}
+
+        payload = build_payload(42, lines, revision=3, token='abc')
+
+        self.assertEqual(payload, {'v': 42, 'l': [[7, 2, '10.50'], [9, 1, None]], 'n': 3, 't': 'abc'})
+        version, parsed = parse_payload(payload)
+        self.assertEqual(version, 42)
+        self.assertEqual([(line.product_id, line.quantity, line.price) for line in parsed.values()], [(7, 2, Decimal('10.50')), (9, 1, None)])
+
+    def test_session_holds_compact_lines_with_price_snapshots(self):
+        self.add(self.products[0])
+        self.update(self.products[0].pk, 'increment')
+        # The cart page loads the products, which takes the price snapshots.
+        self.client.get(reverse('cart:cart'))
+
+        self.assertEqual(self.session_payload()['l'], [[self.products[0].pk, 2, '100.00']])
+
+    def test_old_format_is_converted(self):
+        session = self.client.session
+        session[settings.CART_SESSION_ID] = {
+            str(self.products[0].pk): {'quantity': 3, 'id': self.products[0].pk},
+            str(self.products[1].pk): {'quantity': 1, 'id': self.products[1].pk},
+        }
+        session.save()
+
+        cart = self.get_cart()
+
+        self.assertEqual(len(cart), 4)
+        self.assertEqual(cart.get_total_cost(), 3 * self.products[0].price + self.products[1].price)
+        self.assertEqual(
+            sorted(self.session_payload()['l']),
+            sorted([[self.products[0].pk, 3, '100.00'], [self.products[1].pk, 1, '101.00']]),
+        )
+
+    def test_totals_follow_the_current_prices(self):
+        self.add(self.products[0])
+        self.client.get(reverse('cart:cart'))
+        Product.objects.filter(pk=self.products[0].pk).update(price=80)
+
+        cart = self.get_cart()
+
+        self.assertEqual(cart.get_total_cost(), 80)
+        self.assertEqual(self.session_payload()['l'], [[self.products[0].pk, 1, '80.00']])
+
+    def test_checkout_total_uses_the_shop_currency(self):
+        self.add(self.products[0])
+
+        response = self.client.get(reverse('cart:checkout'))
+
+        self.assertContains(response, '%s ৳' % response.context['cart'].get_total_cost())
+        self.assertNotContains(response, '$')
+
+
+class LoginMergeTests(CartTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret-password')
+
+    def log_in(self):
+        return self.client.post(reverse('login'), {'username': 'buyer', 'password': 'secret-password'})
+
+    def test_session_cart_is_merged_into_the_user_cart(self):
+        self.log_in()
+        self.add(self.products[0])
+        self.client.post(reverse('logout'))
+
+        self.add(self.products[0])
+        self.add(self.products[1])
+        self.log_in()
+
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+        cart = self.get_cart()
+        self.assertEqual({item['product'].pk: item['quantity'] for item in cart}, {
+            self.products[0].pk: 2,
+            self.products[1].pk: 1,
+        })
+        self.assertEqual(UserCart.objects.filter(user=self.user).count(), 1)
+
+    def test_login_without_a_session_cart_keeps_the_user_cart(self):
+        self.log_in()
+        self.add(self.products[2])
+        self.client.post(reverse('logout'))
+
+        self.log_in()
+
+        self.assertEqual([item['product'].pk for item in self.get_cart()], [self.products[2].pk])
+
+
+class DatabaseStorageTests(CartTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+
+    def payload(self, product, quantity):
+        return build_payload(1, {product.pk: CartLine(product.pk, quantity, product.price)})
+
+    def test_first_write_updates_a_row_created_since_the_load(self):
+        storage = DatabaseCartStorage(self.user)
+        other = DatabaseCartStorage(self.user)
+        self.assertIsNone(storage.load())
+        self.assertIsNone(other.load())
+
+        other.save(self.payload(self.products[0], 1))
+        payload = self.payload(self.products[1], 2)
+        storage.save(payload)
+
+        cart = UserCart.objects.get(user=self.user)
+        self.assertEqual(cart.data, payload)
+        self.assertEqual(storage.cart.pk, cart.pk)
+
+    async def test_async_first_write_updates_a_row_created_since_the_load(self):
+        storage = DatabaseCartStorage(self.user)
+        self.assertIsNone(await storage.aload())
+
+        await UserCart.objects.acreate(user=self.user, data={})
+        payload = self.payload(self.products[1], 2)
+        await storage.asave(payload)
+
+        cart = await UserCart.objects.aget(user=self.user)
+        self.assertEqual(cart.data, payload)
+        self.assertEqual(storage.cart.pk, cart.pk)
+
+
+class FragmentETagTests(CartTestMixin, TestCase):
+    views = ('hx_menu_cart', 'hx_cart_total')
+
+    def fetch(self, name, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse('cart:%s' % name), headers=headers)
+
+    def test_unchanged_cart_answers_304(self):
+        self.add(self.products[0])
+
+        for name in self.views:
+            with self.subTest(name):
+                response = self.fetch(name)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('no-cache', response['Cache-Control'])
+
+                revalidated = self.fetch(name, response['ETag'])
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertEqual(revalidated.content, b'')
+
+    def test_cart_change_changes_the_etag(self):
+        self.add(self.products[0])
+        etags = {name: self.fetch(name)['ETag'] for name in self.views}
+
+        self.update(self.products[0].pk, 'increment')
+
+        for name in self.views:
+            with self.subTest(name):
+                response = self.fetch(name, etags[name])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etags[name])
+
+    def test_catalog_change_changes_the_etag(self):
+        self.add(self.products[0])
+        etags = {name: self.fetch(name)['ETag'] for name in self.views}
+
+        catalog.bump_version()
+
+        for name in self.views:
+            with self.subTest(name):
+                self.assertEqual(self.fetch(name, etags[name]).status_code, 200)
+
+
+class AsyncFragmentETagTests(FragmentETagTests):
+    """
+    Runs the same checks against the async partials, routed when ASYNC_VIEWS is on.
+    """
+
+    def fetch(self, name, etag=None):
+        pattern = next(pattern for pattern in urls.urlpatterns if pattern.name == name)
+        view = {'hx_menu_cart': ahx_menu_cart, 'hx_cart_total': ahx_cart_total}[name]
 
-# Create your tests here.
+        with mock.patch.object(pattern, 'callback', view):
+            return super().fetch(name, etag)
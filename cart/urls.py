@@ -1,7 +1,13 @@
 # cart/urls.py
+from django.conf import settings
 from django.urls import path
 from .views import cart, checkout, add_to_cart, hx_menu_cart, update_cart, hx_cart_total, success
 
+if settings.ASYNC_VIEWS:
+    # Served by an ASGI server, the HTMX endpoints run as async views.
+    from .views import aadd_to_cart as add_to_cart, ahx_menu_cart as hx_menu_cart
+    from .views import aupdate_cart as update_cart, ahx_cart_total as hx_cart_total
+
 app_name = 'cart'
 
 urlpatterns = [
@@ -1,15 +1,52 @@
 from django.conf import settings
-from django.contrib.auth.decorators import login_required
-from django.shortcuts import render, get_object_or_404
-from .cart import Cart
+from django.core.cache import cache
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from core import metrics
+
+from .cart import aget_cart, get_cart
 from product.models import Product
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+
+
+def cart_etag(request, *args, **kwargs):
+    """
+    Returns the ETag of the cart partials: it changes whenever the cart or the catalog changes.
+    """
+    return get_cart(request).get_etag()
+
+
+def render_cart_fragment(request, template_name, etag=None):
+    """
+    Renders a cart partial, reusing the HTML rendered for the same cart version.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        template_name (str): The partial to render.
+        etag (str, optional): The ETag of the cart, when the caller already has it.
+
+    Returns:
+        HttpResponse: The rendered partial.
+    """
+    key = 'cart-fragment:%s:%s' % (template_name, etag or get_cart(request).get_etag())
+    html = cache.get(key)
+    metrics.record_cache(html is not None)
+
+    if html is None:
+        html = render_to_string(template_name, request=request)
+        cache.set(key, html, settings.CART_FRAGMENT_CACHE_TIMEOUT)
+
+    return HttpResponse(html)
 
 
 # This function handles the adding of products to the cart
 # It takes in the HTTP request and the product ID as parameters
-# It initializes a new instance of the Cart class with the request object
+# It retrieves the Cart for this request
 # It then calls the add method of the cart object, passing in the product ID
 # Finally, it renders the 'cart/partials/menu_cart.html' template and returns the response
 def add_to_cart(request, product_id):
@@ -23,8 +60,8 @@ def add_to_cart(request, product_id):
     Returns:
         HttpResponse: The rendered 'cart/partials/menu_cart.html' template.
     """
-    # Initialize a new instance of the Cart class with the request object
-    cart = Cart(request)
+    # Retrieve the Cart for this request
+    cart = get_cart(request)
 
     # Call the add method of the cart object, passing in the product ID
     cart.add(product_id)
@@ -68,11 +105,10 @@ def success(request):
 
 # This function handles the updating of the cart
 # It takes in the HTTP request, the product ID, and the action as parameters
-# It initializes a new instance of the Cart class with the request object
+# It retrieves the Cart for this request
 # It then checks the action parameter and calls the add method of the cart object accordingly
-# It retrieves the product object with the given product ID
 # It retrieves the quantity of the product in the cart
-# If the quantity is not None, it creates a dictionary with the product information and the quantity
+# If the quantity is not None, it retrieves the product from the cart and creates a dictionary with the product and the quantity
 # Finally, it renders the 'cart/partials/cart_item.html' template with the item dictionary as context and returns the response
 def update_cart(request, product_id, action):
     """
@@ -88,46 +124,17 @@ def update_cart(request, product_id, action):
         JsonResponse: An error response if the action is invalid, the product does not exist, or an exception occurs.
     """
     try:
-        # Initialize a new instance of the Cart class with the request object
-        cart = Cart(request)
+        # Retrieve the Cart for this request
+        cart = get_cart(request)
 
         # Check the action parameter and call the add method of the cart object accordingly
-        if action == 'increment':
-            cart.add(product_id, 1, True)
-        elif action == 'decrement':
-            cart.add(product_id, -1, True)
-        else:
+        if not apply_action(cart, product_id, action):
             return JsonResponse({'error': 'Invalid action'}, status=400)
 
-        # Retrieve the product object with the given product ID
-        product = get_object_or_404(Product, pk=product_id)
-
-        # Retrieve the quantity of the product in the cart
-        quantity = cart.get_item(product_id)
-
-        if quantity:
-            quantity = quantity['quantity']
-
-            # Create a dictionary with the product information and the quantity
-            item = {
-                'product': {
-                    'id': product.id,
-                    'name': product.name,
-                    'slug': product.slug,
-                    'image': product.image.url,
-                    'get_thumbnail': product.get_thumbnail(),
-                    'price': product.price,
-                },
-                'total_price': product.price * quantity,
-                'quantity': quantity
-            }
-        else:
-            item = None
-
-        # Render the 'cart/partials/cart_item.html' template with the item dictionary as context and return the response
-        response = render(request, 'cart/partials/cart_item.html', {'item': item})
-        response['HX-Trigger'] = 'update-menu-cart' 
-        return response
+        # Load the products with the cart's batched product lookup
+        cart.get_products()
+
+        return render_cart_item(request, cart, product_id)
 
     except Product.DoesNotExist:
         return JsonResponse({'error': 'Product does not exist'}, status=404)
@@ -135,6 +142,61 @@ def update_cart(request, product_id, action):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def apply_action(cart, product_id, action):
+    """
+    Applies an update_cart action to the cart.
+
+    Returns:
+        bool: False if the action is invalid.
+    """
+    if action == 'increment':
+        cart.add(product_id, 1, True)
+    elif action == 'decrement':
+        cart.add(product_id, -1, True)
+    else:
+        return False
+
+    return True
+
+
+def render_cart_item(request, cart, product_id):
+    """
+    Renders the 'cart/partials/cart_item.html' partial of a cart line, once the products of
+    the cart are loaded, and tells the page to refresh the menu cart.
+
+    Raises:
+        Product.DoesNotExist: If the product does not exist: the batched lookup dropped its line.
+    """
+    if int(product_id) in cart.missing:
+        raise Product.DoesNotExist
+
+    # Retrieve the quantity of the product in the cart
+    line = cart.get_item(product_id)
+
+    if line:
+        quantity = line.quantity
+
+        # Retrieve the product object from the cart's batched product lookup
+        product = cart.get_product(product_id)
+
+        if product is None:
+            raise Product.DoesNotExist
+
+        # Create a dictionary with the product and the quantity
+        item = {
+            'product': product,
+            'total_price': product.price * quantity,
+            'quantity': quantity
+        }
+    else:
+        item = None
+
+    # Render the 'cart/partials/cart_item.html' template with the item dictionary as context and return the response
+    response = render(request, 'cart/partials/cart_item.html', {'item': item})
+    response['HX-Trigger'] = 'update-menu-cart'
+    return response
+
+
 # This function handles the rendering of the checkout page
 # It takes in the HTTP request as a parameter
 # It retrieves
@@ -151,6 +213,11 @@ def checkout(request):
     return render(request, 'cart/checkout.html')
 
 
+# The cart partials carry an ETag derived from the cart version: browsers revalidate them on every
+# request (no-cache) and get a 304 while the cart has not changed. Rendered partials are cached per
+# cart version as well.
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=cart_etag)
 def hx_menu_cart(request):
     """
     Handles the rendering of the menu cart.
@@ -159,11 +226,13 @@ def hx_menu_cart(request):
         request (HttpRequest): The HTTP request object.
 
     Returns:
-        HttpResponse: The rendered 'cart/partials/menu_cart.html' template.
+        HttpResponse: The rendered 'cart/partials/menu_cart.html' template, or a 304 if the cart has not changed.
     """
-    return render(request, 'cart/partials/menu_cart.html')
+    return render_cart_fragment(request, 'cart/partials/menu_cart.html')
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=cart_etag)
 def hx_cart_total(request):
     """
     Handles the rendering of the cart total.
@@ -172,6 +241,73 @@ def hx_cart_total(request):
         request (HttpRequest): The HTTP request object.
 
     Returns:
-        HttpResponse: The rendered 'cart/partials/cart_total.html' template.
+        HttpResponse: The rendered 'cart/partials/cart_total.html' template, or a 304 if the cart has not changed.
+    """
+    return render_cart_fragment(request, 'cart/partials/cart_total.html')
+
+
+# Async versions of the HTMX cart endpoints, routed instead of the sync ones when ASYNC_VIEWS is
+# on (see cart/urls.py). They load the cart with the async session and ORM APIs and prepare
+# everything the templates need before rendering them.
+async def aadd_to_cart(request, product_id):
+    """
+    The async version of add_to_cart.
+    """
+    cart = await aget_cart(request)
+    cart.add(product_id)
+    return render(request, 'cart/partials/menu_cart.html')
+
+
+async def aupdate_cart(request, product_id, action):
+    """
+    The async version of update_cart.
+    """
+    try:
+        cart = await aget_cart(request)
+
+        if not apply_action(cart, product_id, action):
+            return JsonResponse({'error': 'Invalid action'}, status=400)
+
+        await cart.aget_products()
+
+        return render_cart_item(request, cart, product_id)
+
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'Product does not exist'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+async def render_conditional_fragment(request, template_name):
+    """
+    Renders a cart partial with its ETag, or answers 304 when the browser already has it.
+    This is what @condition(etag_func=cart_etag) does for the sync views, which cannot compute
+    the tag of an async view.
+    """
+    cart = await aget_cart(request)
+    etag = await cart.aget_etag()
+    response = get_conditional_response(request, etag=quote_etag(etag))
+
+    if response is None:
+        response = render_cart_fragment(request, template_name, etag)
+
+        if request.method in ('GET', 'HEAD'):
+            response.headers.setdefault('ETag', quote_etag(etag))
+
+    return response
+
+
+@cache_control(private=True, no_cache=True)
+async def ahx_menu_cart(request):
+    """
+    The async version of hx_menu_cart.
+    """
+    return await render_conditional_fragment(request, 'cart/partials/menu_cart.html')
+
+
+@cache_control(private=True, no_cache=True)
+async def ahx_cart_total(request):
+    """
+    The async version of hx_cart_total.
     """
-    return render(request, 'cart/partials/cart_total.html')
\ No newline at end of file
+    return await render_conditional_fragment(request, 'cart/partials/cart_total.html')
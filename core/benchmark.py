@@ -0,0 +1,429 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+import django
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import metrics
+from product import search
+from product.models import Category, Product, Review
+from product.facets import rebuild_counts
+from product.ratings import rebuild_aggregates
+
+
+WORDS = (
+    'laptop', 'phone', 'tablet', 'monitor', 'keyboard', 'mouse', 'headset', 'speaker', 'camera',
+    'charger', 'cable', 'router', 'printer', 'drive', 'watch', 'console', 'controller', 'adapter',
+    'wireless', 'portable', 'gaming', 'mechanical', 'ultra', 'compact', 'pro', 'mini', 'smart',
+)
+
+CHECKOUT_DATA = {
+    'first_name': 'Bench',
+    'last_name': 'Mark',
+    'email': 'bench@example.com',
+    'phone': '000',
+    'address': 'Street 1',
+    'zipcode': '0000',
+    'city': 'City',
+}
+
+
+def seed_catalog(categories=10, products=500, users=20, reviews_per_product=3, seed=0):
+    """
+    Fills the database with a synthetic catalog: categories, products with searchable names
+    and descriptions, users and their reviews. Everything is written with bulk_create, so no
+    signals fire; the rating aggregates, the facet counts and the search index are rebuilt
+    afterwards.
+
+    Args:
+        categories (int, optional): Number of categories.
+        products (int, optional): Number of products, spread over the categories.
+        users (int, optional): Number of users writing reviews.
+        reviews_per_product (int, optional): Maximum number of reviews per product.
+        seed (int, optional): Seed of the random generator, the same seed gives the same catalog.
+
+    Returns:
+        dict: The slugs of the categories and products and the words used in the product names.
+    """
+    rng = random.Random(seed)
+
+    Category.objects.bulk_create([
+        Category(name='Category %d' % i, slug='category-%d' % i) for i in range(categories)
+    ])
+    category_list = list(Category.objects.order_by('pk'))
+
+    Product.objects.bulk_create([
+        Product(
+            category=category_list[i % categories],
+            name='%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), i),
+            slug='product-%d' % i,
+            description=' '.join(rng.choice(WORDS) for _ in range(20)),
+            price=rng.randint(5, 2000),
+        )
+        for i in range(products)
+    ], batch_size=500)
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+
+    User.objects.bulk_create([User(username='bench-%d' % i) for i in range(users)])
+    user_ids = list(User.objects.filter(username__startswith='bench-').values_list('pk', flat=True))
+
+    Review.objects.bulk_create([
+        Review(product_id=product_id, created_by_id=user_id, rating=rng.randint(1, 5), content='Benchmark review')
+        for product_id in product_ids
+        for user_id in rng.sample(user_ids, min(len(user_ids), rng.randint(0, reviews_per_product)))
+    ], batch_size=500)
+
+    rebuild_aggregates()
+    rebuild_counts()
+    search.get_backend().index(Product.objects.all())
+
+    return {
+        'categories': [category.slug for category in category_list],
+        'products': list(Product.objects.values_list('slug', flat=True)),
+        'product_ids': product_ids,
+        'words': WORDS,
+    }
+
+
+class Flow(object):
+    """
+    A storefront flow to benchmark.
+
+    `requests` returns the requests of one iteration as (method, path, options) tuples, which
+    the runners send with the test client or the async test client. `prepare` returns requests
+    sent before each iteration and not timed (checkout uses it to fill the cart). Both get the
+    seeded catalog and a random generator.
+    """
+    name = None
+
+    def prepare(self, catalog, rng):
+        return []
+
+    def requests(self, catalog, rng):
+        raise NotImplementedError
+
+
+class FrontpageFlow(Flow):
+    name = 'frontpage'
+
+    def requests(self, catalog, rng):
+        return [('get', reverse('frontpage'), {})]
+
+
+class ShopFlow(Flow):
+    name = 'shop'
+
+    def requests(self, catalog, rng):
+        return [('get', reverse('shop'), {})]
+
+
+class ShopFilterFlow(Flow):
+    name = 'shop_filter'
+
+    def requests(self, catalog, rng):
+        params = {'category': rng.choice(catalog['categories'])}
+
+        if rng.random() < 0.5:
+            params['sort'] = 'rating'
+
+        return [('get', reverse('shop'), {'data': params})]
+
+
+class ShopSearchFlow(Flow):
+    name = 'shop_search'
+
+    def requests(self, catalog, rng):
+        return [('get', reverse('shop'), {'data': {'query': rng.choice(catalog['words'])}})]
+
+
+class ProductFlow(Flow):
+    name = 'product'
+
+    def requests(self, catalog, rng):
+        return [('get', reverse('product', args=[rng.choice(catalog['products'])]), {})]
+
+
+class CartFlow(Flow):
+    """
+    The HTMX cart loop: add a product, increment it, then refresh the menu cart and the total.
+    """
+    name = 'cart'
+
+    def requests(self, catalog, rng):
+        product_id = rng.choice(catalog['product_ids'])
+        htmx = {'headers': {'HX-Request': 'true'}}
+
+        return [
+            ('get', reverse('cart:add_to_cart', args=[product_id]), htmx),
+            ('get', reverse('cart:update_cart', args=[product_id, 'increment']), htmx),
+            ('get', reverse('cart:hx_menu_cart'), htmx),
+            ('get', reverse('cart:hx_cart_total'), htmx),
+        ]
+
+
+class CheckoutFlow(Flow):
+    """
+    Places an order for a cart of a few products against the configured payment gateway.
+    """
+    name = 'checkout'
+
+    def prepare(self, catalog, rng):
+        return [('get', reverse('cart:add_to_cart', args=[product_id]), {}) for product_id in rng.sample(catalog['product_ids'], 3)]
+
+    def requests(self, catalog, rng):
+        return [('post', reverse('start_order'), {'data': json.dumps(CHECKOUT_DATA), 'content_type': 'application/json'})]
+
+
+FLOWS = [FrontpageFlow, ShopFlow, ShopFilterFlow, ShopSearchFlow, ProductFlow, CartFlow, CheckoutFlow]
+
+
+def send(client, requests):
+    """
+    Sends requests with the test client and checks that none of them failed.
+
+    Returns:
+        list: The responses.
+    """
+    responses = [getattr(client, method)(path, **options) for method, path, options in requests]
+    check_responses(responses)
+    return responses
+
+
+async def asend(client, requests):
+    """
+    Sends requests, one after the other, with the async test client and checks that none of them failed.
+    """
+    responses = []
+    for method, path, options in requests:
+        responses.append(await getattr(client, method)(path, **options))
+    check_responses(responses)
+    return responses
+
+
+def check_responses(responses):
+    for response in responses:
+        if response.status_code >= 400:
+            raise RuntimeError('%s returned %d' % (response.request['PATH_INFO'], response.status_code))
+
+
+def summarize(durations, queries, requests, elapsed=None):
+    """
+    Computes the throughput, latency percentiles and query counts of a flow.
+
+    Args:
+        durations (list): The duration of each iteration, in seconds.
+        queries (list): The number of queries of each iteration, or their mean when the
+            iterations ran concurrently and could not be told apart.
+        requests (int): The number of requests made by all the iterations.
+        elapsed (float, optional): The wall clock time of the run, when the iterations ran
+            concurrently. Defaults to the sum of the durations.
+
+    Returns:
+        dict: The statistics of the flow, latencies in milliseconds.
+    """
+    total = elapsed or sum(durations)
+
+    if len(durations) > 1:
+        cuts = statistics.quantiles(durations, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = durations[0]
+
+    if not isinstance(queries, list):
+        queries_stats = {'mean': queries, 'max': None, 'total': queries * len(durations)}
+    else:
+        queries_stats = {'mean': statistics.mean(queries), 'max': max(queries), 'total': sum(queries)}
+
+    return {
+        'iterations': len(durations),
+        'requests': requests,
+        'throughput': len(durations) / total if total else None,
+        'requests_per_second': requests / total if total else None,
+        'latency_ms': {
+            'mean': statistics.mean(durations) * 1000,
+            'p50': p50 * 1000,
+            'p95': p95 * 1000,
+            'p99': p99 * 1000,
+            'max': max(durations) * 1000,
+        },
+        'queries': queries_stats,
+    }
+
+
+def run_flow(flow, catalog, iterations=100, warmup=5, seed=0):
+    """
+    Runs a flow with its own client (and so its own session and cart) and measures it, the
+    way one WSGI worker thread serves requests: one at a time.
+
+    Args:
+        flow (Flow): The flow to run.
+        catalog (dict): The seeded catalog, see seed_catalog.
+        iterations (int, optional): Number of measured iterations.
+        warmup (int, optional): Number of iterations run first and not measured.
+        seed (int, optional): Seed of the random generator picking products and filters.
+
+    Returns:
+        dict: The statistics of the flow, see summarize.
+    """
+    client = Client()
+    rng = random.Random(seed)
+    durations = []
+    queries = []
+    requests = 0
+    page_cache_hits = 0
+
+    for i in range(warmup + iterations):
+        send(client, flow.prepare(catalog, rng))
+        iteration = flow.requests(catalog, rng)
+
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            responses = send(client, iteration)
+            duration = time.perf_counter() - start
+
+        if i < warmup:
+            continue
+
+        durations.append(duration)
+        queries.append(len(context.captured_queries))
+        requests += len(responses)
+        page_cache_hits += sum(1 for response in responses if response.get('X-Page-Cache') == 'hit')
+
+    stats = summarize(durations, queries, requests)
+    stats['page_cache_hits'] = page_cache_hits
+    return stats
+
+
+async def arun_flow(flow, catalog, iterations=100, warmup=5, seed=0, concurrency=10):
+    """
+    Runs a flow through the ASGI handler, the way one ASGI worker serves requests: `concurrency`
+    virtual users, each with its own async client and session, send their iterations at the
+    same time on one event loop.
+
+    The queries of concurrent requests cannot be told apart, so the mean per iteration is
+    taken from the request metrics (core/metrics.py) and includes the `prepare` requests. The
+    throughput is measured over the wall clock time, which includes the untimed `prepare`
+    requests too: it is a lower bound.
+
+    Returns:
+        dict: The statistics of the flow, see summarize.
+    """
+    durations = []
+    counts = {'requests': 0, 'page_cache_hits': 0}
+
+    async def user(index, count, measured):
+        client = AsyncClient()
+        rng = random.Random('%s-%d' % (seed, index))
+
+        for _ in range(count):
+            await asend(client, flow.prepare(catalog, rng))
+            iteration = flow.requests(catalog, rng)
+
+            start = time.perf_counter()
+            responses = await asend(client, iteration)
+            duration = time.perf_counter() - start
+
+            if measured:
+                durations.append(duration)
+                counts['requests'] += len(responses)
+                counts['page_cache_hits'] += sum(1 for response in responses if response.get('X-Page-Cache') == 'hit')
+
+    await asyncio.gather(*[user(i, 1, False) for i in range(min(warmup, concurrency))])
+
+    per_user = [iterations // concurrency + (1 if i < iterations % concurrency else 0) for i in range(concurrency)]
+    queries_before = total_queries()
+    start = time.perf_counter()
+    await asyncio.gather(*[user(i, count, True) for i, count in enumerate(per_user) if count])
+    elapsed = time.perf_counter() - start
+    queries = (total_queries() - queries_before) / len(durations)
+
+    stats = summarize(durations, queries, counts['requests'], elapsed)
+    stats['page_cache_hits'] = counts['page_cache_hits']
+    stats['concurrency'] = concurrency
+    return stats
+
+
+def total_queries():
+    """
+    Returns the number of queries recorded by the request metrics of this process so far.
+    """
+    with metrics.registry.lock:
+        return sum(
+            histogram.sum for (name, view), histogram in metrics.registry.histograms.items()
+            if name == 'bytex_db_queries'
+        )
+
+
+def run_benchmark(flows=None, iterations=100, warmup=5, seed=0, asgi=False, concurrency=10, **seed_options):
+    """
+    Seeds a synthetic catalog in the current database and runs the storefront flows against it.
+
+    The caller is responsible for pointing the connection at a throwaway database and for
+    configuring a stub payment gateway; see the benchmark management command.
+
+    Args:
+        flows (list, optional): Names of the flows to run. Defaults to every flow.
+        iterations (int, optional): Number of measured iterations per flow.
+        warmup (int, optional): Number of unmeasured iterations per flow.
+        seed (int, optional): Seed of the catalog and of the flows.
+        asgi (bool, optional): Run the flows concurrently through the ASGI handler (arun_flow).
+        concurrency (int, optional): Number of concurrent virtual users in ASGI mode.
+        **seed_options: Passed to seed_catalog (categories, products, users, reviews_per_product).
+
+    Returns:
+        dict: The environment of the run and the statistics of each flow.
+    """
+    cache.clear()
+    catalog = seed_catalog(seed=seed, **seed_options)
+
+    results = {}
+    for flow_class in FLOWS:
+        if flows and flow_class.name not in flows:
+            continue
+        if asgi:
+            results[flow_class.name] = async_to_sync(arun_flow)(
+                flow_class(), catalog, iterations=iterations, warmup=warmup, seed=seed, concurrency=concurrency,
+            )
+        else:
+            results[flow_class.name] = run_flow(flow_class(), catalog, iterations=iterations, warmup=warmup, seed=seed)
+
+    return {
+        'environment': environment(),
+        'options': dict(
+            seed_options, iterations=iterations, warmup=warmup, seed=seed,
+            mode='asgi' if asgi else 'wsgi', concurrency=concurrency if asgi else 1,
+        ),
+        'flows': results,
+    }
+
+
+def environment():
+    """
+    Describes where the benchmark ran, so that results from different commits can be compared.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+    }
@@ -0,0 +1,116 @@
+import re
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+TRANSACTION_CONTROL = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT|BEGIN|COMMIT)\b', re.IGNORECASE)
+
+
+class BudgetExceeded(AssertionError):
+    """
+    Raised when a view runs more queries or takes longer than its budget allows.
+    """
+
+
+class Budget(object):
+    """
+    The query and latency budget of a view.
+
+    The query budget is a fixed number: a view must not run more queries for a bigger catalog
+    or a fuller cart. The latency budget is a base in milliseconds plus an allowance per
+    product in the catalog and per line in the cart, since rendering more rows legitimately
+    takes longer.
+
+    Args:
+        queries (int): The maximum number of SQL queries.
+        latency_ms (float): The latency budget for an empty catalog and cart, in milliseconds.
+        per_product_ms (float, optional): The latency allowance per product in the catalog.
+        per_cart_item_ms (float, optional): The latency allowance per line in the cart.
+    """
+
+    def __init__(self, queries, latency_ms, per_product_ms=0, per_cart_item_ms=0):
+        self.queries = queries
+        self.latency_ms = latency_ms
+        self.per_product_ms = per_product_ms
+        self.per_cart_item_ms = per_cart_item_ms
+
+    def max_latency_ms(self, products=0, cart_items=0):
+        latency = self.latency_ms + self.per_product_ms * products + self.per_cart_item_ms * cart_items
+        # Slow machines (CI runners, coverage) can scale every latency budget at once.
+        return latency * getattr(settings, 'BUDGET_LATENCY_FACTOR', 1)
+
+    def check(self, name, queries, latency_ms, products=0, cart_items=0):
+        """
+        Compares a measurement with the budget.
+
+        Raises:
+            BudgetExceeded: If the view ran too many queries or took too long.
+        """
+        errors = []
+        # Savepoints are transaction bookkeeping (and appear only inside test transactions).
+        queries = [query for query in queries if not TRANSACTION_CONTROL.match(query['sql'])]
+
+        if len(queries) > self.queries:
+            errors.append('%d queries, budget %d:\n    %s' % (
+                len(queries), self.queries, '\n    '.join(query['sql'] for query in queries),
+            ))
+
+        max_latency = self.max_latency_ms(products, cart_items)
+        if latency_ms > max_latency:
+            errors.append('%.1f ms, budget %.1f ms' % (latency_ms, max_latency))
+
+        if errors:
+            raise BudgetExceeded('%s is over budget (%d products, %d cart items): %s' % (
+                name, products, cart_items, '; '.join(errors),
+            ))
+
+
+# The budgets of the hot views, by URL name. The query budgets are for a cold cache: the page
+# and catalog caches only make things cheaper.
+BUDGETS = {
+    'frontpage': Budget(queries=2, latency_ms=100),
+    # A search adds the grouped query of its facet counts (product/facets.py).
+    'shop': Budget(queries=5, latency_ms=150),
+    # The product and cart pages read their "frequently bought together" products (order/recommendations.py).
+    'product': Budget(queries=3, latency_ms=100),
+    'cart:cart': Budget(queries=4, latency_ms=100, per_cart_item_ms=2),
+    'cart:add_to_cart': Budget(queries=2, latency_ms=50),
+    'cart:update_cart': Budget(queries=3, latency_ms=50),
+    'cart:hx_menu_cart': Budget(queries=3, latency_ms=50),
+    'cart:hx_cart_total': Budget(queries=3, latency_ms=50),
+    # The order is written before the payment session exists, which is stored by a second UPDATE.
+    'start_order': Budget(queries=6, latency_ms=150, per_cart_item_ms=1),
+    'myaccount': Budget(queries=5, latency_ms=150),
+}
+
+
+@contextmanager
+def enforce(name, products=0, cart_items=0, using=None):
+    """
+    Measures the queries and the time of the enclosed block and fails if they are over the
+    budget of the given view.
+
+        with budgets.enforce('shop', products=100):
+            self.client.get(reverse('shop'))
+
+    Args:
+        name (str): The URL name of the view, a key of BUDGETS.
+        products (int, optional): The number of products in the catalog.
+        cart_items (int, optional): The number of lines in the cart.
+        using (BaseDatabaseWrapper, optional): The connection to watch. Defaults to the default one.
+
+    Raises:
+        BudgetExceeded: If the block is over budget.
+    """
+    budget = BUDGETS[name]
+
+    with CaptureQueriesContext(using or connection) as context:
+        start = time.perf_counter()
+        yield context
+        latency_ms = (time.perf_counter() - start) * 1000
+
+    budget.check(name, context.captured_queries, latency_ms, products, cart_items)
@@ -0,0 +1,92 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from product import catalog
+
+from . import metrics
+
+
+def page_cache_key(request, vary_on):
+    """
+    Builds the cache key of a page: the catalog version, the full path and the request headers
+    the page varies on. The Cookie header is deliberately left out: cached pages are only
+    served to anonymous visitors, and their per-session parts are loaded separately.
+    """
+    parts = [request.get_full_path()] + [request.headers.get(header, '') for header in vary_on]
+    digest = hashlib.md5('\n'.join(parts).encode()).hexdigest()
+    return 'page:%s:%s' % (catalog.get_version(), digest)
+
+
+def has_private_cookies(request):
+    """
+    Tells whether a request carries a session or a CSRF cookie, whose state could end up in
+    the rendered page.
+    """
+    return settings.SESSION_COOKIE_NAME in request.COOKIES or settings.CSRF_COOKIE_NAME in request.COOKIES
+
+
+def cache_anonymous_page(view=None, vary_on=('HX-Request',)):
+    """
+    Caches the HTML of a catalog page for anonymous visitors.
+
+    The page is rendered with `request.cart_placeholder` set, which makes core/base.html leave
+    the per-session menu cart out of the HTML and load it through HTMX (hx_menu_cart) instead,
+    so a single cached copy can be served to every anonymous visitor. Signed-in users and
+    non-GET requests bypass the cache. Entries are keyed by the catalog version, so any product
+    or category change invalidates them. Only pages rendered for cookieless visitors are
+    stored: the session or the CSRF cookie of a visitor never shapes the shared copy, though
+    these visitors are still served it. Responses that set cookies or use the CSRF token are
+    never cached.
+
+    Args:
+        view (callable): The view to decorate.
+        vary_on (tuple, optional): Request headers that change the response (besides the path).
+
+    Returns:
+        callable: The decorated view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            request.cart_placeholder = True
+            key = page_cache_key(request, vary_on)
+            cached = cache.get(key)
+
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Page-Cache'] = 'hit'
+                metrics.record_cache(True)
+            else:
+                response = view(request, *args, **kwargs)
+
+                if (
+                    response.status_code == 200
+                    and not has_private_cookies(request)
+                    and not response.streaming
+                    and not response.cookies
+                    and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+                ):
+                    cache.set(key, (response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+
+                response['X-Page-Cache'] = 'miss'
+                metrics.record_cache(False)
+
+            # Signed-in users get different HTML for the same URL.
+            patch_vary_headers(response, ('Cookie',) + tuple(vary_on))
+            return response
+
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+
+    return decorator
@@ -0,0 +1,99 @@
+import importlib
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import clear_url_caches
+
+import cart.urls
+import order.urls
+from core.benchmark import FLOWS, run_benchmark
+from order import payments
+from product import search
+
+
+def reload_urlconf():
+    """
+    Rebuilds the URL patterns, which pick the sync or async views from ASYNC_VIEWS when they
+    are imported.
+    """
+    for module in (cart.urls, order.urls, importlib.import_module(settings.ROOT_URLCONF)):
+        importlib.reload(module)
+
+    clear_url_caches()
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a synthetic catalog in a throwaway test database and benchmarks the storefront flows '
+        'through the real views, against the stub payment gateway.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flow', action='append', dest='flows', choices=[flow.name for flow in FLOWS],
+                            help='Flow to run, may be repeated. Defaults to every flow.')
+        parser.add_argument('--iterations', type=int, default=100, help='Measured iterations per flow.')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured iterations run first per flow.')
+        parser.add_argument('--products', type=int, default=500, help='Number of products to seed.')
+        parser.add_argument('--categories', type=int, default=10, help='Number of categories to seed.')
+        parser.add_argument('--users', type=int, default=20, help='Number of reviewing users to seed.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the catalog and of the flows.')
+        parser.add_argument('--output', default='benchmark.json', help='Where to write the results as JSON.')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Serve the flows through the ASGI handler, with the async views, concurrently.')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent virtual users in ASGI mode.')
+        parser.add_argument('--gateway-latency', type=float, default=0,
+                            help='Seconds the stub payment gateway takes to answer, like the real one would.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        # The gateway and the search backend are created once per process; start from fresh ones.
+        payments._gateway = None
+        search._backend = None
+
+        try:
+            with override_settings(
+                PAYMENT_GATEWAY='order.payments.StubGateway',
+                PAYMENT_STUB_LATENCY=options['gateway_latency'],
+                ASYNC_VIEWS=options['asgi'],
+                # Only the request path is measured; background writers would also lock the in-memory test database.
+                RECOMMENDATIONS_ON_ORDER=False,
+            ):
+                reload_urlconf()
+                results = run_benchmark(
+                    flows=options['flows'],
+                    iterations=options['iterations'],
+                    warmup=options['warmup'],
+                    seed=options['seed'],
+                    asgi=options['asgi'],
+                    concurrency=options['concurrency'],
+                    categories=options['categories'],
+                    products=options['products'],
+                    users=options['users'],
+                )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        finally:
+            reload_urlconf()
+            payments._gateway = None
+            search._backend = None
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results['options']['gateway_latency'] = options['gateway_latency']
+
+        self.stdout.write('%-12s %9s %9s %9s %9s %9s' % ('flow', 'it/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for name, stats in results['flows'].items():
+            latency = stats['latency_ms']
+            self.stdout.write('%-12s %9.1f %9.2f %9.2f %9.2f %9.1f' % (
+                name, stats['throughput'], latency['p50'], latency['p95'], latency['p99'], stats['queries']['mean'],
+            ))
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.stdout.write(self.style.SUCCESS('Results written to %s' % options['output']))
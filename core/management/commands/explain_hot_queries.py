@@ -0,0 +1,97 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core.pagination import KeysetPaginator
+from order.models import Order, OrderItem
+from product.models import Category, Product, Review
+
+
+# Plan lines that mean a full table scan (or a sort of the whole result), per database vendor.
+FULL_SCAN_PATTERNS = {
+    'sqlite': [
+        # "SCAN product_product" reads the whole table, "SCAN ... USING INDEX" walks an index in order.
+        re.compile(r'\bSCAN (?!.*\bUSING (COVERING )?INDEX\b)(?!.*\bINTEGER PRIMARY KEY\b)'),
+        re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+    ],
+    'postgresql': [
+        re.compile(r'\bSeq Scan\b'),
+    ],
+    'mysql': [
+        re.compile(r'\btype\b\W+ALL\b|\bALL\b.*\bUsing filesort\b'),
+    ],
+}
+
+
+def hot_queries():
+    """
+    Builds the querysets behind the hot paths of the shop, the way the views build them.
+
+    The parameters are placeholders: the plans depend on the shape of the queries and the
+    available indexes, not on the values.
+
+    Returns:
+        list: (name, queryset) pairs.
+    """
+    latest = Product.objects.order_by('-created_at', '-id')
+    paginator = KeysetPaginator(Product.objects.all(), per_page=settings.SHOP_PAGE_SIZE)
+
+    return [
+        ('frontpage: latest products', Product.objects.all()[:8]),
+        ('shop: first page', latest[:settings.SHOP_PAGE_SIZE + 1]),
+        ('shop: next page', latest.filter(paginator.after([timezone.now(), 1]))[:settings.SHOP_PAGE_SIZE + 1]),
+        ('shop: category page', latest.filter(category__slug='category')[:settings.SHOP_PAGE_SIZE + 1]),
+        ('catalog: category by slug', Category.objects.filter(slug='category')),
+        ('product: product by slug', Product.objects.filter(slug='product')[:1]),
+        ('product: review of the user', Review.objects.filter(product_id=1, created_by_id=1)[:1]),
+        (
+            'myaccount: orders of the user',
+            Order.objects.filter(user_id=1).order_by('-created_at', '-id')[:settings.ORDERS_PAGE_SIZE + 1],
+        ),
+        ('myaccount: items of the orders', OrderItem.objects.filter(order_id__in=[1, 2]).select_related('product')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the hot queries of the shop and flags the ones that scan a whole table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any query scans a whole table.')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the plan of every query, not only the flagged ones.')
+
+    def handle(self, *args, **options):
+        patterns = FULL_SCAN_PATTERNS.get(connection.vendor, [])
+
+        if not patterns:
+            self.stdout.write(self.style.WARNING(
+                'No full scan patterns for the %s backend, the plans are printed unchecked.' % connection.vendor
+            ))
+
+        flagged = []
+
+        for name, queryset in hot_queries():
+            plan = queryset.explain()
+            scans = [line.strip() for line in plan.splitlines() if any(p.search(line) for p in patterns)]
+
+            if scans:
+                flagged.append(name)
+                self.stdout.write(self.style.ERROR('FULL SCAN  %s' % name))
+                for line in scans:
+                    self.stdout.write('    %s' % line)
+            else:
+                self.stdout.write(self.style.SUCCESS('ok         %s' % name))
+
+            if options['verbose_plans'] or (scans and options['verbosity'] > 1):
+                for line in plan.splitlines():
+                    self.stdout.write('        %s' % line)
+
+        if flagged:
+            message = '%d of the hot queries scan a whole table.' % len(flagged)
+            if options['fail']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every hot query uses an index.'))
@@ -0,0 +1,88 @@
+import glob
+import io
+import os
+import pstats
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Turns request profiling on or off in every running worker, without a redeploy, '
+        'and summarizes the profiles collected for a view.'
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        on = subparsers.add_parser('on', help='Start profiling requests.')
+        on.add_argument('--rate', type=float, default=0.01, help='Fraction of the requests to profile.')
+        on.add_argument('--format', choices=profiling.FORMATS, default='pstats',
+                        help='cProfile dumps, or sampled stacks for flame graphs.')
+        on.add_argument('--duration', type=int, default=600, help='Seconds before profiling turns itself off, 0 for never.')
+        on.add_argument('--no-header', action='store_true', help='Ignore the X-Profile request header.')
+
+        subparsers.add_parser('off', help='Stop profiling requests.')
+        subparsers.add_parser('status', help='Show the profiling configuration and the collected profiles.')
+
+        top = subparsers.add_parser('top', help='Print the hottest functions over the pstats profiles of a view.')
+        top.add_argument('view', help='The view name, e.g. shop or cart:update_cart.')
+        top.add_argument('--limit', type=int, default=25, help='Number of functions to print.')
+        top.add_argument('--sort', default='cumulative', help='pstats sort key.')
+
+    def handle(self, *args, **options):
+        getattr(self, 'handle_%s' % options['action'])(**options)
+
+    def handle_on(self, **options):
+        if not 0 <= options['rate'] <= 1:
+            raise CommandError('--rate must be between 0 and 1.')
+
+        profiling.enable(
+            sample_rate=options['rate'],
+            fmt=options['format'],
+            duration=options['duration'] or None,
+            header=not options['no_header'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Profiling %.1f%% of the requests (%s) into %s, within %d seconds.' % (
+                options['rate'] * 100, options['format'], profiling.get_profile_dir(), profiling.CONFIG_TTL,
+            )
+        ))
+
+    def handle_off(self, **options):
+        profiling.disable()
+        self.stdout.write(self.style.SUCCESS('Profiling turned off, within %d seconds.' % profiling.CONFIG_TTL))
+
+    def handle_status(self, **options):
+        config = profiling.get_config(refresh=True)
+
+        if config is None:
+            self.stdout.write('Profiling is off.')
+        else:
+            until = time.strftime('%H:%M:%S', time.localtime(config['until'])) if config['until'] else 'turned off'
+            self.stdout.write('Profiling %.1f%% of the requests (%s), header %s, until %s.' % (
+                config['sample_rate'] * 100, config['format'], 'on' if config['header'] else 'off', until,
+            ))
+
+        directory = profiling.get_profile_dir()
+        for view in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            if not os.path.isdir(os.path.join(directory, view)):
+                continue
+            self.stdout.write('  %-30s %d profiles' % (view, len(os.listdir(os.path.join(directory, view)))))
+
+    def handle_top(self, **options):
+        view = options['view'].replace(':', '_')
+        paths = glob.glob(os.path.join(profiling.get_profile_dir(), view, '*.prof'))
+
+        if not paths:
+            raise CommandError('No pstats profiles for %s.' % options['view'])
+
+        output = io.StringIO()
+        stats = pstats.Stats(*paths, stream=output)
+        stats.sort_stats(options['sort']).print_stats(options['limit'])
+
+        self.stdout.write('%d profiles of %s' % (len(paths), options['view']))
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,72 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.scale import ScaleSeeder
+from product import catalog
+from product.facets import rebuild_counts
+from product.models import Category
+from product.ratings import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with a large synthetic catalog and order history (categories, products, '
+        'users, reviews, orders and order items) with skewed distributions, reproducible from a seed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50, help='Number of categories.')
+        parser.add_argument('--products', type=int, default=100000, help='Number of products.')
+        parser.add_argument('--users', type=int, default=20000, help='Number of users.')
+        parser.add_argument('--reviews', type=int, default=500000, help='Approximate number of reviews.')
+        parser.add_argument('--orders', type=int, default=200000, help='Number of orders.')
+        parser.add_argument('--days', type=int, default=730, help='Length of the generated history, in days.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows written per query.')
+
+    def handle(self, *args, **options):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError('seed_scale needs a database whose bulk inserts return the primary keys (SQLite, PostgreSQL, MariaDB).')
+
+        if options['categories'] < 1 and options['products']:
+            raise CommandError('Products need at least one category.')
+
+        if Category.objects.filter(slug__startswith='scale-').exists():
+            raise CommandError('The database already holds generated data; seed an empty database so runs are reproducible.')
+
+        start = time.perf_counter()
+
+        def progress(name, count):
+            self.stdout.write('%9d %s (%.1f s)' % (count, name, time.perf_counter() - start))
+
+        seeder = ScaleSeeder(
+            categories=options['categories'],
+            products=options['products'],
+            users=options['users'],
+            reviews=options['reviews'],
+            orders=options['orders'],
+            days=options['days'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+        counts = seeder.run()
+
+        # bulk_create sends no signals: rebuild what they would have maintained.
+        rebuild_aggregates(batch_size=options['batch_size'])
+        call_command('rebuild_search_index', batch_size=options['batch_size'], stdout=self.stdout)
+        rebuild_counts()
+        catalog.bump_version()
+
+        # Refresh the planner statistics, so the query plans are the ones of a database this size.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(
+            'Generated %(categories)d categories, %(products)d products, %(users)d users, %(reviews)d reviews, '
+            '%(orders)d orders and %(order_items)d order items' % counts
+            + ' in %.1f s.' % (time.perf_counter() - start)
+        ))
@@ -0,0 +1,223 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+
+# Files whose name starts with a content hash (thumbnail variants, imported images) never
+# change: a new image gets a new name.
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{16}[-.][^/]*$')
+
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_immutable(path):
+    return bool(HASHED_NAME.search(path))
+
+
+def cache_control(path):
+    if is_immutable(path):
+        return 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+
+    return 'public, max-age=%d' % getattr(settings, 'MEDIA_MAX_AGE', 3600)
+
+
+def parse_range(header, size):
+    """
+    Parses a Range header against a file of the given size.
+
+    Only single ranges are supported: for anything else the whole file is sent, which the
+    HTTP spec allows.
+
+    Args:
+        header (str): The Range header, e.g. 'bytes=0-1023', 'bytes=1024-' or 'bytes=-512'.
+        size (int): The size of the file.
+
+    Returns:
+        tuple or None: The first and last byte positions, None to send the whole file.
+
+    Raises:
+        ValueError: If the range is not satisfiable.
+    """
+    match = RANGE.match(header.strip())
+
+    if match is None or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+
+    if first == '':
+        # A suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range.')
+        return max(0, size - length), size - 1
+
+    first = int(first)
+    last = size - 1 if last == '' else min(int(last), size - 1)
+
+    if first >= size or first > last:
+        raise ValueError('Range %s is outside of the file.' % header)
+
+    return first, last
+
+
+def range_applies(request, etag, last_modified):
+    """
+    Tells whether the Range header of a request applies: an If-Range precondition that does
+    not match the current file means the client's copy is stale and needs the whole file.
+    """
+    if_range = request.headers.get('If-Range')
+
+    if not if_range:
+        return True
+
+    if if_range.startswith('W/'):
+        # Weak validators never match for ranges.
+        return False
+
+    if if_range.startswith('"'):
+        return if_range == etag
+
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+class FileRange(object):
+    """
+    A file object limited to a byte range. It keeps the fileno() of the file, so servers whose
+    wsgi.file_wrapper uses os.sendfile() (gunicorn, uWSGI) still send the range from the
+    kernel: they start at the current offset and stop after Content-Length bytes.
+    """
+
+    def __init__(self, f, first, last):
+        self.file = f
+        self.name = f.name
+        self.remaining = last - first + 1
+        f.seek(first)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def offload(response, path, fullpath):
+    """
+    Hands the transfer of a file to the front-end server, as configured by MEDIA_SENDFILE:
+
+    - 'x-accel-redirect' (nginx): the file is served from the internal location
+      MEDIA_ACCEL_PREFIX, which must alias MEDIA_ROOT;
+    - 'x-sendfile' (Apache mod_xsendfile, lighttpd): the file is served from its absolute path.
+
+    The front-end server then handles the ranges and sends the bytes without a Python worker.
+
+    Returns:
+        bool: Whether the transfer was offloaded.
+    """
+    backend = getattr(settings, 'MEDIA_SENDFILE', None)
+
+    if backend == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/internal-media/') + path
+    elif backend == 'x-sendfile':
+        response['X-Sendfile'] = fullpath
+    elif backend:
+        raise ValueError('Unknown MEDIA_SENDFILE backend %r.' % backend)
+    else:
+        return False
+
+    return True
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serves a file of MEDIA_ROOT, replacing django.views.static.serve.
+
+    Responses carry an ETag and a Last-Modified date, so revalidations get a 304 without any
+    file being read, and a Cache-Control header: content-hashed files are cached for a year as
+    immutable, the others for MEDIA_MAX_AGE seconds. Single byte ranges are answered with a
+    206. The bytes are sent by the front-end server when MEDIA_SENDFILE is set, and otherwise
+    by a FileResponse, which WSGI servers pass to os.sendfile().
+
+    Args:
+        request (HttpRequest): The current HTTP request.
+        path (str): The path of the file, relative to MEDIA_ROOT.
+
+    Returns:
+        HttpResponse: The file, a 206 with a part of it, a 304, a 412 or a 416.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('%s does not exist' % path)
+
+    if not os.path.isfile(fullpath):
+        raise Http404('%s does not exist' % path)
+
+    size = stat.st_size
+    last_modified = stat.st_mtime
+    etag = quote_etag('%x-%x' % (stat.st_mtime_ns, size))
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['Content-Length'] = size
+        return response
+
+    response = HttpResponse(content_type=content_type, headers=headers)
+    if offload(response, path, fullpath):
+        return response
+
+    byte_range = None
+    if 'Range' in request.headers and range_applies(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    f = open(fullpath, 'rb')
+
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type, headers=headers)
+    else:
+        first, last = byte_range
+        response = FileResponse(FileRange(f, first, last), content_type=content_type, status=206, headers=headers)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+        response['Content-Length'] = last - first + 1
+
+    return response
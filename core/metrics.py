@@ -0,0 +1,241 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+
+# Upper bounds of the histogram buckets: seconds for durations, a count for the queries.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class RequestStats(object):
+    """
+    What one request spent in the database, the templates and the cache.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+# The stats of the request being handled by the current thread or task. Context variables follow
+# the request into the threads where async views run their ORM calls.
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    A database execute wrapper adding every query to the stats of the current request. It is
+    installed on each connection as it opens (see install_query_recorder).
+    """
+    stats = _current.get()
+
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Receiver of the connection_created signal, connected in CoreConfig.ready().
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def start_request():
+    """
+    Starts collecting the stats of a request.
+
+    Returns:
+        tuple: The RequestStats, and the token to pass to finish_request.
+    """
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def record_cache(hit):
+    """
+    Counts a cache lookup of the current request. Outside of a request it does nothing.
+
+    Args:
+        hit (bool): Whether the value was found in the cache.
+    """
+    stats = _current.get()
+
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+class Histogram(object):
+    """
+    A Prometheus histogram: cumulative bucket counts, a sum and a count.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+
+        lines.append('%s_sum{%s} %s' % (name, labels, repr(self.sum)))
+        lines.append('%s_count{%s} %d' % (name, labels, self.count))
+        return lines
+
+
+class Registry(object):
+    """
+    The metrics of this process, aggregated per view.
+
+    Each worker process has its own registry: Prometheus scrapes every worker, or the
+    per-process series are summed in the queries.
+    """
+
+    HISTOGRAMS = (
+        ('bytex_request_duration_seconds', 'Request latency by view.', DURATION_BUCKETS),
+        ('bytex_db_queries', 'SQL queries per request by view.', QUERY_BUCKETS),
+        ('bytex_db_duration_seconds', 'Time spent in SQL per request by view.', DURATION_BUCKETS),
+        ('bytex_template_duration_seconds', 'Time spent rendering templates per request by view.', DURATION_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+            self.requests = {}
+            self.cache = {}
+
+    def histogram(self, name, view):
+        key = (name, view)
+
+        if key not in self.histograms:
+            buckets = dict((metric, buckets) for metric, _, buckets in self.HISTOGRAMS)[name]
+            self.histograms[key] = Histogram(buckets)
+
+        return self.histograms[key]
+
+    def observe(self, view, method, status, duration, stats):
+        """
+        Records a finished request.
+
+        Args:
+            view (str): The name of the view that handled the request.
+            method (str): The HTTP method.
+            status (int): The status code of the response.
+            duration (float): The latency of the request, in seconds.
+            stats (RequestStats): What the request spent in the database, the templates and the cache.
+        """
+        with self.lock:
+            self.histogram('bytex_request_duration_seconds', view).observe(duration)
+            self.histogram('bytex_db_queries', view).observe(stats.queries)
+            self.histogram('bytex_db_duration_seconds', view).observe(stats.sql_time)
+            self.histogram('bytex_template_duration_seconds', view).observe(stats.template_time)
+
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            hits, misses = self.cache.get(view, (0, 0))
+            self.cache[view] = (hits + stats.cache_hits, misses + stats.cache_misses)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        with self.lock:
+            lines.append('# HELP bytex_requests_total Requests by view, method and status.')
+            lines.append('# TYPE bytex_requests_total counter')
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append('bytex_requests_total{view="%s",method="%s",status="%s"} %d' % (view, method, status, count))
+
+            for name, help_text, _ in self.HISTOGRAMS:
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                for (metric, view), histogram in sorted(self.histograms.items()):
+                    if metric == name:
+                        lines.extend(histogram.render(name, 'view="%s"' % view))
+
+            lines.append('# HELP bytex_cache_requests_total Cache lookups by view and result.')
+            lines.append('# TYPE bytex_cache_requests_total counter')
+            for view, (hits, misses) in sorted(self.cache.items()):
+                lines.append('bytex_cache_requests_total{view="%s",result="hit"} %d' % (view, hits))
+                lines.append('bytex_cache_requests_total{view="%s",result="miss"} %d' % (view, misses))
+
+            lines.append('# HELP bytex_cache_hit_ratio Share of the cache lookups that were hits, by view.')
+            lines.append('# TYPE bytex_cache_hit_ratio gauge')
+            for view, (hits, misses) in sorted(self.cache.items()):
+                if hits + misses:
+                    lines.append('bytex_cache_hit_ratio{view="%s"} %s' % (view, repr(hits / (hits + misses))))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class TimedTemplate(Template):
+    """
+    A template that adds its render time to the stats of the current request.
+    """
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+
+        if stats is None:
+            return super().render(context, request)
+
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class MetricsDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing the templates rendered by the views. Included
+    templates are rendered inside their parent, so they are not counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
@@ -0,0 +1,136 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics, profiling
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+class MetricsMiddleware(object):
+    """
+    Records the latency, SQL queries and time, template time and cache hits of every request,
+    aggregated per resolved view in core/metrics.py and exposed by the metrics view.
+
+    SQL is measured by an execute wrapper installed on every database connection, so queries
+    run by the other middlewares (sessions, the cart) count too. This middleware should come
+    first. It runs in the mode of the rest of the stack, sync under WSGI and async under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats, token = metrics.start_request()
+        start = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+
+        self.observe(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = metrics.start_request()
+        start = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+
+        self.observe(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def observe(self, request, response, duration, stats):
+        metrics.registry.observe(get_view_name(request), request.method, response.status_code, duration, stats)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a sample of the requests, or the ones asking for it with the X-Profile header,
+    when profiling has been turned on with the `profiling` management command. The profiles are
+    written to PROFILING_DIR, in one directory per view (see core/profiling.py).
+
+    When profiling is off, the cost is a lookup of the in-process copy of the toggle. This
+    middleware must come after AuthenticationMiddleware. Under ASGI, the profilers only see
+    the event loop thread, not the sync code Django runs in other threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        config = profiling.get_config()
+        profiler = self.start(request, config) if config is not None else None
+
+        if profiler is None:
+            return self.get_response(request)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        self.dump(request, profiler)
+        return response
+
+    async def __acall__(self, request):
+        config = profiling.get_config()
+        profiler = None
+
+        if config is not None:
+            # Only the X-Profile header needs the user, which costs a session read.
+            user = await request.auser() if 'X-Profile' in request.headers else None
+            profiler = self.start(request, config, user)
+
+        if profiler is None:
+            return await self.get_response(request)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.stop()
+
+        self.dump(request, profiler)
+        return response
+
+    def start(self, request, config, user=None):
+        """
+        Starts a profiler if the request is to be profiled.
+
+        Returns:
+            StackSampler or PStatsProfiler or None: The running profiler.
+        """
+        if not profiling.should_profile(request, config, user):
+            return None
+
+        profiler_class, extension = profiling.PROFILERS[config['format']]
+        profiler = profiler_class()
+        profiler.extension = extension
+        profiler.start()
+        return profiler
+
+    def dump(self, request, profiler):
+        profiler.dump(profiling.profile_path(get_view_name(request), profiler.extension))
@@ -0,0 +1,149 @@
+import base64
+import datetime
+import json
+import math
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Encodes cursor values. Unlike DjangoJSONEncoder, datetimes keep their microseconds,
+    otherwise rows created within the same millisecond could be skipped.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class Page(object):
+    """
+    One page of a keyset-paginated queryset.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset with opaque cursors instead of page numbers.
+
+    Each cursor holds the ordering values of the last row of a page, and the next page is
+    fetched with a WHERE clause on those values rather than an OFFSET, so deep pages cost the
+    same as the first one. The ordering must be unique: end it with the primary key.
+    Ordering fields may be model fields or annotations.
+    """
+
+    def __init__(self, queryset, ordering=('-created_at', '-id'), per_page=24):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        data = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Decodes a cursor back to the ordering values it holds.
+
+        Returns:
+            list or None: The values, or None if the cursor is missing or malformed.
+        """
+        if not cursor:
+            return None
+
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data)
+        except (ValueError, TypeError):
+            return None
+
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+
+        opts = self.queryset.model._meta
+
+        for i, name in enumerate(self.fields):
+            value = values[i]
+
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                # Annotations are stored as plain JSON numbers (json.loads also accepts NaN and Infinity).
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    return None
+                continue
+
+            try:
+                values[i] = field.to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                # A tampered cursor: values of the wrong type for the field.
+                return None
+
+            # The ordering fields are never NULL, and a NULL value could not be compared with.
+            if values[i] is None:
+                return None
+
+        return values
+
+    def after(self, values):
+        """
+        Builds the filter selecting the rows that come after the given ordering values.
+
+        For an ordering (a, b, c) this is: a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND c > vc),
+        with < instead of > for descending fields.
+        """
+        condition = Q()
+        equal = {}
+
+        for ordering, field, value in zip(self.ordering, self.fields, values):
+            lookup = '%s__lt' % field if ordering.startswith('-') else '%s__gt' % field
+            condition |= Q(**equal, **{lookup: value})
+            equal[field] = value
+
+        return condition
+
+    def get_page(self, cursor=None):
+        """
+        Returns the page that starts after the given cursor (the first page without one).
+
+        Args:
+            cursor (str, optional): The `next_cursor` of the previous page.
+
+        Returns:
+            Page: The objects of the page and the cursor of the next one.
+        """
+        queryset = self.queryset.order_by(*self.ordering)
+        values = self.decode_cursor(cursor)
+
+        if values is not None:
+            queryset = queryset.filter(self.after(values))
+
+        # Fetch one extra row to know whether there is a next page.
+        object_list = list(queryset[:self.per_page + 1])
+        next_cursor = None
+
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = self.encode_cursor(object_list[-1])
+
+        return Page(object_list, next_cursor)
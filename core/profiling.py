@@ -0,0 +1,194 @@
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+
+# The file holding the profiling configuration, in PROFILING_DIR. A file rather than the cache:
+# the default cache is local to each process, so the management command could not reach the
+# workers through it. Workers on several hosts need a shared PROFILING_DIR.
+CONFIG_FILE = 'profiling.json'
+
+# How long a worker keeps using the configuration it read, in seconds. Checking the toggle
+# costs one file read per worker every few seconds instead of one per request.
+CONFIG_TTL = 5
+
+FORMATS = ('pstats', 'collapsed')
+
+_config = (0, None)
+
+
+def enable(sample_rate=0.0, fmt='pstats', duration=None, header=True):
+    """
+    Turns profiling on for every worker, within CONFIG_TTL seconds.
+
+    Args:
+        sample_rate (float, optional): The fraction of the requests to profile, between 0 and 1.
+        fmt (str, optional): 'pstats' for cProfile dumps, 'collapsed' for sampled stacks in the
+            collapsed format of flame graph tools.
+        duration (int, optional): Turn profiling off again after this many seconds.
+        header (bool, optional): Also profile the requests carrying the X-Profile header.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown profile format %r, expected one of %s.' % (fmt, ', '.join(FORMATS)))
+
+    config = {
+        'sample_rate': sample_rate,
+        'format': fmt,
+        'header': header,
+        'until': time.time() + duration if duration else None,
+    }
+
+    path = get_config_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write a new file and move it into place, so a worker never reads a half-written configuration.
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(config, f)
+    os.replace(tmp, path)
+
+
+def disable():
+    try:
+        os.remove(get_config_path())
+    except FileNotFoundError:
+        pass
+
+
+def read_config():
+    """
+    Reads the configuration written by enable(), or None when there is none.
+    """
+    try:
+        with open(get_config_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_config(refresh=False):
+    """
+    Returns the current profiling configuration, or None when profiling is off.
+
+    Args:
+        refresh (bool, optional): Read the file even if this process read it less than CONFIG_TTL seconds ago.
+    """
+    global _config
+
+    expires_at, config = _config
+    now = time.time()
+
+    if refresh or expires_at < now:
+        config = read_config()
+        _config = (now + CONFIG_TTL, config)
+
+    if config is not None and config['until'] is not None and config['until'] < now:
+        return None
+
+    return config
+
+
+def should_profile(request, config, user=None):
+    """
+    Tells whether a request is profiled: it is sampled, or it carries the X-Profile header and
+    comes from a staff user or with the PROFILING_TOKEN.
+
+    Async callers pass the user they loaded with request.auser().
+    """
+    if config['header'] and 'X-Profile' in request.headers:
+        token = getattr(settings, 'PROFILING_TOKEN', None)
+        user = user or request.user
+        if (token and request.headers['X-Profile'] == token) or user.is_staff:
+            return True
+
+    return random.random() < config['sample_rate']
+
+
+class StackSampler(object):
+    """
+    A sampling profiler for one thread: a background thread records the stack of the profiled
+    thread every `interval` seconds. Much cheaper than cProfile, and it gives whole stacks,
+    which is what flame graphs are drawn from.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (code.co_filename, code.co_name))
+                frame = frame.f_back
+
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+
+class PStatsProfiler(object):
+    """
+    cProfile, with the same interface as StackSampler.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+PROFILERS = {
+    'pstats': (PStatsProfiler, 'prof'),
+    'collapsed': (StackSampler, 'collapsed'),
+}
+
+
+def get_profile_dir():
+    return str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def get_config_path():
+    return os.path.join(get_profile_dir(), CONFIG_FILE)
+
+
+def profile_path(view_name, extension):
+    """
+    Returns where to write a profile: one directory per view, one file per request.
+    """
+    directory = os.path.join(get_profile_dir(), re.sub(r'[^\w.-]', '_', view_name))
+    os.makedirs(directory, exist_ok=True)
+    name = '%s-%d-%s.%s' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(), uuid.uuid4().hex[:6], extension)
+    return os.path.join(directory, name)
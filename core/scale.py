@@ -0,0 +1,314 @@
+import datetime
+import itertools
+import math
+import random
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from order.models import Order, OrderItem
+from product.models import Category, Product, Review
+
+from .benchmark import WORDS
+
+
+# The generated data ends here rather than now, so that two runs with the same seed are identical.
+END = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+FIRST_NAMES = ('Alex', 'Sam', 'Maria', 'Jon', 'Aisha', 'Wei', 'Lena', 'Omar', 'Priya', 'Tom', 'Yuki', 'Ana')
+LAST_NAMES = ('Smith', 'Khan', 'Garcia', 'Chen', 'Novak', 'Silva', 'Ahmed', 'Brown', 'Rossi', 'Sato')
+CITIES = ('Dhaka', 'Berlin', 'Lagos', 'Lima', 'Osaka', 'Austin', 'Lyon', 'Pune', 'Leeds', 'Porto')
+
+# Online ratings lean positive.
+RATING_WEIGHTS = (5, 7, 15, 33, 40)
+
+QUANTITY_WEIGHTS = ((1, 2, 3, 5), (80, 14, 5, 1))
+
+# Share of the orders placed without an account.
+GUEST_SHARE = 0.05
+
+
+def zipf_weights(n, exponent):
+    """
+    Returns the cumulative Zipf weights of n ranks, for random.choices(cum_weights=...): the
+    item of rank k is drawn with a probability proportional to 1 / k ** exponent.
+    """
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(itertools.islice(iterator, size))
+
+        if not batch:
+            return
+
+        yield batch
+
+
+def bulk_insert(model, objects, batch_size):
+    """
+    Writes a stream of unsaved objects with bulk_create, one transaction per batch, so that
+    millions of rows never sit in memory at once.
+
+    Returns:
+        list: The primary keys of the created objects.
+    """
+    ids = []
+
+    for batch in batched(objects, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+        ids.extend(obj.pk for obj in batch)
+
+    return ids
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Lets bulk_create write the created_at values of the generated rows: auto_now_add fields
+    would otherwise all be set to the time of the insert.
+    """
+    fields = [field for model in models for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+
+    for field in fields:
+        field.auto_now_add = False
+
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class ScaleSeeder(object):
+    """
+    Generates a large catalog and order history with skewed, reproducible distributions:
+
+    - category sizes follow a Zipf law, a few categories hold most of the products;
+    - product popularity follows a Zipf law, which gives the review counts and the order lines
+      a long tail;
+    - user activity follows a Zipf law, a few power users write many reviews and place many
+      orders;
+    - prices are log-normal, ratings lean positive, and products, reviews and orders are spread
+      over the `days` before END, in insertion order for the products and the orders.
+
+    Every row is written with bulk_create: no signals fire. The caller rebuilds the derived
+    data (rating aggregates, facet counts, search index, catalog version), see the seed_scale
+    command.
+
+    Args:
+        categories (int): Number of categories.
+        products (int): Number of products.
+        users (int): Number of users.
+        reviews (int): Approximate number of reviews.
+        orders (int): Number of orders.
+        days (int, optional): The length of the history, in days.
+        seed (int, optional): Seed of the random generator, the same seed gives the same data.
+        batch_size (int, optional): Number of rows written per query.
+        progress (callable, optional): Called with the name and the row count of every finished table.
+    """
+
+    def __init__(self, categories, products, users, reviews, orders, days=730, seed=0, batch_size=5000, progress=None):
+        self.categories = categories
+        self.products = products
+        self.users = users
+        self.reviews = reviews
+        self.orders = orders
+        self.start = END - datetime.timedelta(days=days)
+        self.span = days * 86400
+        self.seed = seed
+        self.batch_size = batch_size
+        self.progress = progress or (lambda name, count: None)
+
+    def run(self):
+        """
+        Generates everything.
+
+        Returns:
+            dict: The number of rows written per model.
+        """
+        # One generator per table: changing the size of one table leaves the others as they were.
+        self.rng = {name: random.Random('%s-%s' % (self.seed, name)) for name in ('products', 'users', 'reviews', 'orders')}
+
+        with explicit_timestamps(Product, Review, Order):
+            counts = {
+                'categories': self.create_categories(),
+                'products': self.create_products(),
+                'users': self.create_users(),
+            }
+            counts['reviews'] = self.create_reviews()
+            counts['orders'], counts['order_items'] = self.create_orders()
+
+        return counts
+
+    def timestamp(self, fraction):
+        return self.start + datetime.timedelta(seconds=int(self.span * fraction))
+
+    def create_categories(self):
+        words = [word.title() for word in WORDS]
+        self.category_ids = bulk_insert(Category, (
+            Category(name='%s %s' % (words[i % len(words)], i // len(words) + 1), slug='scale-category-%d' % i)
+            for i in range(self.categories)
+        ), self.batch_size)
+        self.progress('categories', len(self.category_ids))
+        return len(self.category_ids)
+
+    def create_products(self):
+        rng = self.rng['products']
+        category_weights = zipf_weights(len(self.category_ids), 1.1)
+        # Draw the category of every product up front: rng.choices with cumulative weights is a bisect per draw.
+        categories = rng.choices(self.category_ids, cum_weights=category_weights, k=self.products)
+        self.prices = []
+
+        def generate():
+            for i, category_id in enumerate(categories):
+                price = Decimal(min(99999, max(1, round(math.exp(rng.gauss(4.0, 1.2)), 2)))).quantize(Decimal('0.01'))
+                self.prices.append(price)
+                yield Product(
+                    category_id=category_id,
+                    name='%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), i),
+                    slug='scale-product-%d' % i,
+                    description=' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 40))),
+                    price=price,
+                    available=rng.random() > 0.05,
+                    created_at=self.timestamp(i / self.products),
+                )
+
+        self.product_ids = bulk_insert(Product, generate(), self.batch_size)
+
+        # Popularity ranks are independent of the creation order: old and new products both have hits.
+        self.popular = list(range(len(self.product_ids)))
+        rng.shuffle(self.popular)
+        self.popularity_weights = zipf_weights(len(self.popular), 1.05)
+
+        self.progress('products', len(self.product_ids))
+        return len(self.product_ids)
+
+    def create_users(self):
+        rng = self.rng['users']
+        # An unusable password: the generated users cannot log in.
+        password = '!'
+
+        self.user_ids = bulk_insert(User, (
+            User(
+                username='scale-user-%d' % i,
+                email='scale-user-%d@example.com' % i,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                password=password,
+            )
+            for i in range(self.users)
+        ), self.batch_size)
+
+        # Activity ranks: user 0 is the most active, the order in which users were created does not matter.
+        self.activity_weights = zipf_weights(len(self.user_ids), 1.0)
+
+        self.progress('users', len(self.user_ids))
+        return len(self.user_ids)
+
+    def create_reviews(self):
+        rng = self.rng['reviews']
+        total = self.popularity_weights[-1] if self.popularity_weights else 0
+        previous = 0.0
+        shares = []
+
+        for weight in self.popularity_weights:
+            shares.append((weight - previous) / total)
+            previous = weight
+
+        def generate():
+            if not self.user_ids:
+                return
+
+            # A user reviews a product once, so the most reviewed products have at most half the users.
+            # The reviews they cannot have go to the next products, to keep the total close to the target.
+            limit = max(1, len(self.user_ids) // 2)
+            deficit = 0
+
+            for rank, index in enumerate(self.popular):
+                wanted = int(self.reviews * shares[rank] * rng.uniform(0.5, 1.5)) + deficit
+                count = min(limit, wanted)
+                reviewers = set()
+
+                for _ in range(count * 3):
+                    if len(reviewers) == count:
+                        break
+                    reviewers.add(rng.choices(self.user_ids, cum_weights=self.activity_weights)[0])
+
+                deficit = wanted - len(reviewers)
+
+                product_start = index / self.products
+
+                for user_id in sorted(reviewers):
+                    yield Review(
+                        product_id=self.product_ids[index],
+                        created_by_id=user_id,
+                        rating=rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0],
+                        content=' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))),
+                        created_at=self.timestamp(rng.uniform(product_start, 1)),
+                    )
+
+        count = len(bulk_insert(Review, generate(), self.batch_size))
+        self.progress('reviews', count)
+        return count
+
+    def create_orders(self):
+        rng = self.rng['orders']
+        item_count = 0
+
+        for start in range(0, self.orders, self.batch_size):
+            orders = []
+            items = []
+
+            for i in range(start, min(start + self.batch_size, self.orders)):
+                user_id = None
+                if self.user_ids and rng.random() >= GUEST_SHARE:
+                    user_id = rng.choices(self.user_ids, cum_weights=self.activity_weights)[0]
+
+                # Most orders hold one or two products, a few hold many.
+                lines = {}
+                for index in rng.choices(self.popular, cum_weights=self.popularity_weights, k=1 + min(9, int(rng.expovariate(0.8)))):
+                    lines[index] = rng.choices(*QUANTITY_WEIGHTS)[0]
+
+                amount = sum(self.prices[index] * quantity for index, quantity in lines.items())
+                shipped = rng.random() < 0.7
+
+                orders.append(Order(
+                    user_id=user_id,
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=rng.choice(LAST_NAMES),
+                    email='order-%d@example.com' % i,
+                    address='%d %s Street' % (rng.randint(1, 999), rng.choice(LAST_NAMES)),
+                    zipcode='%05d' % rng.randint(0, 99999),
+                    city=rng.choice(CITIES),
+                    phone='%010d' % rng.randint(0, 10 ** 10 - 1),
+                    created_at=self.timestamp(i / self.orders),
+                    paid=True,
+                    paid_amount=int(amount),
+                    status=Order.SHIPPED if shipped else Order.ORDERED,
+                ))
+                items.append(lines)
+
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order_id=order.pk,
+                        product_id=self.product_ids[index],
+                        price=self.prices[index] * quantity,
+                        quantity=quantity,
+                    )
+                    for order, lines in zip(orders, items)
+                    for index, quantity in lines.items()
+                ], batch_size=self.batch_size)
+
+            item_count += sum(len(lines) for lines in items)
+
+        self.progress('orders', self.orders)
+        return self.orders, item_count
@@ -0,0 +1,132 @@
+import gzip
+import os
+from io import BytesIO
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional: without it only the gzip copies are written.
+    brotli = None
+
+
+# Text assets worth precompressing. Images and fonts are compressed formats already.
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.svg', '.html', '.txt', '.json', '.xml', '.ico')
+
+# Smaller files gain nothing from compression, their response headers outweigh them.
+COMPRESS_MIN_SIZE = 256
+
+# Raster images wider than this are scaled down to it.
+IMAGE_MAX_WIDTH = 1600
+
+# Encoder options per Pillow format, for recompressing the raster images.
+IMAGE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'GIF': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 6},
+}
+
+
+def recompress_image(data):
+    """
+    Re-encodes a raster image with the encoder options of IMAGE_OPTIONS, scaling it down to
+    IMAGE_MAX_WIDTH first. Animated images keep their frames and size.
+
+    Args:
+        data (bytes): The image.
+
+    Returns:
+        bytes or None: The smaller image, or None if re-encoding does not make it smaller.
+    """
+    img = Image.open(BytesIO(data))
+    fmt = img.format
+    options = dict(IMAGE_OPTIONS.get(fmt, {}))
+
+    if not options:
+        return None
+
+    if getattr(img, 'is_animated', False):
+        options.update(save_all=True, loop=img.info.get('loop', 0), duration=img.info.get('duration'))
+    elif img.width > IMAGE_MAX_WIDTH:
+        img = img.resize((IMAGE_MAX_WIDTH, round(img.height * IMAGE_MAX_WIDTH / img.width)), Image.LANCZOS)
+
+    buffer = BytesIO()
+    img.save(buffer, fmt, **options)
+
+    if buffer.tell() >= len(data):
+        return None
+
+    return buffer.getvalue()
+
+
+def compress(data):
+    """
+    Returns the precompressed copies of a text asset, by file extension: '.gz' and, when the
+    brotli package is installed, '.br'. Copies that are not smaller are left out.
+    """
+    copies = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+
+    if brotli is not None:
+        copies['.br'] = brotli.compress(data, quality=11)
+
+    return {extension: content for extension, content in copies.items() if len(content) < len(data)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    The manifest storage of collectstatic, plus two build steps:
+
+    - raster images are scaled down and re-encoded before they are hashed, so their hashed
+      names match the bytes that are served;
+    - every hashed text asset gets gzip (and brotli) copies next to it, e.g. app.3f2a9c.css.gz,
+      for front-end servers that send precompressed files (nginx gzip_static and brotli_static).
+
+    The hashed names never change content, so they can be cached forever; {% static %} resolves
+    them from staticfiles.json.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run=dry_run, **options)
+            return
+
+        paths = dict(paths)
+
+        for name in list(paths):
+            if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png', '.gif', '.webp'):
+                storage, path = paths[name]
+
+                with storage.open(path) as f:
+                    data = f.read()
+
+                try:
+                    smaller = recompress_image(data)
+                except OSError as e:
+                    yield name, None, e
+                    continue
+
+                if smaller is not None:
+                    # Hash (and copy) the smaller image from here rather than from the source directory.
+                    self.delete(name)
+                    self._save(name, ContentFile(smaller))
+                    paths[name] = (self, name)
+
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+
+        for hashed_name in set(self.hashed_files.values()):
+            if os.path.splitext(hashed_name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+
+            with self.open(hashed_name) as f:
+                data = f.read()
+
+            if len(data) < COMPRESS_MIN_SIZE:
+                continue
+
+            for extension, content in compress(data).items():
+                if self.exists(hashed_name + extension):
+                    self.delete(hashed_name + extension)
+                self._save(hashed_name + extension, ContentFile(content))
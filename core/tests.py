@@ -1,3 +1,721 @@
-from django.test import TestCase
+import base64
+import collections
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from PIL import Image
+
+from core import budgets, metrics, profiling
+from core.benchmark import CHECKOUT_DATA, FLOWS, seed_catalog
+from core.management.commands import benchmark as benchmark_command
+from core.scale import ScaleSeeder
+from core.pagination import KeysetPaginator
+from order import payments
+from order.models import Order, OrderItem
+from product.models import Category, FacetCount, Product, Review
+from product.ratings import rating_average, rebuild_aggregates
+
+
+class BudgetTests(TestCase):
+    def test_latency_budget_grows_with_the_cart(self):
+        budget = budgets.Budget(queries=1, latency_ms=10, per_product_ms=1, per_cart_item_ms=2)
+
+        self.assertEqual(budget.max_latency_ms(), 10)
+        self.assertEqual(budget.max_latency_ms(products=5, cart_items=3), 21)
+
+    def test_check_raises_over_budget(self):
+        budget = budgets.Budget(queries=1, latency_ms=10)
+        queries = [{'sql': 'SELECT 1', 'time': '0'}] * 2
+
+        budget.check('view', queries[:1], 5)
+        with self.assertRaisesMessage(budgets.BudgetExceeded, '2 queries, budget 1'):
+            budget.check('view', queries, 5)
+        with self.assertRaisesMessage(budgets.BudgetExceeded, 'budget 10.0 ms'):
+            budget.check('view', queries[:1], 50)
+
+
+class ViewBudgetMixin(object):
+    """
+    Runs the hot views against a seeded catalog and a filled cart, with cold caches, and
+    checks them against their budgets in core/budgets.py. Subclasses set the catalog and cart
+    sizes: the query budgets are the same for every size.
+    """
+    products = 10
+    cart_items = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = seed_catalog(categories=5, products=cls.products, users=5)
+        cls.user = User.objects.create_user('budget', password='budget')
+
+    def setUp(self):
+        gateway = override_settings(PAYMENT_GATEWAY='order.payments.StubGateway')
+        gateway.enable()
+        self.addCleanup(gateway.disable)
+        payments._gateway = None
+        self.client.get(reverse('frontpage'))
+        for product_id in self.catalog['product_ids'][:self.cart_items]:
+            self.client.get(reverse('cart:add_to_cart', args=[product_id]))
+
+    def tearDown(self):
+        payments._gateway = None
+
+    def enforce(self, name):
+        cache.clear()
+        return budgets.enforce(name, products=self.products, cart_items=self.cart_items)
+
+    def test_frontpage(self):
+        with self.enforce('frontpage'):
+            self.assertEqual(self.client.get(reverse('frontpage')).status_code, 200)
+
+    def test_shop(self):
+        for params in ({}, {'category': self.catalog['categories'][0], 'sort': 'rating'}, {'query': 'laptop'}):
+            with self.subTest(params=params), self.enforce('shop'):
+                self.assertEqual(self.client.get(reverse('shop'), params).status_code, 200)
+
+    def test_product(self):
+        with self.enforce('product'):
+            response = self.client.get(reverse('product', args=[self.catalog['products'][0]]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart(self):
+        with self.enforce('cart:cart'):
+            self.assertEqual(self.client.get(reverse('cart:cart')).status_code, 200)
+
+    def test_cart_partials(self):
+        product_id = self.catalog['product_ids'][-1]
+
+        with self.enforce('cart:add_to_cart'):
+            self.client.get(reverse('cart:add_to_cart', args=[product_id]))
+        with self.enforce('cart:update_cart'):
+            self.client.get(reverse('cart:update_cart', args=[product_id, 'increment']))
+        with self.enforce('cart:hx_menu_cart'):
+            self.client.get(reverse('cart:hx_menu_cart'))
+        with self.enforce('cart:hx_cart_total'):
+            self.client.get(reverse('cart:hx_cart_total'))
+
+    def test_start_order(self):
+        with self.enforce('start_order'):
+            response = self.client.post(reverse('start_order'), json.dumps(CHECKOUT_DATA), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_myaccount(self):
+        products = list(Product.objects.all()[:self.cart_items])
+        for i in range(self.cart_items):
+            order = Order.objects.create(user=self.user, **CHECKOUT_DATA)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, price=product.price, quantity=1) for product in products
+            ])
+
+        self.client.force_login(self.user)
+        with self.enforce('myaccount'):
+            self.assertEqual(self.client.get(reverse('myaccount')).status_code, 200)
+
+
+class SmallCatalogBudgetTests(ViewBudgetMixin, TestCase):
+    products = 10
+    cart_items = 1
+
+
+class LargeCatalogBudgetTests(ViewBudgetMixin, TestCase):
+    products = 200
+    cart_items = 20
+
+
+def make_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(categories=2, products=25, users=2)
+
+    def test_pages_cover_every_row_once(self):
+        paginator = KeysetPaginator(Product.objects.all(), per_page=10)
+        seen = []
+        cursor = None
+
+        while True:
+            page = paginator.get_page(cursor)
+            seen.extend(product.pk for product in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(seen, list(Product.objects.order_by('-created_at', '-id').values_list('pk', flat=True)))
+
+    def test_annotation_ordering(self):
+        products = Product.objects.annotate(rating_average=rating_average())
+        paginator = KeysetPaginator(products, ordering=('-rating_average', '-review_count', '-id'), per_page=10)
+
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+
+        self.assertEqual(paginator.decode_cursor(first.next_cursor)[2], first.object_list[-1].pk)
+        self.assertFalse({p.pk for p in first} & {p.pk for p in second})
+
+    def test_tampered_cursors_are_ignored(self):
+        paginator = KeysetPaginator(Product.objects.all())
+        rated = KeysetPaginator(
+            Product.objects.annotate(rating_average=rating_average()),
+            ordering=('-rating_average', '-review_count', '-id'),
+        )
+
+        for cursor in ('!!!', 'bm90IGpzb24', make_cursor({'a': 1}), make_cursor([1])):
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(paginator.decode_cursor(cursor))
+
+        for values in ([[1, 2], 5], [{'a': 1}, 5], ['2024-01-01T00:00:00', {'a': 1}], ['2024-01-01T00:00:00', 'x'], [None, 5]):
+            with self.subTest(values=values):
+                self.assertIsNone(paginator.decode_cursor(make_cursor(values)))
+
+        for value in ('4.5', True, None, [4.5], {'a': 1}, float('nan')):
+            with self.subTest(value=value):
+                self.assertIsNone(rated.decode_cursor(make_cursor([value, 3, 5])))
+
+        self.assertEqual(rated.decode_cursor(make_cursor([4.5, 3, 5])), [4.5, 3, 5])
+
+    def test_shop_ignores_tampered_cursors(self):
+        for params in ({'cursor': make_cursor([[1], 5])}, {'cursor': make_cursor(['x', 5]), 'sort': 'rating'}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('shop'), params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['page']), min(25, settings.SHOP_PAGE_SIZE))
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        settings = override_settings(PROFILING_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.forget_config()
+        self.addCleanup(self.forget_config)
+
+    def forget_config(self):
+        # What a worker that never read the toggle sees.
+        profiling._config = (0, None)
+
+    def profiling(self, *args):
+        output = io.StringIO()
+        call_command('profiling', *args, stdout=output)
+        return output.getvalue()
+
+    def test_toggle_reaches_other_processes(self):
+        self.profiling('on', '--rate', '0.5')
+        self.forget_config()
+
+        self.assertEqual(profiling.get_config()['sample_rate'], 0.5)
+        self.assertIn('Profiling 50.0% of the requests', self.profiling('status'))
+
+        self.profiling('off')
+
+        self.assertIsNone(profiling.get_config(refresh=True))
+        self.assertIn('Profiling is off.', self.profiling('status'))
+
+    def test_toggle_expires(self):
+        profiling.enable(sample_rate=1, duration=60)
+        config = profiling.read_config()
+        config['until'] -= 120
+        with open(profiling.get_config_path(), 'w') as f:
+            json.dump(config, f)
+
+        self.assertIsNone(profiling.get_config(refresh=True))
+
+    def test_sampled_requests_are_profiled(self):
+        profiling.enable(sample_rate=1)
+        self.forget_config()
+
+        self.assertEqual(self.client.get(reverse('frontpage')).status_code, 200)
+
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'frontpage'))), 1)
+        self.assertIn('frontpage', self.profiling('status'))
+
+
+class MediaTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        self.root = os.path.join(base, 'media')
+        os.makedirs(os.path.join(self.root, 'uploads'))
+
+        # Next to MEDIA_ROOT, out of reach.
+        with open(os.path.join(base, 'secret.txt'), 'w') as f:
+            f.write('secret')
+
+        for name in ('uploads/photo.jpg', 'uploads/0123456789abcdef-400w.webp'):
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(self.content)
+
+        settings_override = override_settings(MEDIA_ROOT=self.root, MEDIA_SENDFILE=None, MEDIA_MAX_AGE=60)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, path, **headers):
+        return self.client.get(reverse('media', args=[path]), headers=headers)
+
+    def test_file_is_served_with_validators(self):
+        response = self.get('uploads/photo.jpg')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+
+        revalidated = self.get('uploads/photo.jpg', if_none_match=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+        revalidated = self.get('uploads/photo.jpg', if_modified_since=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_hashed_names_are_immutable(self):
+        response = self.get('uploads/0123456789abcdef-400w.webp')
+
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_ranges(self):
+        for header, first, last in (('bytes=0-99', 0, 99), ('bytes=1000-', 1000, 1023), ('bytes=-24', 1000, 1023)):
+            with self.subTest(header):
+                response = self.get('uploads/photo.jpg', range=header)
+
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], 'bytes %d-%d/1024' % (first, last))
+                self.assertEqual(response['Content-Length'], str(last - first + 1))
+                self.assertEqual(b''.join(response.streaming_content), self.content[first:last + 1])
+
+    def test_unsatisfiable_range(self):
+        response = self.get('uploads/photo.jpg', range='bytes=2000-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        response = self.get('uploads/photo.jpg', range='bytes=0-1,5-6')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_if_range(self):
+        etag = self.get('uploads/photo.jpg')['ETag']
+
+        self.assertEqual(self.get('uploads/photo.jpg', range='bytes=0-9', if_range=etag).status_code, 206)
+        self.assertEqual(self.get('uploads/photo.jpg', range='bytes=0-9', if_range='"stale"').status_code, 200)
+        self.assertEqual(self.get('uploads/photo.jpg', range='bytes=0-9', if_range='W/' + etag).status_code, 200)
+        self.assertEqual(self.get('uploads/photo.jpg', range='bytes=0-9', if_range=http_date(0)).status_code, 200)
+
+    def test_missing_files_and_traversal_are_404(self):
+        self.assertEqual(self.get('uploads/missing.jpg').status_code, 404)
+        self.assertEqual(self.get('uploads').status_code, 404)
+        self.assertEqual(self.get('../secret.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/..%2Fsecret.txt').status_code, 404)
+
+    def test_offloaded_to_the_front_end_server(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_PREFIX='/internal-media/'):
+            response = self.get('uploads/photo.jpg')
+
+        self.assertEqual(response['X-Accel-Redirect'], '/internal-media/uploads/photo.jpg')
+        self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.get('uploads/photo.jpg')
+
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.root, 'uploads', 'photo.jpg'))
+
+    def test_head(self):
+        response = self.client.head(reverse('media', args=['uploads/photo.jpg']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(response.content, b'')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 5))
+
+        for value in (0, 1, 3, 10):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.render('queries', 'view="shop"'), [
+            'queries_bucket{view="shop",le="1"} 2',
+            'queries_bucket{view="shop",le="5"} 3',
+            'queries_bucket{view="shop",le="+Inf"} 4',
+            'queries_sum{view="shop"} 14.0',
+            'queries_count{view="shop"} 4',
+        ])
+
+    def test_registry_aggregates_per_view(self):
+        stats = metrics.RequestStats()
+        stats.queries, stats.cache_hits, stats.cache_misses = 3, 3, 1
+
+        metrics.registry.observe('shop', 'GET', 200, 0.02, stats)
+        metrics.registry.observe('shop', 'GET', 200, 0.04, stats)
+        output = metrics.registry.render()
+
+        self.assertIn('bytex_requests_total{view="shop",method="GET",status="200"} 2', output)
+        self.assertIn('bytex_db_queries_sum{view="shop"} 6.0', output)
+        self.assertIn('bytex_cache_requests_total{view="shop",result="hit"} 6', output)
+        self.assertIn('bytex_cache_hit_ratio{view="shop"} 0.75', output)
+
+    def test_middleware_records_requests(self):
+        self.client.get(reverse('frontpage'))
+        self.client.get('/no-such-page/')
+
+        output = metrics.registry.render()
+        self.assertIn('bytex_requests_total{view="frontpage",method="GET",status="200"} 1', output)
+        self.assertIn('bytex_requests_total{view="unresolved",method="GET",status="404"} 1', output)
+        self.assertIn('bytex_request_duration_seconds_count{view="frontpage"} 1', output)
+
+    def test_endpoint_is_closed_by_default(self):
+        # The test client comes from 127.0.0.1, like every request behind a local proxy.
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    def test_staff_users_can_read_the_metrics(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE bytex_requests_total counter')
+
+    def test_bearer_token(self):
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'}).status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+        # Without a configured token, no header opens the endpoint.
+        self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer None'}).status_code, 404)
+
+    def test_allowed_addresses(self):
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.product = Product.objects.create(category=category, name='Laptop', slug='laptop', price=100)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, client=None, **headers):
+        return (client or self.client).get(reverse('shop'), headers=headers)
+
+    def test_anonymous_pages_are_cached(self):
+        first = self.get()
+
+        with self.assertNumQueries(0):
+            second = self.get()
+
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.get(HX_Request='true')['X-Page-Cache'], 'miss')
+
+    def test_vary_headers(self):
+        for response in (self.get(), self.get()):
+            self.assertEqual(set(response['Vary'].split(', ')), {'Cookie', 'HX-Request'})
+
+    def test_signed_in_users_bypass_the_cache(self):
+        self.get()
+        self.client.force_login(User.objects.create_user('buyer'))
+
+        response = self.get()
+
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'logout')
+
+    def test_pages_rendered_with_a_session_or_csrf_cookie_are_not_stored(self):
+        visitor = Client()
+        visitor.get(reverse('cart:add_to_cart', args=[self.product.pk]))
+        self.assertIn(settings.SESSION_COOKIE_NAME, visitor.cookies)
+        csrf_visitor = Client()
+        csrf_visitor.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 32
+
+        self.assertEqual(self.get(visitor)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.get(csrf_visitor)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.get()['X-Page-Cache'], 'miss')
+
+        # The copy stored for a cookieless visitor is served to everybody anonymous.
+        self.assertEqual(self.get(visitor)['X-Page-Cache'], 'hit')
+
+    def test_menu_cart_is_loaded_separately(self):
+        self.get()
+        visitor = Client()
+        visitor.get(reverse('cart:add_to_cart', args=[self.product.pk]))
+
+        response = self.get(visitor)
+
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'hx-trigger="load, update-menu-cart from:body"')
+        self.assertNotContains(response, 'bg-indigo-500')
+        self.assertContains(visitor.get(reverse('cart:hx_menu_cart')), 'bg-indigo-500')
+
+    def test_catalog_changes_invalidate_the_pages(self):
+        self.get()
+        self.assertEqual(self.get()['X-Page-Cache'], 'hit')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Gaming Laptop'
+            self.product.save()
+
+        response = self.get()
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Gaming Laptop')
+        self.assertEqual(self.get()['X-Page-Cache'], 'hit')
+
+    def test_only_get_requests_are_cached(self):
+        self.client.post(reverse('shop'))
+        self.assertEqual(self.get()['X-Page-Cache'], 'miss')
+        self.assertNotIn('X-Page-Cache', self.client.post(reverse('shop')))
+
+
+class ScaleSeederTests(TestCase):
+    OPTIONS = {'categories': 8, 'products': 400, 'users': 60, 'reviews': 600, 'orders': 500, 'batch_size': 150}
+
+    def seed(self, seed=0):
+        return ScaleSeeder(seed=seed, **self.OPTIONS).run()
+
+    def snapshot(self):
+        return {
+            'products': list(Product.objects.order_by('slug').values_list('slug', 'name', 'category__slug', 'price', 'available', 'created_at')),
+            'reviews': sorted(Review.objects.values_list('product__slug', 'created_by__username', 'rating', 'created_at')),
+            'orders': list(Order.objects.order_by('email').values_list('email', 'user__username', 'paid_amount', 'status', 'created_at')),
+            'items': sorted(OrderItem.objects.values_list('order__email', 'product__slug', 'quantity', 'price')),
+        }
+
+    def clear(self):
+        # The seeder writes no aggregates; the review signals would take them below zero.
+        rebuild_aggregates()
+        for model in (OrderItem, Order, Review, Product, Category, User):
+            model.objects.all().delete()
+
+    def test_counts(self):
+        counts = self.seed()
+
+        self.assertEqual(counts['categories'], Category.objects.count())
+        self.assertEqual(counts['products'], Product.objects.count())
+        self.assertEqual(counts['users'], User.objects.count())
+        self.assertEqual(counts['reviews'], Review.objects.count())
+        self.assertEqual(counts['orders'], Order.objects.count())
+        self.assertEqual(counts['order_items'], OrderItem.objects.count())
+        self.assertEqual((counts['categories'], counts['products'], counts['users'], counts['orders']), (8, 400, 60, 500))
+        self.assertGreater(counts['reviews'], 600 * 0.5)
+        self.assertLess(counts['reviews'], 600 * 1.5)
+        # A user reviews a product at most once.
+        self.assertEqual(Review.objects.values('product', 'created_by').distinct().count(), counts['reviews'])
+
+    def test_same_seed_same_data(self):
+        self.seed(seed=3)
+        first = self.snapshot()
+        self.clear()
+
+        self.seed(seed=3)
+        self.assertEqual(self.snapshot(), first)
+        self.clear()
+
+        self.seed(seed=4)
+        self.assertNotEqual(self.snapshot()['products'], first['products'])
+
+    def test_distributions_are_skewed(self):
+        self.seed()
+
+        category_sizes = sorted(Product.objects.values('category').annotate(n=Count('pk')).values_list('n', flat=True), reverse=True)
+        # Zipf: the largest category is far above the average.
+        self.assertGreater(category_sizes[0], 2 * 400 / 8)
+
+        sold = sorted(collections.Counter(OrderItem.objects.values_list('product_id', flat=True)).values(), reverse=True)
+        top = sum(sold[:40])  # The 10% most popular products.
+        self.assertGreater(top / sum(sold), 0.3)
+
+        orders_per_user = sorted(collections.Counter(Order.objects.exclude(user=None).values_list('user_id', flat=True)).values(), reverse=True)
+        self.assertGreater(orders_per_user[0], 5 * orders_per_user[len(orders_per_user) // 2])
+
+    def test_command(self):
+        out = io.StringIO()
+        options = dict(self.OPTIONS, batch_size=1000)
+
+        call_command('seed_scale', stdout=out, **options)
+
+        self.assertIn('Generated 8 categories, 400 products, 60 users', out.getvalue())
+        product = Product.objects.filter(review_count__gt=0).first()
+        self.assertEqual(product.review_count, product.reviews.count())
+        self.assertTrue(FacetCount.objects.exists())
+
+        with self.assertRaisesMessage(CommandError, 'already holds generated data'):
+            call_command('seed_scale', stdout=out, **options)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_smoke(self):
+        output = os.path.join(tempfile.mkdtemp(), 'benchmark.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        out = io.StringIO()
+
+        # Run against the test database instead of a throwaway one.
+        with mock.patch.object(connection.creation, 'create_test_db', return_value=connection.settings_dict['NAME']), \
+                mock.patch.object(connection.creation, 'destroy_test_db'), \
+                mock.patch.object(benchmark_command, 'setup_test_environment'), \
+                mock.patch.object(benchmark_command, 'teardown_test_environment'):
+            call_command(
+                'benchmark', iterations=2, warmup=1, products=20, categories=2, users=3, output=output, stdout=out,
+            )
+
+        with open(output) as f:
+            results = json.load(f)
+
+        self.assertEqual(set(results['flows']), {flow.name for flow in FLOWS})
+        for name, stats in results['flows'].items():
+            with self.subTest(name):
+                self.assertEqual(stats['iterations'], 2)
+                self.assertIn(name, out.getvalue())
+        self.assertEqual(results['options']['mode'], 'wsgi')
+        self.assertEqual(Order.objects.count(), 3)
+
+
+class StaticBuildTests(TestCase):
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        source = os.path.join(base, 'assets')
+        self.root = os.path.join(base, 'static')
+        os.makedirs(os.path.join(source, 'images'))
+
+        with open(os.path.join(source, 'app.css'), 'w') as f:
+            f.write('.logo { background: url("images/logo.png"); }\n')
+            f.writelines('.rule-%d { margin: %dpx; }\n' % (i, i) for i in range(40))
+        with open(os.path.join(source, 'tiny.js'), 'w') as f:
+            f.write('console.log(1)\n')
+        Image.new('RGB', (2400, 600), 'white').save(os.path.join(source, 'images', 'logo.png'))
+
+        static = override_settings(
+            STATICFILES_DIRS=[source],
+            STATIC_ROOT=self.root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        )
+        static.enable()
+        self.addCleanup(static.disable)
+
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    def test_hashed_names(self):
+        with open(os.path.join(self.root, 'staticfiles.json')) as f:
+            paths = json.load(f)['paths']
+
+        self.assertRegex(paths['app.css'], r'^app\.[0-9a-f]{12}\.css$')
+        self.assertRegex(paths['images/logo.png'], r'^images/logo\.[0-9a-f]{12}\.png$')
+        self.assertEqual(staticfiles_storage.url('app.css'), settings.STATIC_URL + paths['app.css'])
+        # References inside the stylesheets point at the hashed names.
+        self.assertIn(os.path.basename(paths['images/logo.png']).encode(), self.read(paths['app.css']))
+
+    def test_precompressed_copies(self):
+        css = staticfiles_storage.stored_name('app.css')
+
+        self.assertEqual(gzip.decompress(self.read(css + '.gz')), self.read(css))
+        # Files too small to gain anything are left alone.
+        self.assertFalse(os.path.exists(os.path.join(self.root, staticfiles_storage.stored_name('tiny.js') + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, staticfiles_storage.stored_name('images/logo.png') + '.gz')))
+
+    def test_images_are_scaled_down(self):
+        logo = Image.open(os.path.join(self.root, staticfiles_storage.stored_name('images/logo.png')))
+
+        self.assertEqual(logo.size, (1600, 400))
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.products = Product.objects.bulk_create([
+            Product(category=category, name='Laptop %d' % i, slug='laptop-%d' % i, price=100 + i) for i in range(4)
+        ])
+        cls.user = User.objects.create_user('buyer')
+        cls.other = User.objects.create_user('other')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def place(self, user=None, items=3):
+        order = Order.objects.create(user=user or self.user, **CHECKOUT_DATA)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, price=product.price * 2, quantity=2) for product in self.products[:items]
+        ])
+        return order
+
+    def count_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('myaccount'), params)
+
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_queries_do_not_grow_with_the_orders(self):
+        self.place(items=1)
+        single, _ = self.count_queries()
+
+        for _ in range(settings.ORDERS_PAGE_SIZE):
+            self.place(items=4)
+        full, response = self.count_queries()
+
+        self.assertEqual(full, single)
+        self.assertEqual(len(response.context['orders']), settings.ORDERS_PAGE_SIZE)
+
+    def test_totals_and_items(self):
+        order = self.place()
+        self.place(user=self.other)
+
+        _, response = self.count_queries()
+
+        (shown,) = response.context['orders']
+        self.assertEqual(shown.pk, order.pk)
+        self.assertEqual(shown.items_total, 2 * (100 + 101 + 102))
+        self.assertEqual([item.product.name for item in shown.items.all()], ['Laptop 0', 'Laptop 1', 'Laptop 2'])
+        self.assertContains(response, 'Total: %s ৳' % shown.items_total)
+
+    def test_older_orders_page(self):
+        orders = [self.place(items=1) for _ in range(settings.ORDERS_PAGE_SIZE + 2)]
+
+        first, response = self.count_queries()
+        older, older_response = self.count_queries(cursor=response.context['orders'].next_cursor)
+
+        self.assertEqual(older, first)
+        self.assertEqual([order.pk for order in older_response.context['orders']], [orders[1].pk, orders[0].pk])
+        self.assertFalse(older_response.context['orders'].has_next)
@@ -1,6 +1,6 @@
 from django.contrib.auth.views import LogoutView, LoginView
 from django.urls import path
-from core.views import frontpage, shop, signup, myaccount, edit_myaccount
+from core.views import frontpage, shop, signup, myaccount, edit_myaccount, metrics
 from product.views import product
 
 
@@ -13,5 +13,6 @@ urlpatterns = [
     path('myaccount/edit', edit_myaccount, name='edit_myaccount'),
     path('shop/', shop, name='shop'),
     path('shop/<slug:slug>/', product, name='product'),
+    path('metrics/', metrics, name='metrics'),
 
 ]
\ No newline at end of file
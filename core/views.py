@@ -1,12 +1,22 @@
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db.models import Prefetch, Sum
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, redirect
-from product.models import Product, Category
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from product import catalog, facets, search
+from product.ratings import rating_average
+from product.models import Product
+from . import metrics as request_metrics
+from .cache import cache_anonymous_page
 from .forms import SignupForm
-from order.models import Order
+from .pagination import KeysetPaginator
+from order.models import Order, OrderItem
 
 # Create your views here.
+@cache_anonymous_page
 def frontpage(request):
     """
     Handles the front page view of the application.
@@ -17,7 +27,7 @@ def frontpage(request):
     Returns:
     HttpResponse: A rendered HTML response for the front page.
     """
-    products = Product.objects.all()[0:8] # Get 8 Products from the database
+    products = catalog.get_latest_products(8) # Get the 8 latest Products from the catalog cache
     return render(request, 'core/home.html', {'products': products})
 
 def signup(request):
@@ -40,52 +50,165 @@ def signup(request):
         form = SignupForm()
     return render(request, 'core/signup.html', {'form': form})
 
+@cache_anonymous_page
 def shop(request):
     """
     Handles the shop view of the application.
 
+    The products are paginated with keyset cursors: newest first when browsing, best match
+    first when searching, best rated first with ?sort=rating. ?min_rating filters on the
+    average rating, ?available and ?price on the availability and the price range. The sidebar
+    shows how many products each category, availability and price range filter leads to (see
+    product/facets.py). HTMX "load more" requests get only the next page of products.
+
     Parameters:
     request (HttpRequest): The current HTTP request.
 
     Returns:
-    HttpResponse: A rendered HTML response for the shop page.
+    HttpResponse: A rendered HTML response for the shop page, or the next page of products for HTMX requests.
     """
-    categories = Category.objects.all()
+    categories = catalog.get_categories()
     products = Product.objects.all()
-    active_category = request.GET.get('category', '')
-    if active_category:
-        products = products.filter(category__slug=active_category)
+    ordering = ('-created_at', '-id')
         
+    # The average rating comes from the aggregates stored on each product, no per-product query.
+    sort = request.GET.get('sort', '')
+    min_rating = request.GET.get('min_rating', '')
+    if sort == 'rating' or min_rating:
+        products = products.annotate(rating_average=rating_average())
+    if min_rating:
+        try:
+            products = products.filter(rating_average__gte=float(min_rating))
+        except ValueError:
+            min_rating = ''
+
     query = request.GET.get('query', '')
     if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query)
-        )
+        products = search.search_queryset(products, query)
+        ordering = ('search_rank', 'id')
+    elif sort == 'rating':
+        ordering = ('-rating_average', '-review_count', '-id')
+
+    # The facet counts are computed over the search before the facet filters narrow it down.
+    searched = products if query or min_rating else None
+
+    active_category = request.GET.get('category', '')
+    category_id = None
+    if active_category:
+        products = products.filter(category__slug=active_category)
+        category_id = next((category.pk for category in categories if category.slug == active_category), None)
+
+    available = {'1': True, '0': False}.get(request.GET.get('available', ''))
+    if available is not None:
+        products = products.filter(available=available)
+
+    price = request.GET.get('price', '')
+    bucket = int(price) if price.isdigit() and int(price) < len(facets.PRICE_BUCKETS) else None
+    if bucket is not None:
+        products = products.annotate(price_bucket=facets.price_bucket_expression()).filter(price_bucket=bucket)
+
+    paginator = KeysetPaginator(products, ordering=ordering, per_page=settings.SHOP_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('cursor'))
+
+    # The query string of the next page keeps the category and the search query.
+    params = request.GET.copy()
+    params['cursor'] = page.next_cursor or ''
         
     context = {
         'categories': categories,
-        'products': products,
-        'active_category': active_category
+        'page': page,
+        'next_query': params.urlencode(),
+        'active_category': active_category,
+        'sort': sort,
+    }
+
+    if not request.headers.get('HX-Request'):
+        # "Load more" requests only render products, they need no sidebar.
+        counts = facets.summarize(
+            facets.get_counts(searched, '%s|%s' % (query, min_rating)),
+            category_id=category_id, available=available, bucket=bucket,
+        )
+        context['facets'] = build_facets(request.GET, categories, counts, active_category, available, bucket)
+
+    if request.headers.get('HX-Request'):
+        response = render(request, 'core/partials/shop_products.html', context)
+    else:
+        response = render(request, 'core/shop.html', context)
+
+    # The same URL returns the full page or just the products depending on this header.
+    patch_vary_headers(response, ['HX-Request'])
+    return response
+
+def build_facets(query_params, categories, counts, active_category, available, bucket):
+    """
+    Builds the filter links of the shop sidebar, with the number of products each one leads to.
+    Clicking the selected value of a facet removes its filter.
+
+    Parameters:
+    query_params (QueryDict): The query string of the current page.
+    categories (list): Every category.
+    counts (dict): The facet counts, see product.facets.summarize.
+    active_category (str): The slug of the selected category.
+    available (bool): The selected availability, or None.
+    bucket (int): The selected price bucket, or None.
+
+    Returns:
+    dict: Lists of links by facet, each a dict with the label, url, count and whether it is selected.
+    """
+    def link(name, value, label, count, selected):
+        params = query_params.copy()
+        params.pop('cursor', None)
+
+        if selected:
+            params.pop(name, None)
+        else:
+            params[name] = value
+
+        return {'label': label, 'url': '?' + params.urlencode(), 'count': count, 'selected': selected}
+
+    return {
+        'categories': [
+            link('category', category.slug, category.name, counts['category'].get(category.pk, 0), category.slug == active_category)
+            for category in categories
+        ],
+        'availability': [
+            link('available', '1' if value else '0', label, counts['available'].get(value, 0), value == available)
+            for value, label in facets.AVAILABILITY
+        ],
+        'prices': [
+            link('price', str(index), facets.price_label(index), counts['price'].get(index, 0), index == bucket)
+            for index in range(len(facets.PRICE_BUCKETS))
+            if counts['price'].get(index) or index == bucket
+        ],
     }
-    return render(request, 'core/shop.html', context)
 
 @login_required
 def myaccount(request):
     """
     Handles the myaccount view of the application.
 
+    The orders are paginated with keyset cursors, newest first. Each page costs two queries
+    however many orders and items it shows: one for the orders with their totals summed in
+    SQL, one for their items joined with the products.
+
     Parameters:
     request (HttpRequest): The current HTTP request.
 
     Returns:
     HttpResponse: A rendered HTML response for the myaccount page.
     """
-    # Retrieve orders associated with the current user
-    orders = Order.objects.filter(user=request.user)
+    # Retrieve orders associated with the current user, with their items and products prefetched
+    orders = (
+        Order.objects.filter(user=request.user)
+        .annotate(items_total=Sum('items__price'))
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    )
+
+    paginator = KeysetPaginator(orders, ordering=('-created_at', '-id'), per_page=settings.ORDERS_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('cursor'))
     
     context = {
-        'orders': orders
+        'orders': page
     }
     
     return render(request, 'core/myaccount.html', context)
@@ -117,4 +240,29 @@ def edit_myaccount(request):
         user.save()
 
         return redirect('myaccount')
-    return render(request, 'core/edit_myaccount.html')
\ No newline at end of file
+    return render(request, 'core/edit_myaccount.html')
+
+
+def metrics(request):
+    """
+    Exposes the request metrics of this process (see core/metrics.py) in the Prometheus text format.
+
+    Only staff users, requests with the METRICS_TOKEN bearer token and the addresses in
+    METRICS_ALLOWED_IPS may read them; everybody else gets a 404.
+
+    Parameters:
+    request (HttpRequest): The current HTTP request.
+
+    Returns:
+    HttpResponse: The metrics as plain text.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    allowed = (
+        request.user.is_staff
+        or (token and constant_time_compare(authorization, 'Bearer %s' % token))
+        or request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    )
+    if not allowed:
+        raise Http404()
+    return HttpResponse(request_metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from order import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the "frequently bought together" recommendations from the whole order history, '
+        'or with --update counts only the orders placed since.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true', help='Only count the orders not counted yet.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows written per query.')
+
+    def handle(self, *args, **options):
+        if options['update']:
+            total = recommendations.update()
+            self.stdout.write(self.style.SUCCESS('Counted the co-purchases of %d new orders.' % total))
+            return
+
+        engine = 'SciPy' if recommendations.sparse is not None else 'Python'
+        total = recommendations.build(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Built the recommendations of %d products (%s).' % (total, engine)))
@@ -12,7 +12,7 @@ class Order(models.Model):
         (ORDERED, 'Ordered'),
         (SHIPPED, 'Shipped'),
     )
-    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
+    user = models.ForeignKey(User, related_name='orders', on_delete=models.CASCADE, blank=True, null=True)
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
     email = models.EmailField()
@@ -26,9 +26,18 @@ class Order(models.Model):
     paid_amount = models.IntegerField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ORDERED)
     payment_intent = models.CharField(max_length=255, blank=True, null=True)
+    checkout_session_id = models.CharField(max_length=255, blank=True, null=True)
+    idempotency_key = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    co_purchases_counted = models.BooleanField(default=False)
     
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # The account page lists the orders of a user newest first.
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            # The recommendations look up the few orders whose co-purchases are not counted yet.
+            models.Index(fields=['id'], condition=models.Q(co_purchases_counted=False), name='order_uncounted_idx'),
+        ]
         
     def get_total_price(self):
         if self.paid_amount:
@@ -43,4 +52,31 @@ class OrderItem(models.Model):
     quantity = models.IntegerField()
     
     def get_total_price(self):
-        return self.price
\ No newline at end of file
+        return self.price
+
+
+# The number of orders in which two products were bought together, in both directions.
+# Maintained by order/recommendations.py.
+class CoPurchase(models.Model):
+    product = models.ForeignKey(Product, related_name='co_purchases', on_delete=models.CASCADE)
+    other = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='co_purchase_unique'),
+        ]
+
+
+# The products most often bought together with a product, best first (rank 0), derived from CoPurchase.
+class Recommendation(models.Model):
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ('product', 'rank')
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_unique_rank'),
+        ]
@@ -0,0 +1,223 @@
+import threading
+import time
+import uuid
+
+import requests
+import stripe
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+
+class PaymentGatewayError(Exception):
+    """
+    Raised when the payment gateway could not create a checkout session.
+    """
+
+
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    """
+    Raised without calling the gateway while its circuit breaker is open.
+    """
+
+
+class CheckoutSession(object):
+    """
+    The part of a gateway checkout session the shop needs.
+    """
+
+    def __init__(self, id, payment_intent=None):
+        self.id = id
+        self.payment_intent = payment_intent
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing service for a while so that its failures do not tie up every worker.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls fail immediately
+    with PaymentGatewayUnavailable. Once `reset_timeout` seconds have passed, one trial call is
+    let through (half-open): if it succeeds the breaker closes again, otherwise it reopens.
+
+    `clock` returns the current time in seconds, time.monotonic by default.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, failure_exceptions=(Exception,), clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_exceptions = failure_exceptions
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                # Let a single trial call through.
+                self.state = self.HALF_OPEN
+                return
+
+            raise PaymentGatewayUnavailable('The payment gateway is unavailable, please try again later.')
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls `func` through the breaker.
+
+        Raises:
+            PaymentGatewayUnavailable: If the breaker is open.
+        """
+        self.before_call()
+
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_exceptions:
+            self.record_failure()
+            raise
+        except Exception:
+            # Errors that are not the service's fault (a rejected request, for example)
+            # prove that it is up.
+            self.record_success()
+            raise
+
+        self.record_success()
+        return result
+
+
+class PaymentGateway(object):
+    """
+    The interface of the payment gateways. The gateway in use is set by the PAYMENT_GATEWAY setting.
+    """
+
+    def create_checkout_session(self, line_items, success_url, cancel_url, idempotency_key=None):
+        """
+        Creates a hosted checkout session.
+
+        Args:
+            line_items (list): The Stripe-style line items (price_data and quantity) to charge.
+            success_url (str): Where the customer is sent after paying.
+            cancel_url (str): Where the customer is sent if they cancel.
+            idempotency_key (str, optional): Makes retries of the same checkout return the same session.
+
+        Returns:
+            CheckoutSession: The created session.
+
+        Raises:
+            PaymentGatewayError: If the session could not be created.
+        """
+        raise NotImplementedError
+
+
+class StripeGateway(PaymentGateway):
+    """
+    Creates Stripe Checkout sessions through one StripeClient per process.
+
+    The client reuses a pooled HTTP session (so TLS connections are kept alive between
+    checkouts), has explicit connect and read timeouts, and sits behind a circuit breaker.
+    """
+
+    def __init__(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.PAYMENT_POOL_SIZE)
+        session.mount('https://', adapter)
+
+        http_client = stripe.RequestsClient(
+            timeout=(settings.PAYMENT_CONNECT_TIMEOUT, settings.PAYMENT_READ_TIMEOUT),
+            session=session,
+        )
+        self.client = stripe.StripeClient(
+            settings.STRIPE_API_KEY_HIDDEN,
+            http_client=http_client,
+            max_network_retries=settings.PAYMENT_MAX_RETRIES,
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.PAYMENT_BREAKER_THRESHOLD,
+            reset_timeout=settings.PAYMENT_BREAKER_RESET_TIMEOUT,
+            failure_exceptions=(stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError),
+        )
+
+    def create_checkout_session(self, line_items, success_url, cancel_url, idempotency_key=None):
+        options = {'idempotency_key': idempotency_key} if idempotency_key else {}
+
+        try:
+            session = self.breaker.call(
+                self.client.v1.checkout.sessions.create,
+                params={
+                    'payment_method_types': ['card'],
+                    'line_items': line_items,
+                    'mode': 'payment',
+                    'success_url': success_url,
+                    'cancel_url': cancel_url,
+                },
+                options=options,
+            )
+        except stripe.StripeError as e:
+            raise PaymentGatewayError(str(e)) from e
+
+        return CheckoutSession(session.id, session.payment_intent)
+
+
+class StubGateway(PaymentGateway):
+    """
+    An in-process stand-in for Stripe, for development and load tests without network access.
+
+    It answers like the real gateway after PAYMENT_STUB_LATENCY seconds, and returns the same
+    session for the same idempotency key.
+    """
+
+    def __init__(self):
+        self.latency = getattr(settings, 'PAYMENT_STUB_LATENCY', 0)
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def create_checkout_session(self, line_items, success_url, cancel_url, idempotency_key=None):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            if idempotency_key and idempotency_key in self.sessions:
+                return self.sessions[idempotency_key]
+
+            token = uuid.uuid4().hex
+            session = CheckoutSession('cs_stub_%s' % token, 'pi_stub_%s' % token)
+
+            if idempotency_key:
+                self.sessions[idempotency_key] = session
+
+        return session
+
+
+_gateway = None
+
+
+def get_gateway():
+    """
+    Returns the payment gateway of this process, created on first use from the PAYMENT_GATEWAY setting.
+    """
+    global _gateway
+
+    if _gateway is None:
+        _gateway = import_string(settings.PAYMENT_GATEWAY)()
+
+    return _gateway
@@ -0,0 +1,314 @@
+import itertools
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import CoPurchase, Order, OrderItem, Recommendation
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy and SciPy are optional: without them the batch build counts pairs in Python.
+    np = sparse = None
+
+logger = logging.getLogger(__name__)
+
+
+# Number of recommendations kept per product.
+TOP_K = getattr(settings, 'RECOMMENDATIONS_TOP_K', 8)
+
+# Number of pairs read per locking query in add_counts(). Each pair is an OR branch of the query:
+# SQLite limits the depth of an expression to 1000.
+LOCK_BATCH_SIZE = 200
+
+_executor = None
+
+
+def pair_counts_python(orders):
+    """
+    Counts how many orders contain each ordered pair of distinct products.
+
+    Args:
+        orders (iterable): The product IDs of each order.
+
+    Returns:
+        dict: A mapping of (product_id, other_id) to the number of orders with both.
+    """
+    counts = Counter()
+
+    for product_ids in orders:
+        counts.update(itertools.permutations(sorted(set(product_ids)), 2))
+
+    return counts
+
+
+def pair_counts_sparse(order_ids, product_ids):
+    """
+    Counts the same pairs as pair_counts_python with sparse matrices: with A the binary
+    order x product matrix, A.T @ A holds the number of orders containing both products of
+    each pair, the diagonal aside.
+
+    Args:
+        order_ids (list): The order of each order item.
+        product_ids (list): The product of each order item.
+
+    Returns:
+        iterator: ((product_id, other_id), count) pairs, read straight from the sparse matrix.
+    """
+    orders, rows = np.unique(np.asarray(order_ids), return_inverse=True)
+    products, columns = np.unique(np.asarray(product_ids), return_inverse=True)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(orders), len(products)),
+    )
+    # A product ordered on two lines of the same order counts once.
+    matrix.data[:] = 1
+
+    co_occurrences = (matrix.T @ matrix).tocoo()
+    mask = co_occurrences.row != co_occurrences.col
+
+    return zip(
+        zip(products[co_occurrences.row[mask]].tolist(), products[co_occurrences.col[mask]].tolist()),
+        co_occurrences.data[mask].tolist(),
+    )
+
+
+def ranked(product_ids=None):
+    """
+    Selects the TOP_K co-purchases of each product in the database, with a window function:
+    the most bought together first, ties going to the lowest ID so the result is stable.
+
+    Args:
+        product_ids (iterable, optional): The products to rank. Defaults to every product.
+
+    Returns:
+        QuerySet: (product_id, other_id, count, rank) tuples, the ranks starting at 1.
+    """
+    rows = CoPurchase.objects.annotate(
+        rank=Window(RowNumber(), partition_by=F('product_id'), order_by=(F('count').desc(), F('other_id').asc())),
+    )
+
+    if product_ids is not None:
+        rows = rows.filter(product_id__in=list(product_ids))
+
+    return rows.filter(rank__lte=TOP_K).values_list('product_id', 'other_id', 'count', 'rank')
+
+
+def write_recommendations(rows, batch_size=5000):
+    """
+    Writes the recommendations selected by ranked().
+
+    Returns:
+        int: The number of products with recommendations.
+    """
+    product_ids = set()
+
+    def generate():
+        for product_id, other_id, count, rank in rows.iterator(chunk_size=batch_size):
+            product_ids.add(product_id)
+            yield Recommendation(product_id=product_id, recommended_id=other_id, score=count, rank=rank - 1)
+
+    Recommendation.objects.bulk_create(generate(), batch_size=batch_size)
+    return len(product_ids)
+
+
+def build(batch_size=5000):
+    """
+    Rebuilds the co-purchase counts and the recommendations from the whole order history.
+
+    The orders counted are marked, so that update() only counts the orders placed since.
+
+    Args:
+        batch_size (int, optional): Number of rows written per query.
+
+    Returns:
+        int: The number of products with recommendations.
+    """
+    with transaction.atomic():
+        # The orders placed during the build are left to the next update().
+        last_order_id = Order.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        items = OrderItem.objects.filter(order_id__lte=last_order_id).order_by('order_id')
+
+        if np is not None:
+            order_ids, product_ids = [], []
+            for order_id, product_id in items.values_list('order_id', 'product_id').iterator(chunk_size=batch_size):
+                order_ids.append(order_id)
+                product_ids.append(product_id)
+            counts = pair_counts_sparse(order_ids, product_ids) if order_ids else ()
+        else:
+            rows = items.values_list('order_id', 'product_id').iterator(chunk_size=batch_size)
+            counts = pair_counts_python(
+                [product_id for _, product_id in group]
+                for _, group in itertools.groupby(rows, key=lambda row: row[0])
+            ).items()
+
+        CoPurchase.objects.all().delete()
+        CoPurchase.objects.bulk_create(
+            (CoPurchase(product_id=product_id, other_id=other_id, count=count) for (product_id, other_id), count in counts),
+            batch_size=batch_size,
+        )
+
+        Recommendation.objects.all().delete()
+        total = write_recommendations(ranked(), batch_size)
+
+        Order.objects.filter(pk__lte=last_order_id, co_purchases_counted=False).update(co_purchases_counted=True)
+
+    return total
+
+
+def update(order_ids=None):
+    """
+    Adds the orders not counted yet to the co-purchase counts, and refreshes the recommendations
+    of their products. The orders are claimed together, locked and marked in one transaction,
+    so concurrent updates never count an order twice.
+
+    The pairs of all the claimed orders are written together: a fixed number of queries
+    whatever the number of orders, plus one locking read per LOCK_BATCH_SIZE pairs.
+
+    Args:
+        order_ids (list, optional): The orders to count. Defaults to every order not counted yet.
+
+    Returns:
+        int: The number of orders counted.
+    """
+    orders = Order.objects.filter(co_purchases_counted=False)
+
+    if order_ids is not None:
+        orders = orders.filter(pk__in=order_ids)
+
+    with transaction.atomic():
+        # Orders locked by a concurrent update are left to it. SQLite has no row locks, but only
+        # one of two transactions reading the same orders can write.
+        claimed = list(orders.select_for_update(skip_locked=True).order_by().values_list('pk', flat=True))
+
+        if not claimed:
+            return 0
+
+        Order.objects.filter(pk__in=claimed).update(co_purchases_counted=True)
+
+        rows = OrderItem.objects.filter(order_id__in=claimed).order_by('order_id').values_list('order_id', 'product_id')
+        counts = pair_counts_python(
+            [product_id for _, product_id in group]
+            for _, group in itertools.groupby(rows, key=lambda row: row[0])
+        )
+
+        if counts:
+            add_counts(counts)
+            refresh({product_id for product_id, _ in counts})
+
+    return len(claimed)
+
+
+def add_counts(counts):
+    """
+    Adds pair counts to the co-purchase counts.
+
+    The missing pairs are created at 0 first and the pairs are then read with a row lock, so
+    that concurrent updates of the same pair wait for each other instead of overwriting each
+    other's counts. Only the pairs in `counts` are read, LOCK_BATCH_SIZE per query. The new
+    counts are written with a single upsert.
+
+    Args:
+        counts (dict): A mapping of (product_id, other_id) to the number of orders to add.
+    """
+    CoPurchase.objects.bulk_create(
+        [CoPurchase(product_id=product_id, other_id=other_id, count=0) for product_id, other_id in counts],
+        ignore_conflicts=True,
+    )
+
+    pairs = list(counts)
+    rows = []
+
+    for start in range(0, len(pairs), LOCK_BATCH_SIZE):
+        condition = Q()
+        for product_id, other_id in pairs[start:start + LOCK_BATCH_SIZE]:
+            condition |= Q(product_id=product_id, other_id=other_id)
+
+        for row in CoPurchase.objects.select_for_update().filter(condition):
+            rows.append(CoPurchase(
+                product_id=row.product_id, other_id=row.other_id, count=row.count + counts[row.product_id, row.other_id],
+            ))
+
+    CoPurchase.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['product', 'other'], update_fields=['count'],
+    )
+
+
+def refresh(product_ids):
+    """
+    Recomputes the recommendations of some products from their co-purchase counts, with one
+    ranking query for all of them.
+    """
+    product_ids = list(product_ids)
+
+    Recommendation.objects.filter(product_id__in=product_ids).delete()
+    write_recommendations(ranked(product_ids))
+
+
+def _run(order_id):
+    try:
+        update([order_id])
+    except Exception:
+        logger.exception('Counting the co-purchases of order %s failed', order_id)
+    finally:
+        # Worker threads have their own database connections; do not leak them.
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recommendations')
+
+    return _executor
+
+
+def schedule(order_id):
+    """
+    Counts the co-purchases of a new order in the background, after the current transaction
+    commits, when RECOMMENDATIONS_ON_ORDER is on. The orders not counted here (the setting is
+    off, or a worker crashed) are counted by the next `manage.py build_recommendations --update`.
+    """
+    if getattr(settings, 'RECOMMENDATIONS_ON_ORDER', False):
+        transaction.on_commit(lambda: get_executor().submit(_run, order_id))
+
+
+def for_products(product_ids, limit=4):
+    """
+    Returns the products most often bought together with the given ones, with a single
+    indexed query over the recommendations table. The given products are left out, and the
+    scores of a product recommended for several of them are added up.
+
+    Args:
+        product_ids (iterable): The IDs of the products viewed or in the cart.
+        limit (int, optional): The maximum number of products returned.
+
+    Returns:
+        list: The recommended products, best first.
+    """
+    product_ids = set(product_ids)
+
+    if not product_ids:
+        return []
+
+    rows = (
+        Recommendation.objects.filter(product_id__in=product_ids, recommended__available=True)
+        .exclude(recommended_id__in=product_ids)
+        .select_related('recommended')
+    )
+    scores = {}
+    products = {}
+
+    for row in rows:
+        scores[row.recommended_id] = scores.get(row.recommended_id, 0) + row.score
+        products[row.recommended_id] = row.recommended
+
+    ranked = sorted(scores, key=lambda product_id: (-scores[product_id], product_id))
+    return [products[product_id] for product_id in ranked[:limit]]
@@ -0,0 +1,30 @@
+from django import template
+
+from order import recommendations
+
+register = template.Library()
+
+
+@register.inclusion_tag('order/partials/recommendations.html')
+def bought_together(product, limit=4):
+    """
+    Renders the products most often bought together with a product, with one indexed query.
+
+    Usage:
+        {% load recommendations %}
+        {% bought_together product %}
+    """
+    return {'products': recommendations.for_products([product.pk], limit)}
+
+
+@register.inclusion_tag('order/partials/recommendations.html')
+def cart_bought_together(cart, limit=4):
+    """
+    Renders the products most often bought together with the contents of a cart, leaving out
+    the products already in it.
+
+    Usage:
+        {% load recommendations %}
+        {% cart_bought_together cart %}
+    """
+    return {'products': recommendations.for_products(cart.lines, limit)}
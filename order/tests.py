@@ -1,3 +1,431 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.benchmark import CHECKOUT_DATA
+from product.models import Category, Product
+
+from . import payments, recommendations, urls
+from .models import CoPurchase, Order, OrderItem, Recommendation
+from .views import astart_order, create_order
+
+
+@override_settings(PAYMENT_GATEWAY='order.payments.StubGateway', RECOMMENDATIONS_ON_ORDER=False)
+class StartOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.product = Product.objects.create(category=category, name='Laptop', slug='laptop', price=100)
+        cls.alice = User.objects.create_user('alice', password='alice')
+        cls.bob = User.objects.create_user('bob', password='bob')
+
+    def setUp(self):
+        payments._gateway = None
+        self.addCleanup(setattr, payments, '_gateway', None)
+
+    def fill_cart(self):
+        # Two of the product: adding puts one in the cart, incrementing makes it two.
+        self.client.get(reverse('cart:add_to_cart', args=[self.product.pk]))
+        self.client.get(reverse('cart:update_cart', args=[self.product.pk, 'increment']))
+
+    def checkout(self, key='key-1'):
+        return self.client.post(
+            reverse('start_order'), json.dumps(CHECKOUT_DATA), content_type='application/json',
+            headers={'Idempotency-Key': key},
+        )
+
+    def cart_count(self):
+        return len(self.client.get(reverse('cart:cart')).context['cart'])
+
+    def test_creates_the_order_and_clears_the_cart(self):
+        self.client.force_login(self.alice)
+        self.fill_cart()
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(response.json()['session']['id'], order.checkout_session_id)
+        self.assertTrue(order.paid)
+        self.assertEqual(order.paid_amount, 200)
+        self.assertEqual([(item.quantity, item.price) for item in order.items.all()], [(2, 200)])
+        self.assertEqual(self.cart_count(), 0)
+
+    def test_repeated_submission_returns_the_same_order(self):
+        self.client.force_login(self.alice)
+        self.fill_cart()
+        first = self.checkout().json()
+
+        self.fill_cart()
+        second = self.checkout()
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first)
+        self.assertEqual(Order.objects.count(), 1)
+        # The replay placed no order, so the cart is kept.
+        self.assertEqual(self.cart_count(), 2)
+
+    def test_key_of_another_user_is_rejected(self):
+        self.client.force_login(self.alice)
+        self.fill_cart()
+        self.checkout()
+
+        self.client.force_login(self.bob)
+        self.fill_cart()
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.get().user, self.alice)
+        self.assertEqual(self.cart_count(), 2)
+
+    def test_losing_racer_opens_no_payment_session(self):
+        # The key was reserved by a submission still waiting for the gateway.
+        Order.objects.create(user=self.alice, idempotency_key='key-1', **CHECKOUT_DATA)
+        self.client.force_login(self.alice)
+        self.fill_cart()
+
+        with mock.patch.object(payments.StubGateway, 'create_checkout_session') as create_session:
+            response = self.checkout()
+
+        self.assertEqual(response.status_code, 409)
+        create_session.assert_not_called()
+        self.assertEqual(self.cart_count(), 2)
+
+    def test_gateway_failure_releases_the_key(self):
+        self.client.force_login(self.alice)
+        self.fill_cart()
+
+        with mock.patch.object(payments.StubGateway, 'create_checkout_session', side_effect=payments.PaymentGatewayError('down')):
+            self.assertEqual(self.checkout().status_code, 503)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.checkout().status_code, 200)
+
+    def test_create_order_race_fallback_is_scoped_to_the_key_owner(self):
+        winner = Order.objects.create(user=self.alice, idempotency_key='key-1', **CHECKOUT_DATA)
+        cart_items = [{'product': self.product, 'quantity': 1}]
+
+        # The pre-check missed the winner's order: the insert hits the unique key.
+        order, created = create_order(self.bob, CHECKOUT_DATA, 'key-1', cart_items, 100)
+
+        self.assertFalse(created)
+        self.assertEqual(order, winner)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class AsyncStartOrderTests(StartOrderTests):
+    """
+    Runs the same checks against astart_order, the view routed when ASYNC_VIEWS is on.
+    """
+
+    def checkout(self, key='key-1'):
+        with mock.patch.object(urls.urlpatterns[0], 'callback', astart_order):
+            return super().checkout(key)
+
+
+class RecommendationTests(TestCase):
+    # The product indexes bought in each order.
+    ORDERS = [(0, 1, 2), (0, 1), (0, 1, 3), (0, 2), (1, 2, 4), (3, 4), (0, 1, 1)]
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.products = Product.objects.bulk_create([
+            Product(category=category, name='Product %d' % i, slug='product-%d' % i, price=10) for i in range(6)
+        ])
+
+    def place(self, indexes):
+        order = Order.objects.create(**CHECKOUT_DATA)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[index], price=10, quantity=1) for index in indexes
+        ])
+        return order
+
+    def recommendations(self):
+        return list(Recommendation.objects.order_by('product_id', 'rank').values_list('product_id', 'recommended_id', 'score', 'rank'))
+
+    def co_purchases(self):
+        return sorted(CoPurchase.objects.values_list('product_id', 'other_id', 'count'))
+
+    def expected_counts(self, orders):
+        return sorted(
+            (self.products[a].pk, self.products[b].pk, count)
+            for (a, b), count in recommendations.pair_counts_python(orders).items()
+        )
+
+    def test_build(self):
+        for indexes in self.ORDERS:
+            self.place(indexes)
+
+        self.assertEqual(recommendations.build(), 5)
+
+        self.assertEqual(self.co_purchases(), self.expected_counts(self.ORDERS))
+        first, second = self.products[0].pk, self.products[1].pk
+        # Product 0 was bought with product 1 four times, with product 2 twice, with product 3 once.
+        self.assertEqual(
+            [row[1:] for row in self.recommendations() if row[0] == first],
+            [(second, 4, 0), (self.products[2].pk, 2, 1), (self.products[3].pk, 1, 2)],
+        )
+        self.assertFalse(Order.objects.filter(co_purchases_counted=False).exists())
+
+    def test_build_keeps_the_top_k(self):
+        self.place(range(6))
+
+        with mock.patch.object(recommendations, 'TOP_K', 2):
+            recommendations.build()
+
+        # Equal counts: the lowest IDs win.
+        self.assertEqual(
+            [row[1] for row in self.recommendations() if row[0] == self.products[5].pk],
+            [self.products[0].pk, self.products[1].pk],
+        )
+        self.assertEqual(Recommendation.objects.count(), 12)
+
+    def test_python_and_sparse_counts_agree(self):
+        if recommendations.np is None:
+            self.skipTest('NumPy and SciPy are not installed.')
+
+        order_ids = [i for i, indexes in enumerate(self.ORDERS) for _ in indexes]
+        product_ids = [index for indexes in self.ORDERS for index in indexes]
+
+        self.assertEqual(
+            dict(recommendations.pair_counts_sparse(order_ids, product_ids)),
+            dict(recommendations.pair_counts_python(self.ORDERS)),
+        )
+
+    def test_build_without_numpy(self):
+        for indexes in self.ORDERS:
+            self.place(indexes)
+
+        recommendations.build()
+        expected = self.recommendations()
+
+        with mock.patch.object(recommendations, 'np', None):
+            recommendations.build()
+
+        self.assertEqual(self.recommendations(), expected)
+
+    def test_update_matches_a_rebuild(self):
+        for indexes in self.ORDERS[:3]:
+            self.place(indexes)
+        recommendations.build()
+
+        for indexes in self.ORDERS[3:]:
+            self.place(indexes)
+
+        self.assertEqual(recommendations.update(), 4)
+        self.assertEqual(recommendations.update(), 0)
+
+        updated = (self.co_purchases(), self.recommendations())
+        recommendations.build()
+        self.assertEqual((self.co_purchases(), self.recommendations()), updated)
+
+    def test_update_runs_a_fixed_number_of_queries(self):
+        small = self.place((0, 1))
+        large = self.place(range(6))
+
+        # Savepoint, claim, mark, items, create the missing pairs, lock, upsert, delete,
+        # rank and insert, release.
+        with self.assertNumQueries(11):
+            recommendations.update([small.pk])
+        with self.assertNumQueries(11):
+            recommendations.update([large.pk])
+
+        self.assertEqual(self.co_purchases(), self.expected_counts([(0, 1), range(6)]))
+
+    def test_update_of_many_orders_runs_the_same_queries(self):
+        orders = [indexes for _ in range(10) for indexes in self.ORDERS]
+        for indexes in orders:
+            self.place(indexes)
+
+        with self.assertNumQueries(11):
+            self.assertEqual(recommendations.update(), len(orders))
+
+        self.assertEqual(self.co_purchases(), self.expected_counts(orders))
+
+    def test_update_locks_only_the_counted_pairs(self):
+        # Pairs among the products of the new orders that the orders do not contain.
+        self.place((0, 1, 2, 3))
+        recommendations.build()
+        self.place((0, 1))
+        self.place((2, 3))
+
+        with mock.patch.object(recommendations, 'LOCK_BATCH_SIZE', 1), CaptureQueriesContext(connection) as queries:
+            recommendations.update()
+
+        locking = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "order_copurchase"' in query['sql'] and 'ROW_NUMBER' not in query['sql']
+        ]
+        # One read per pair of the two orders (0-1, 1-0, 2-3, 3-2), none for 0-2, 1-3 and the others.
+        self.assertEqual(len(locking), 4)
+        self.assertEqual(self.co_purchases(), self.expected_counts([(0, 1, 2, 3), (0, 1), (2, 3)]))
+
+    def test_schedule(self):
+        order = self.place((0, 1))
+
+        for enabled in (False, True):
+            with self.subTest(enabled=enabled), override_settings(RECOMMENDATIONS_ON_ORDER=enabled), \
+                    mock.patch.object(recommendations, 'get_executor') as get_executor, \
+                    self.captureOnCommitCallbacks(execute=True):
+                recommendations.schedule(order.pk)
+
+            self.assertEqual(get_executor().submit.called, enabled)
+
+    def test_for_products(self):
+        for indexes in self.ORDERS:
+            self.place(indexes)
+        recommendations.build()
+        product_ids = [self.products[0].pk, self.products[1].pk]
+
+        with self.assertNumQueries(1):
+            recommended = recommendations.for_products(product_ids, limit=2)
+
+        # Product 2 was bought with 0 twice and with 1 twice, product 3 once with each.
+        self.assertEqual(recommended, [self.products[2], self.products[3]])
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ServiceDown(Exception):
+    pass
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = payments.CircuitBreaker(
+            failure_threshold=3, reset_timeout=30, failure_exceptions=(ServiceDown,), clock=self.clock,
+        )
+        self.service = mock.Mock(return_value='ok')
+
+    def fail(self, times=1):
+        self.service.side_effect = ServiceDown
+
+        for _ in range(times):
+            with self.assertRaises(ServiceDown):
+                self.breaker.call(self.service)
+
+        self.service.side_effect = None
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        # A success resets the count of consecutive failures.
+        self.assertEqual(self.breaker.call(self.service), 'ok')
+        self.fail(2)
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.CLOSED)
+
+        self.fail()
+
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.OPEN)
+        self.service.reset_mock()
+        with self.assertRaises(payments.PaymentGatewayUnavailable):
+            self.breaker.call(self.service)
+        self.service.assert_not_called()
+
+    def test_half_open_trial_closes_the_breaker(self):
+        self.fail(3)
+
+        self.clock.now += 29.9
+        with self.assertRaises(payments.PaymentGatewayUnavailable):
+            self.breaker.call(self.service)
+
+        self.clock.now += 0.1
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.HALF_OPEN)
+        # Only one trial call at a time.
+        with self.assertRaises(payments.PaymentGatewayUnavailable):
+            self.breaker.call(self.service)
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.call(self.service), 'ok')
+        # Closed again: it takes the full threshold to reopen.
+        self.fail(2)
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens_the_breaker(self):
+        self.fail(3)
+        self.clock.now += 30
+
+        self.fail()
+
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.OPEN)
+        self.clock.now += 29
+        with self.assertRaises(payments.PaymentGatewayUnavailable):
+            self.breaker.call(self.service)
+        self.clock.now += 1
+        self.assertEqual(self.breaker.call(self.service), 'ok')
+        self.assertEqual(self.breaker.state, payments.CircuitBreaker.CLOSED)
+
+    def test_other_errors_do_not_count(self):
+        self.fail(2)
+        self.service.side_effect = ValueError
+
+        with self.assertRaises(ValueError):
+            self.breaker.call(self.service)
+
+        self.assertEqual(self.breaker.failures, 0)
+
+
+@override_settings(
+    PAYMENT_CONNECT_TIMEOUT=2, PAYMENT_READ_TIMEOUT=7, PAYMENT_MAX_RETRIES=3, PAYMENT_POOL_SIZE=4,
+    PAYMENT_BREAKER_THRESHOLD=2, PAYMENT_BREAKER_RESET_TIMEOUT=15,
+)
+class StripeGatewayTests(SimpleTestCase):
+    def create_session(self, gateway):
+        return gateway.create_checkout_session([], 'https://shop/success', 'https://shop/cancel', idempotency_key='key')
+
+    def test_client_configuration(self):
+        with mock.patch.object(payments, 'HTTPAdapter', wraps=payments.HTTPAdapter) as adapter, \
+                mock.patch.object(payments.stripe, 'RequestsClient') as requests_client, \
+                mock.patch.object(payments.stripe, 'StripeClient') as stripe_client:
+            gateway = payments.StripeGateway()
+
+        session = requests_client.call_args.kwargs['session']
+        self.assertEqual(requests_client.call_args.kwargs['timeout'], (2, 7))
+        self.assertEqual(adapter.call_args.kwargs['pool_maxsize'], 4)
+        self.assertIsInstance(session.get_adapter('https://api.stripe.com'), payments.HTTPAdapter)
+        self.assertEqual(stripe_client.call_args.kwargs['http_client'], requests_client.return_value)
+        self.assertEqual(stripe_client.call_args.kwargs['max_network_retries'], 3)
+        self.assertEqual((gateway.breaker.failure_threshold, gateway.breaker.reset_timeout), (2, 15))
+
+    def test_connection_errors_open_the_breaker(self):
+        gateway = payments.StripeGateway()
+        create = mock.Mock(side_effect=stripe.APIConnectionError('timed out'))
+
+        with mock.patch.object(gateway, 'client') as client:
+            client.v1.checkout.sessions.create = create
+
+            for _ in range(2):
+                with self.assertRaises(payments.PaymentGatewayError):
+                    self.create_session(gateway)
+            with self.assertRaises(payments.PaymentGatewayUnavailable):
+                self.create_session(gateway)
+
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(create.call_args.kwargs['options'], {'idempotency_key': 'key'})
+
+    def test_rejected_requests_do_not_open_the_breaker(self):
+        gateway = payments.StripeGateway()
+
+        with mock.patch.object(gateway, 'client') as client:
+            client.v1.checkout.sessions.create.side_effect = stripe.InvalidRequestError('bad line items', 'line_items')
+
+            for _ in range(3):
+                with self.assertRaises(payments.PaymentGatewayError):
+                    self.create_session(gateway)
+
+        self.assertEqual(gateway.breaker.state, payments.CircuitBreaker.CLOSED)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path
-from .views import start_order
+from .views import astart_order, start_order
 
 urlpatterns = [
-    path('start_order/', start_order, name='start_order'),
+    # Served by an ASGI server, checkout runs as an async view.
+    path('start_order/', astart_order if settings.ASYNC_VIEWS else start_order, name='start_order'),
 ]
@@ -1,30 +1,175 @@
 import json
-import stripe
 
-from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
+from django.urls import reverse
 
-from cart.cart import Cart
+from cart.cart import aget_cart, get_cart
 
+from . import recommendations
 from .models import Order, OrderItem
+from .payments import PaymentGatewayError, get_gateway
+
+
+def order_response(order):
+    """
+    Returns the JSON response describing the payment session of an order.
+    """
+    return JsonResponse({'session': {'id': order.checkout_session_id}, 'order': order.payment_intent})
+
+
+def replay_response(order, user):
+    """
+    Returns the response to a checkout whose idempotency key is already taken by an order.
+
+    Only the customer who placed the order gets it back: a key used by someone else is
+    rejected. While the first submission is still waiting for its payment session, the
+    client is asked to retry.
+    """
+    if order.user_id != (user.pk if user is not None else None):
+        return JsonResponse({'error': 'Idempotency key already used'}, status=422)
+
+    if not order.checkout_session_id:
+        return JsonResponse({'error': 'Order is being processed, please retry'}, status=409)
+
+    return order_response(order)
+
 
 def start_order(request):
     """
     Creates a new order based on the provided cart and payment information.
 
+    The cart is read once, and the order and all of its items are written in one transaction
+    (the items with a single bulk INSERT). The payment session comes from the configured
+    payment gateway (see order/payments.py). When the request carries an idempotency key (the
+    `Idempotency-Key` header or an `idempotency_key` field), a repeated submission returns the
+    order created by the first one instead of creating another.
+
+    The order is written before the gateway is called, so that it reserves the idempotency key:
+    of two concurrent submissions only the one that created the order opens a payment session
+    and clears the cart. The order is deleted again if the gateway fails, so the customer can
+    retry with the same key.
+
     Args:
         request: The HTTP request containing the cart and payment data.
 
     Returns:
         A JsonResponse containing the payment session and order details.
     """
-    cart = Cart(request)
+    cart = get_cart(request)
     data = json.loads(request.body)
-    total_price = 0
+    user = request.user if request.user.is_authenticated else None
+    idempotency_key = get_idempotency_key(request, data)
+
+    if idempotency_key:
+        order = Order.objects.filter(idempotency_key=idempotency_key).first()
+
+        if order is not None:
+            return replay_response(order, user)
+
+    # Read the cart once: the products come from a single batched query.
+    cart_items = list(cart)
+
+    if not cart_items:
+        return JsonResponse({'error': 'Cart is empty'}, status=400)
+
+    items, total_price = build_line_items(cart_items)
+    order, created = create_order(user, data, idempotency_key, cart_items, total_price)
+
+    if not created:
+        return replay_response(order, user)
+
+    try:
+        session = get_gateway().create_checkout_session(
+            line_items=items,
+            success_url=request.build_absolute_uri(reverse('cart:success')),
+            cancel_url=request.build_absolute_uri(reverse('cart:cart')),
+            idempotency_key=idempotency_key,
+        )
+    except PaymentGatewayError as e:
+        order.delete()
+        return JsonResponse({'error': str(e)}, status=503)
+
+    confirm_order(order, session)
+
+    cart.clear()
+
+    return order_response(order)
+
+
+async def astart_order(request):
+    """
+    The async version of start_order, routed instead of it when ASYNC_VIEWS is on.
+
+    The session, the user and the cart are loaded with the async APIs, and the worker keeps
+    serving other requests while the payment gateway answers: the gateway call runs in a
+    thread of its own. The order is written in one transaction, which Django only runs
+    synchronously.
+    """
+    cart = await aget_cart(request)
+    data = json.loads(request.body)
+    user = await request.auser()
+    user = user if user.is_authenticated else None
+    idempotency_key = get_idempotency_key(request, data)
+
+    if idempotency_key:
+        order = await Order.objects.filter(idempotency_key=idempotency_key).afirst()
+
+        if order is not None:
+            return replay_response(order, user)
+
+    await cart.aget_products()
+    cart_items = list(cart)
 
+    if not cart_items:
+        return JsonResponse({'error': 'Cart is empty'}, status=400)
+
+    items, total_price = build_line_items(cart_items)
+    order, created = await sync_to_async(create_order)(user, data, idempotency_key, cart_items, total_price)
+
+    if not created:
+        return replay_response(order, user)
+
+    try:
+        session = await sync_to_async(get_gateway().create_checkout_session, thread_sensitive=False)(
+            line_items=items,
+            success_url=request.build_absolute_uri(reverse('cart:success')),
+            cancel_url=request.build_absolute_uri(reverse('cart:cart')),
+            idempotency_key=idempotency_key,
+        )
+    except PaymentGatewayError as e:
+        await order.adelete()
+        return JsonResponse({'error': str(e)}, status=503)
+
+    await sync_to_async(confirm_order)(order, session)
+
+    cart.clear()
+
+    return order_response(order)
+
+
+def get_idempotency_key(request, data):
+    """
+    Returns the idempotency key of a checkout: the `Idempotency-Key` header or the `idempotency_key` field.
+    """
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key') or None
+
+
+def build_line_items(cart_items):
+    """
+    Builds the line items of the payment session from the items of the cart.
+
+    Args:
+        cart_items (list): The items of the cart, with their products.
+
+    Returns:
+        tuple: The line items for the payment gateway, and the total price of the cart.
+    """
+    total_price = 0
     items = []
 
-    for item in cart:
+    for item in cart_items:
         product = item['product']
         total_price += product.price * int(item['quantity'])
 
@@ -38,38 +183,60 @@ def start_order(request):
             },
             'quantity': item['quantity']
         })
-    
-    stripe.api_key = settings.STRIPE_API_KEY_HIDDEN
-    session = stripe.checkout.Session.create(
-        payment_method_types=['card'],
-        line_items=items,
-        mode='payment',
-        success_url='https://consoles-ct-experiences-hang.trycloudflare.com/cart/success/',
-        cancel_url='https://consoles-ct-experiences-hang.trycloudflare.com/cart/'
-    )
-    payment_intent = session.payment_intent
-
-    order = Order.objects.create(
-        user=request.user, 
-        first_name=data['first_name'], 
-        last_name=data['last_name'], 
-        email=data['email'], 
-        phone=data['phone'], 
-        address=data['address'], 
-        zipcode=data['zipcode'], 
-        city=data['city'],
-        payment_intent=payment_intent,
-        paid=True,
-        paid_amount=total_price
-    )
-
-    for item in cart:
-        product = item['product']
-        quantity = int(item['quantity'])
-        price = product.price * quantity
 
-        item = OrderItem.objects.create(order=order, product=product, price=price, quantity=quantity)
+    return items, total_price
 
-    cart.clear()
 
-    return JsonResponse({'session': session, 'order': payment_intent})
\ No newline at end of file
+def create_order(user, data, idempotency_key, cart_items, total_price):
+    """
+    Writes the order and its items in one transaction, before its payment session exists.
+
+    Returns:
+        tuple: The order, and whether this call created it. With an idempotency key already
+            taken by a concurrent submission, the order of that submission is returned instead.
+    """
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                user=user, 
+                first_name=data['first_name'], 
+                last_name=data['last_name'], 
+                email=data['email'], 
+                phone=data['phone'], 
+                address=data['address'], 
+                zipcode=data['zipcode'], 
+                city=data['city'],
+                idempotency_key=idempotency_key,
+                paid_amount=total_price
+            )
+
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=item['product'],
+                    price=item['product'].price * int(item['quantity']),
+                    quantity=int(item['quantity']),
+                )
+                for item in cart_items
+            ])
+    except IntegrityError:
+        # A concurrent submission with the same idempotency key won the race.
+        if not idempotency_key:
+            raise
+
+        return Order.objects.get(idempotency_key=idempotency_key), False
+
+    return order, True
+
+
+def confirm_order(order, session):
+    """
+    Stores the payment session of an order created by create_order.
+    """
+    order.payment_intent = session.payment_intent
+    order.checkout_session_id = session.id
+    order.paid = True
+    order.save(update_fields=['payment_intent', 'checkout_session_id', 'paid'])
+
+    # Count the products bought together once the order is committed.
+    recommendations.schedule(order.pk)
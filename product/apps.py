@@ -17,3 +17,6 @@ class ProductConfig(AppConfig):
     # This setting is used by Django to identify the 'product' app.
     name = 'product'
 
+    def ready(self):
+        # Connect the signal handlers that keep the catalog version up to date.
+        from . import signals  # noqa: F401
@@ -0,0 +1,141 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import metrics
+
+from .models import Category, Product
+
+
+# The cache key holding the current catalog version.
+VERSION_KEY = 'catalog:version'
+
+# How long a cached entry is served as fresh, in seconds.
+CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+# How long an expired entry is kept around to be served while it is being rebuilt, in seconds.
+STALE_TIMEOUT = getattr(settings, 'CATALOG_STALE_TIMEOUT', 3600)
+
+# How long a worker may hold the rebuild lock of an entry, in seconds.
+LOCK_TIMEOUT = 30
+
+
+def get_version():
+    """
+    Returns the current catalog version.
+
+    The version is a counter kept in Django's cache and bumped whenever a product or a category
+    changes, so anything derived from catalog data can be checked for staleness with a single
+    cache lookup. It starts from a timestamp so that a cache flush never hands out a version
+    that was already in use.
+
+    Returns:
+        int: The current catalog version.
+    """
+    version = cache.get(VERSION_KEY)
+
+    if version is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+
+    return version
+
+
+def bump_version():
+    """
+    Invalidates everything derived from the catalog by incrementing the catalog version.
+
+    Returns:
+        int: The new catalog version.
+    """
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # The key was evicted, start a fresh version.
+        get_version()
+        return cache.incr(VERSION_KEY)
+
+
+def get_or_build(key, build, timeout=CACHE_TIMEOUT):
+    """
+    Read-through cache lookup with stampede protection.
+
+    Entries are stored as (catalog_version, expires_at, value). An entry is fresh while it was
+    built at the current catalog version and has not expired. When it is stale, the first worker
+    to take the rebuild lock rebuilds it while the others keep serving the stale value. Only a
+    cold miss, where there is nothing to serve, makes a worker build the value without the lock.
+
+    Args:
+        key (str): The cache key of the entry.
+        build (callable): Builds the value from the database.
+        timeout (int, optional): How long the entry stays fresh, in seconds.
+
+    Returns:
+        The cached or freshly built value.
+    """
+    version = get_version()
+    entry = cache.get(key)
+    lock_key = '%s:lock' % key
+    locked = False
+
+    if entry is not None:
+        entry_version, expires_at, value = entry
+
+        if entry_version == version and expires_at > time.time():
+            metrics.record_cache(True)
+            return value
+
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+
+        if not locked:
+            metrics.record_cache(True)
+            return value
+
+    metrics.record_cache(False)
+
+    try:
+        value = build()
+        cache.set(key, (version, time.time() + timeout, value), STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+    return value
+
+
+def get_product(pk):
+    """
+    Returns the product with the given ID, or None if it does not exist.
+    """
+    return get_or_build(
+        'catalog:product:%s' % pk,
+        lambda: Product.objects.filter(pk=pk).first(),
+    )
+
+
+def get_product_by_slug(slug):
+    """
+    Returns the product with the given slug, or None if it does not exist.
+    """
+    return get_or_build(
+        'catalog:product-slug:%s' % slug,
+        lambda: Product.objects.filter(slug=slug).first(),
+    )
+
+
+def get_categories():
+    """
+    Returns the list of all categories.
+    """
+    return get_or_build('catalog:categories', lambda: list(Category.objects.all()))
+
+
+def get_latest_products(count):
+    """
+    Returns the `count` most recently created products.
+    """
+    return get_or_build(
+        'catalog:latest:%s' % count,
+        lambda: list(Product.objects.all()[0:count]),
+    )
@@ -0,0 +1,192 @@
+import hashlib
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from . import catalog
+from .models import FacetCount, Product
+
+
+# The lower bounds of the price ranges of the shop sidebar. The last range has no upper bound.
+PRICE_BUCKETS = (0, 50, 100, 250, 500, 1000, 2500)
+
+AVAILABILITY = ((True, 'In stock'), (False, 'Out of stock'))
+
+# The currency symbol of the shop, as printed by the templates.
+CURRENCY = '৳'
+
+
+def price_bucket(price):
+    """
+    Returns the index in PRICE_BUCKETS of the range a price falls in.
+    """
+    price = Decimal(str(price))
+    bucket = 0
+
+    for index, bound in enumerate(PRICE_BUCKETS):
+        if price >= bound:
+            bucket = index
+
+    return bucket
+
+
+def price_bucket_expression():
+    """
+    Returns an expression computing price_bucket in the database, for grouping products.
+    """
+    return Case(
+        *[When(price__lt=bound, then=Value(index - 1)) for index, bound in enumerate(PRICE_BUCKETS) if index],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def price_label(bucket):
+    """
+    Returns the label of a price range, with the currency after the amount like the catalog templates print prices.
+    """
+    low = PRICE_BUCKETS[bucket]
+
+    if bucket + 1 < len(PRICE_BUCKETS):
+        return '%d - %d %s' % (low, PRICE_BUCKETS[bucket + 1], CURRENCY)
+
+    return '%d+ %s' % (low, CURRENCY)
+
+
+def facet_key(category_id, available, price):
+    """
+    Returns the facet count a product is counted in, or None if its fields are not known
+    (a product loaded with only() or defer()).
+    """
+    if category_id is None or available is None or price is None:
+        return None
+
+    return category_id, bool(available), price_bucket(price)
+
+
+def update_counts(old_key=None, new_key=None):
+    """
+    Moves a product between facet counts, with one UPDATE per changed count.
+
+    The counts are changed with F-expressions, so concurrent saves never overwrite each other's
+    changes. A count row is only created for an increment: a decrement of a missing row means
+    its category is being deleted.
+
+    Args:
+        old_key (tuple, optional): The facet key before the change; None when a product is created.
+        new_key (tuple, optional): The facet key after the change; None when a product is deleted.
+    """
+    if old_key == new_key:
+        return
+
+    for key, delta in ((old_key, -1), (new_key, 1)):
+        if key is None:
+            continue
+
+        category_id, available, bucket = key
+        counts = FacetCount.objects.filter(category_id=category_id, available=available, price_bucket=bucket)
+
+        if counts.update(count=F('count') + delta) or delta < 0:
+            continue
+
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(category_id=category_id, available=available, price_bucket=bucket, count=delta)
+        except IntegrityError:
+            # Another request created the row first.
+            counts.update(count=F('count') + delta)
+
+
+def grouped_counts(products):
+    """
+    Counts products per facet key with a single grouped query.
+
+    Returns:
+        list: (category_id, available, price_bucket, count) tuples.
+    """
+    return list(
+        products.order_by()
+        .annotate(price_bucket=price_bucket_expression())
+        .values_list('category_id', 'available', 'price_bucket')
+        .annotate(count=Count('pk'))
+    )
+
+
+def rebuild_counts():
+    """
+    Recomputes the whole count table from the products, for data written without signals
+    (bulk imports, generated data).
+
+    Returns:
+        int: The number of count rows.
+    """
+    rows = grouped_counts(Product.objects.all())
+
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([
+            FacetCount(category_id=category_id, available=available, price_bucket=bucket, count=count)
+            for category_id, available, bucket, count in rows
+        ])
+
+    return len(rows)
+
+
+def get_counts(products=None, cache_key=''):
+    """
+    Returns the facet counts of a product search, cached until the catalog changes.
+
+    Browsing without a search reads the maintained count table, which has one row per category,
+    availability and price bucket whatever the size of the catalog. A search counts its results
+    with one grouped query.
+
+    Args:
+        products (QuerySet, optional): The products searched, with every filter applied except the
+            facets themselves. None for the whole catalog.
+        cache_key (str, optional): Identifies the search, for caching its counts.
+
+    Returns:
+        list: (category_id, available, price_bucket, count) tuples.
+    """
+    if products is None:
+        return catalog.get_or_build(
+            'catalog:facets',
+            lambda: list(FacetCount.objects.filter(count__gt=0).values_list('category_id', 'available', 'price_bucket', 'count')),
+        )
+
+    digest = hashlib.md5(cache_key.encode()).hexdigest()
+    return catalog.get_or_build('catalog:facets:%s' % digest, lambda: grouped_counts(products))
+
+
+def summarize(rows, category_id=None, available=None, bucket=None):
+    """
+    Turns facet counts into the counts shown next to each filter.
+
+    The count of a filter value is the number of results when the other facets keep their
+    current filters and this facet takes that value, so selecting a category still shows the
+    counts of the other categories.
+
+    Args:
+        rows (list): The facet counts, see get_counts.
+        category_id (int, optional): The selected category.
+        available (bool, optional): The selected availability.
+        bucket (int, optional): The selected price bucket.
+
+    Returns:
+        dict: Counts by category ID ('category'), by availability ('available') and by price
+            bucket ('price').
+    """
+    summary = {'category': {}, 'available': {}, 'price': {}}
+    selected = {'category': category_id, 'available': available, 'price': bucket}
+
+    for row_category, row_available, row_bucket, count in rows:
+        values = {'category': row_category, 'available': row_available, 'price': row_bucket}
+
+        for facet, value in values.items():
+            others = [other for other in values if other != facet]
+
+            if all(selected[other] is None or selected[other] == values[other] for other in others):
+                summary[facet][value] = summary[facet].get(value, 0) + count
+
+    return summary
@@ -0,0 +1,420 @@
+import csv
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils.text import slugify
+
+from . import catalog, facets, search, thumbnails
+from .models import Category, Product
+
+
+# The product fields an import sets; the others (ratings, creation date) are left alone.
+IMPORT_FIELDS = ['category', 'name', 'description', 'price', 'available', 'image']
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+FALSE_VALUES = ('0', 'false', 'no', 'n', 'f', '')
+
+
+class RowError(ValueError):
+    """
+    Raised for a row of the import file that cannot be imported.
+    """
+
+
+def read_rows(path, fmt=None):
+    """
+    Streams the rows of a CSV (with a header line) or JSON Lines file as dicts, one at a time,
+    so files of any size are read in constant memory.
+
+    Args:
+        path (str): The file to read.
+        fmt (str, optional): 'csv' or 'jsonl'. Defaults to the extension of the file.
+
+    Yields:
+        dict: A row. A JSON Lines row that is not valid JSON is yielded as a RowError.
+    """
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield RowError('invalid JSON: %s' % e)
+
+
+def clean_row(row):
+    """
+    Validates a row and converts its values.
+
+    Required: slug, name, category (a category name; its slug is derived from it unless a
+    category_slug is given) and price. Optional: description, available and image (the path
+    of a local image file; a product keeps its current image when it is empty).
+
+    Args:
+        row (dict): The raw row.
+
+    Returns:
+        dict: The cleaned row.
+
+    Raises:
+        RowError: If the row is invalid.
+    """
+    if isinstance(row, RowError):
+        raise row
+
+    if not isinstance(row, dict):
+        raise RowError('expected an object, got %s' % type(row).__name__)
+
+    def value(name):
+        return str(row.get(name) or '').strip()
+
+    slug = value('slug')
+    name = value('name')
+    category = value('category')
+
+    if not slug or not name or not category:
+        raise RowError('slug, name and category are required')
+
+    try:
+        validate_slug(slug)
+    except ValidationError:
+        raise RowError('invalid slug %r' % slug)
+
+    if len(name) > 255 or len(category) > 255:
+        raise RowError('name and category are limited to 255 characters')
+
+    try:
+        price = Decimal(value('price')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError('invalid price %r' % value('price'))
+
+    if price < 0 or price >= Decimal('1e10'):
+        raise RowError('price out of range: %s' % price)
+
+    available = value('available').lower() if 'available' in row else 'true'
+    if available not in TRUE_VALUES + FALSE_VALUES:
+        raise RowError('invalid available flag %r' % available)
+
+    category_slug = value('category_slug') or slugify(category)
+    if not category_slug:
+        raise RowError('cannot derive a slug from category %r' % category)
+
+    return {
+        'slug': slug,
+        'name': name,
+        'category': category,
+        'category_slug': category_slug,
+        'description': value('description'),
+        'price': price,
+        'available': available in TRUE_VALUES,
+        'image': value('image'),
+    }
+
+
+class Checkpoint(object):
+    """
+    Remembers how many rows of an input file have been imported, so that an interrupted
+    import resumes after the last committed batch. The checkpoint is tied to the size and
+    modification time of the file: a changed file starts over.
+    """
+
+    def __init__(self, path, input_path):
+        self.path = path
+        stat = os.stat(input_path)
+        self.key = {'input': os.path.abspath(input_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def load(self):
+        """
+        Returns the number of rows already imported.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+        if data.get('file') != self.key:
+            return 0
+
+        return data.get('rows', 0)
+
+    def save(self, rows):
+        # Write a new file and move it into place, so a crash never leaves a truncated checkpoint.
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as f:
+            json.dump({'file': self.key, 'rows': rows}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CatalogImporter(object):
+    """
+    Imports products from a stream of rows, in batches.
+
+    Each batch is validated, its categories resolved (missing ones are created) and its
+    products upserted by slug with one bulk_create and one bulk_update, in one transaction.
+    Model signals do not fire for bulk writes, so the search index is updated per batch, and
+    the facet counts rebuilt and the catalog version bumped once at the end.
+
+    Images are stored once per content hash, and their thumbnail variants are rendered in a
+    process pool while the next batches are imported. A product only gets its image_hash,
+    which makes the pages use the variants, once they are stored. Images whose variants
+    already exist are not rendered again.
+
+    Args:
+        batch_size (int, optional): Number of rows written per transaction.
+        workers (int, optional): Number of processes rendering thumbnails, 0 to skip them.
+        images_dir (str, optional): The directory image paths are relative to.
+        progress (callable, optional): Called with the stats after every batch.
+    """
+
+    def __init__(self, batch_size=1000, workers=None, images_dir='', progress=None):
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.images_dir = images_dir
+        self.progress = progress or (lambda stats: None)
+        self.categories = {category.slug: category for category in Category.objects.all()}
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'invalid': 0, 'images': 0, 'thumbnails': 0}
+        self.errors = []
+        # The renderings in flight by image hash: the future and the IDs of the products waiting for it.
+        self.pending = {}
+        # The image hashes whose variants this import stored.
+        self.rendered = set()
+        # The image hash each product of the current batch waits for, by slug.
+        self.rendering = {}
+        self.executor = None
+
+    def run(self, rows, checkpoint=None, skip=0):
+        """
+        Imports the rows.
+
+        Args:
+            rows (iterable): The raw rows, see read_rows.
+            checkpoint (Checkpoint, optional): Updated after every committed batch.
+            skip (int, optional): Number of leading rows to skip, already imported by an earlier run.
+
+        Returns:
+            dict: The import stats: rows read, products created and updated, invalid rows,
+                images stored and thumbnail sets rendered.
+        """
+        if self.workers:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        self.stats['rows'] = skip
+        batch = []
+
+        try:
+            for number, row in enumerate(rows, 1):
+                if number <= skip:
+                    continue
+
+                batch.append((number, row))
+
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+                    if checkpoint is not None:
+                        checkpoint.save(self.stats['rows'])
+
+            if batch:
+                self.import_batch(batch)
+                if checkpoint is not None:
+                    checkpoint.save(self.stats['rows'])
+
+            self.collect_thumbnails(wait_all=True)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+
+        facets.rebuild_counts()
+        catalog.bump_version()
+        return self.stats
+
+    def import_batch(self, batch):
+        cleaned = {}
+
+        for number, row in batch:
+            try:
+                # The last row wins when a slug appears twice in a batch.
+                row = clean_row(row)
+                cleaned[row['slug']] = row
+            except RowError as e:
+                self.stats['invalid'] += 1
+                self.errors.append('row %d: %s' % (number, e))
+
+        with transaction.atomic():
+            self.resolve_categories(cleaned.values())
+            products = self.upsert(cleaned)
+
+        search.get_backend().index(products)
+
+        self.stats['rows'] += len(batch)
+        self.collect_thumbnails()
+        self.progress(self.stats)
+
+    def resolve_categories(self, rows):
+        missing = {}
+
+        for row in rows:
+            if row['category_slug'] not in self.categories:
+                missing[row['category_slug']] = Category(name=row['category'], slug=row['category_slug'])
+
+        if missing:
+            Category.objects.bulk_create(missing.values(), ignore_conflicts=True)
+            for category in Category.objects.filter(slug__in=list(missing)):
+                self.categories[category.slug] = category
+
+    def upsert(self, rows):
+        """
+        Creates or updates the products of a batch, keyed by slug.
+
+        Returns:
+            list: The created and updated products.
+        """
+        existing = Product.objects.in_bulk(list(rows), field_name='slug')
+        created = []
+        updated = []
+
+        for slug, row in rows.items():
+            product = existing.get(slug) or Product(slug=slug)
+            product.category = self.categories[row['category_slug']]
+            product.name = row['name']
+            product.description = row['description']
+            product.price = row['price']
+            product.available = row['available']
+
+            if row['image']:
+                self.attach_image(product, row['image'])
+
+            if product.pk is None:
+                created.append(product)
+            else:
+                updated.append(product)
+
+        Product.objects.bulk_create(created, batch_size=self.batch_size)
+        Product.objects.bulk_update(updated, IMPORT_FIELDS + ['image_hash'], batch_size=self.batch_size)
+
+        # bulk_create sets the primary keys on SQLite and PostgreSQL; look them up elsewhere.
+        if any(product.pk is None for product in created):
+            ids = dict(Product.objects.filter(slug__in=[p.slug for p in created]).values_list('slug', 'pk'))
+            for product in created:
+                product.pk = ids[product.slug]
+
+        # Point the products at the variants rendered before their primary keys were known, and
+        # attach the others to their pending renderings.
+        done = {}
+
+        for product in created + updated:
+            digest = self.rendering.pop(product.slug, None)
+
+            if digest in self.pending:
+                self.pending[digest][1].append(product.pk)
+            elif digest in self.rendered:
+                done.setdefault(digest, []).append(product.pk)
+
+        for digest, product_ids in done.items():
+            Product.objects.filter(pk__in=product_ids).update(image_hash=digest)
+
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+        return created + updated
+
+    def attach_image(self, product, path):
+        """
+        Stores the image of a product under a name derived from its content, and schedules the
+        rendering of its thumbnails if they do not exist yet.
+        """
+        path = os.path.join(self.images_dir, path)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            self.errors.append('%s: cannot read image %s: %s' % (product.slug, path, e))
+            return
+
+        digest = thumbnails.content_hash(data)
+
+        if product.image_hash == digest:
+            return
+
+        name = 'uploads/%s%s' % (digest, os.path.splitext(path)[1].lower())
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(data))
+            self.stats['images'] += 1
+
+        product.image = name
+
+        variants = [thumbnails.variant_name(digest, size, fmt) for size in thumbnails.SIZES for fmt in thumbnails.get_formats()]
+
+        if all(default_storage.exists(variant) for variant in variants):
+            product.image_hash = digest
+            return
+
+        # The pages use the full image until the variants are stored (see Product.get_thumbnail).
+        # Without workers the build_thumbnails command renders them later.
+        product.image_hash = ''
+
+        if self.executor is None:
+            return
+
+        self.rendering[product.slug] = digest
+
+        if digest not in self.pending and digest not in self.rendered:
+            # Keep the number of images in flight bounded, whatever the size of the import.
+            while len(self.pending) >= self.workers * 4:
+                self.collect_thumbnails(block=True)
+
+            self.pending[digest] = (self.executor.submit(thumbnails.render_variants, data), [])
+
+    def collect_thumbnails(self, block=False, wait_all=False):
+        """
+        Stores the variants rendered by the process pool, and points their products at them.
+
+        Args:
+            block (bool, optional): Wait for at least one rendering to finish.
+            wait_all (bool, optional): Wait for every rendering to finish.
+        """
+        if not self.pending:
+            return
+
+        futures = {future: digest for digest, (future, _) in self.pending.items()}
+
+        if wait_all:
+            wait(futures)
+        elif block:
+            wait(futures, return_when=FIRST_COMPLETED)
+
+        for future, digest in futures.items():
+            if not future.done():
+                continue
+
+            _, product_ids = self.pending.pop(digest)
+
+            try:
+                thumbnails.store_variants(digest, future.result())
+            except Exception as e:
+                # The products keep an empty image_hash: the build_thumbnails command retries them.
+                self.errors.append('image %s: rendering the thumbnails failed: %s' % (digest, e))
+                continue
+
+            self.rendered.add(digest)
+            Product.objects.filter(pk__in=product_ids).update(image_hash=digest)
+            self.stats['thumbnails'] += 1
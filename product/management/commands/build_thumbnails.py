@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from product.models import Product
+from product.thumbnails import build_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Builds the thumbnail variants of product images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Render and overwrite the variants of every product with an image, even existing ones.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+
+        if not options['all']:
+            products = products.filter(image_hash='')
+
+        built = 0
+
+        for product_id in products.values_list('pk', flat=True).iterator():
+            if build_thumbnails(product_id, force=options['all']):
+                built += 1
+
+        self.stdout.write(self.style.SUCCESS('Built thumbnails for %d products.' % built))
@@ -0,0 +1,61 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.importer import CatalogImporter, Checkpoint, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports products from a CSV or JSON Lines file, creating or updating them by slug. '
+        'An interrupted import resumes after the last committed batch.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The CSV (with a header line) or JSON Lines file to import.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='The file format. Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows written per transaction.')
+        parser.add_argument('--workers', type=int, default=None, help='Processes rendering thumbnails, 0 to leave them to build_thumbnails. Defaults to the number of CPUs.')
+        parser.add_argument('--images-dir', default='', help='The directory the image paths of the rows are relative to.')
+        parser.add_argument('--checkpoint', help='The checkpoint file. Defaults to the path of the input with .checkpoint appended.')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and import the whole file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+
+        if not os.path.isfile(path):
+            raise CommandError('%s does not exist.' % path)
+
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        checkpoint = Checkpoint(options['checkpoint'] or '%s.checkpoint' % path, path)
+        skip = 0 if options['restart'] else checkpoint.load()
+
+        if skip:
+            self.stdout.write('Resuming after row %d.' % skip)
+
+        start = time.perf_counter()
+
+        def progress(stats):
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%(rows)d rows: %(created)d created, %(updated)d updated, %(invalid)d invalid' % stats
+                              + ', %.0f rows/s' % ((stats['rows'] - skip) / elapsed if elapsed else 0))
+
+        importer = CatalogImporter(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            images_dir=options['images_dir'],
+            progress=progress,
+        )
+        stats = importer.run(read_rows(path, options['format']), checkpoint=checkpoint, skip=skip)
+        checkpoint.clear()
+
+        for error in importer.errors:
+            self.stderr.write(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %(rows)d rows: %(created)d products created, %(updated)d updated, %(invalid)d invalid rows; '
+            '%(images)d images stored, %(thumbnails)d thumbnail sets rendered.' % stats
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from product import catalog
+from product.facets import rebuild_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the facet counts of the shop sidebar (products per category, availability and price range).'
+
+    def handle(self, *args, **options):
+        total = rebuild_counts()
+        catalog.bump_version()
+
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d facet counts.' % total))
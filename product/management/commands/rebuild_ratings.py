@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from product import catalog
+from product.ratings import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized rating aggregates (count, sum, histogram) of every product from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of products written per query.')
+
+    def handle(self, *args, **options):
+        total = rebuild_aggregates(batch_size=options['batch_size'])
+        catalog.bump_version()
+
+        self.stdout.write(self.style.SUCCESS('Rebuilt the rating aggregates of %d reviewed products.' % total))
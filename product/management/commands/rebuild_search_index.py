@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from product.models import Product
+from product.search import InMemoryBackend, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from the whole catalog, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of products indexed per batch.')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        batch_size = options['batch_size']
+
+        if isinstance(backend, InMemoryBackend):
+            self.stdout.write(self.style.WARNING(
+                'The in-memory search index lives in each web process and is rebuilt on first use; '
+                'nothing to do here.'
+            ))
+            return
+
+        backend.clear()
+
+        last_pk = 0
+        indexed = 0
+        products = Product.objects.only('pk', 'name', 'description').order_by('pk')
+
+        # Walk the catalog by primary key so that every batch is an indexed range scan.
+        while True:
+            batch = list(products.filter(pk__gt=last_pk)[:batch_size])
+
+            if not batch:
+                break
+
+            backend.index(batch)
+            last_pk = batch[-1].pk
+            indexed += len(batch)
+            self.stdout.write('Indexed %d products' % indexed)
+
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt (%d products).' % indexed))
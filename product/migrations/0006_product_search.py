@@ -0,0 +1,37 @@
+from django.db import migrations, OperationalError
+
+
+def create_search_table(apps, schema_editor):
+    # The full-text index is an SQLite FTS5 virtual table. On other databases, or when SQLite
+    # was built without FTS5, it is skipped and product.search falls back to its in-memory index.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS product_search "
+            "USING fts5(name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    except OperationalError:
+        return
+
+    schema_editor.execute(
+        "INSERT INTO product_search (rowid, name, description) "
+        "SELECT id, name, COALESCE(description, '') FROM product_product"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_product_thumbnail'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_slugs(apps, schema_editor):
+    """
+    Makes the category and product slugs unique before the constraints are added: every
+    duplicate but the oldest row gets its id appended to its slug.
+    """
+    for model_name in ('Category', 'Product'):
+        model = apps.get_model('product', model_name)
+        duplicates = (
+            model.objects.values('slug')
+            .annotate(count=Count('id'))
+            .filter(count__gt=1)
+            .values_list('slug', flat=True)
+        )
+        for slug in list(duplicates):
+            for obj in model.objects.filter(slug=slug).order_by('id')[1:]:
+                obj.slug = '%s-%d' % (slug, obj.id)
+                obj.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_product_rating_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created_by'], name='review_product_author_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+
+
+# The price buckets when this migration was written, a copy of product.facets.PRICE_BUCKETS: the
+# migration must not change if the buckets do. A later change of the buckets rebuilds the counts
+# with `manage.py rebuild_facets`.
+PRICE_BUCKETS = (0, 50, 100, 250, 500, 1000, 2500)
+
+
+def fill_counts(apps, schema_editor):
+    """
+    Counts the existing products per category, availability and price bucket.
+    """
+    Product = apps.get_model('product', 'Product')
+    FacetCount = apps.get_model('product', 'FacetCount')
+
+    rows = (
+        Product.objects.order_by()
+        .annotate(price_bucket=Case(
+            *[When(price__lt=bound, then=Value(index - 1)) for index, bound in enumerate(PRICE_BUCKETS) if index],
+            default=Value(len(PRICE_BUCKETS) - 1),
+            output_field=IntegerField(),
+        ))
+        .values_list('category_id', 'available', 'price_bucket')
+        .annotate(count=Count('pk'))
+    )
+    FacetCount.objects.bulk_create([
+        FacetCount(category_id=category_id, available=available, price_bucket=bucket, count=count)
+        for category_id, available, bucket, count in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available', models.BooleanField()),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='product.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'available', 'price_bucket'), name='facet_count_unique')],
+            },
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,5 @@
 # This file contains the models for the product and review app.
-# Each product has a category, name, slug, description, price, availability, creation date, image, and thumbnail.
+# Each product has a category, name, slug, description, price, availability, creation date, image, thumbnail, image hash and rating aggregates.
 # Each review has a product, rating, content, creator, and creation date.
 
 from django.db import models
@@ -8,11 +8,13 @@ from PIL import Image
 from io import BytesIO
 from django.contrib.auth.models import User
 
+from . import thumbnails
+
 # Define the Category model.
 # A category has a name and a slug.
 class Category(models.Model):
     name = models.CharField(max_length=255)  # The name of the category.
-    slug = models.SlugField()  # The slug used in the URL.
+    slug = models.SlugField(unique=True)  # The slug used in the URL.
     
     class Meta:
         ordering = ('name',)  # Categories are ordered by name.
@@ -24,41 +26,69 @@ class Category(models.Model):
     
 
 # Define the Product model.
-# A product has a category, name, slug, description, price, availability, creation date, image, and thumbnail.
+# A product has a category, name, slug, description, price, availability, creation date, image, thumbnail, image hash and rating aggregates.
+# The rating aggregates are maintained by product/ratings.py whenever a review is created, edited or deleted.
 class Product(models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)  # The category of the product.
     name = models.CharField(max_length=255)  # The name of the product.
-    slug = models.SlugField()  # The slug used in the URL.
+    slug = models.SlugField(unique=True)  # The slug used in the URL.
     description = models.TextField(blank=True, null=True)  # The description of the product.
     price = models.DecimalField(max_digits=12, decimal_places=2)  # The price of the product.
     available = models.BooleanField(default=True)  # Whether the product is available.
     created_at = models.DateTimeField(auto_now_add=True)  # The date and time the product was created.
     image = models.ImageField(upload_to='uploads/', blank=True, null=True)  # The image of the product.
     thumbnail = models.ImageField(upload_to='uploads/', blank=True, null=True)  # The thumbnail of the product.
+    image_hash = models.CharField(max_length=16, blank=True, default='')  # The content hash naming the thumbnail variants of the image.
+    review_count = models.PositiveIntegerField(default=0)  # The number of reviews of the product.
+    rating_sum = models.PositiveIntegerField(default=0)  # The sum of the ratings of all reviews.
+    rating_1 = models.PositiveIntegerField(default=0)  # The number of 1 star reviews.
+    rating_2 = models.PositiveIntegerField(default=0)  # The number of 2 star reviews.
+    rating_3 = models.PositiveIntegerField(default=0)  # The number of 3 star reviews.
+    rating_4 = models.PositiveIntegerField(default=0)  # The number of 4 star reviews.
+    rating_5 = models.PositiveIntegerField(default=0)  # The number of 5 star reviews.
 
     class Meta:
         ordering = ('-created_at',)  # Products are ordered by creation date in descending order.
+        indexes = [
+            # The shop pages list products newest first, the id breaks ties between the keyset cursors.
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ]
 
     def __str__(self):
         return self.name  # Return the name of the product when it is converted to a string.
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Remember the stored facet fields so that a save can move the product between facet counts.
+        product._stored_facet = tuple(product.__dict__.get(field) for field in ('category_id', 'available', 'price'))
+        return product
     
     def get_display_price(self):
         return self.price  # Return the price of the product.
     
-    def get_thumbnail(self):
-        if self.image:  # If the product has an image,
-            return self.image.url  # return the URL of the image.
-        else:  # If the product does not have an image,
-            if self.image:  # if there is an image file,
-                self.thumbnail = self.make_thumbnail(self.image)  # create a thumbnail from the image.
-                self.save()  # save the thumbnail to the database.
-                return self.thumbnail.url  # return the URL of the thumbnail.
-            else:  # if there is no image file,
-                return 'https://via.placeholder.com/240x240.jpg'  # return a placeholder image URL.
+    def get_thumbnail(self, size='listing', fmt='jpeg'):
+        if self.image_hash:  # If the thumbnail variants of the image have been built,
+            return thumbnails.variant_url(self.image_hash, size, fmt)  # return the URL of the requested variant.
+        elif self.image:  # If they are not built yet but there is an image file,
+            return self.image.url  # return the URL of the full-size image.
+        else:  # if there is no image file,
+            return thumbnails.PLACEHOLDER_URL  # return a placeholder image URL.
+
+    def get_srcset(self, fmt='jpeg'):
+        # Return a srcset listing every thumbnail variant of the given format with its width.
+        if not self.image_hash:
+            return ''
+
+        return ', '.join(
+            '%s %sw' % (thumbnails.variant_url(self.image_hash, size, fmt), width)
+            for size, width in sorted(thumbnails.SIZES.items(), key=lambda item: item[1])
+        )
             
     def make_thumbnail(self, image, size=(300, 300)):
         img = Image.open(image)  # Open the image file.
-        img.convert('RGB')  # Convert the image to RGB format.
+        img = img.convert('RGB')  # Convert the image to RGB format.
         img.thumbnail(size)  # Create a thumbnail of the specified size.
         thumb_io = BytesIO()  # Create a buffer to store the thumbnail.
         img.save(thumb_io, 'JPEG', quality=85)  # Save the thumbnail to the buffer in JPEG format.
@@ -66,26 +96,49 @@ class Product(models.Model):
         return thumbnail  # Return the thumbnail.
     
     def get_rating(self):
-        reviews_total = 0  # Initialize the total rating of the product to 0.
-        
-        # Iterate over all reviews of the product and add up the ratings.
-        for review in self.reviews.all():
-            reviews_total += review.rating
-            
-            # If there are any reviews, calculate and return the average rating of the product.
-            if reviews_total > 0:
-                return reviews_total / self.reviews.count()
-            
-            return 0  # If there are no reviews, return 0 as the rating.
+        if self.review_count:  # If there are any reviews,
+            return self.rating_sum / self.review_count  # return the average rating from the stored aggregates.
+
+        return 0  # If there are no reviews, return 0 as the rating.
     
 
 
+# Define the FacetCount model.
+# A facet count is the number of products of a category with a given availability and price bucket.
+# The counts are maintained by product/facets.py whenever a product is created, edited or deleted.
+class FacetCount(models.Model):
+    category = models.ForeignKey(Category, related_name='facet_counts', on_delete=models.CASCADE)  # The category of the products.
+    available = models.BooleanField()  # Whether the products are available.
+    price_bucket = models.PositiveSmallIntegerField()  # The index of the price range of the products in facets.PRICE_BUCKETS.
+    count = models.IntegerField(default=0)  # The number of products.
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'available', 'price_bucket'], name='facet_count_unique'),
+        ]
+
+
 # Define the Review model.
 # A review has a product, rating, content, creator, and creation date.
 class Review(models.Model):
+    MIN_RATING = 1
+    MAX_RATING = 5
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')  # The product being reviewed.
     rating = models.IntegerField(default=4)  # The rating given to the product.
     content = models.TextField()  # The content of the review.
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews' )  # The user who created the review.
     created_at = models.DateTimeField(auto_now_add=True)  # The date and time the review was created.
 
+    class Meta:
+        indexes = [
+            # The product page looks up the review of the current user to edit it in place.
+            models.Index(fields=['product', 'created_by'], name='review_product_author_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        review = super().from_db(db, field_names, values)
+        # Remember the stored rating so that an edit can move the review between histogram buckets.
+        review._stored_rating = review.__dict__.get('rating')
+        return review
@@ -0,0 +1,117 @@
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+
+from .models import Product, Review
+
+
+def clean_rating(value, default=4):
+    """
+    Converts a submitted rating to an int between Review.MIN_RATING and Review.MAX_RATING.
+    """
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        rating = default
+
+    return min(max(rating, Review.MIN_RATING), Review.MAX_RATING)
+
+
+def update_aggregates(product_id, old_rating=None, new_rating=None):
+    """
+    Applies a review change to the rating aggregates of a product in a single UPDATE.
+
+    The counters are updated with F-expressions, so concurrent reviews of the same product
+    never overwrite each other's changes.
+
+    Args:
+        product_id (int): The ID of the reviewed product.
+        old_rating (int, optional): The rating before the change; None when a review is created.
+        new_rating (int, optional): The rating after the change; None when a review is deleted.
+
+    Returns:
+        None
+    """
+    changes = {}
+    buckets = {}
+
+    if old_rating is not None:
+        changes['review_count'] = F('review_count') - 1
+        changes['rating_sum'] = F('rating_sum') - old_rating
+        buckets[old_rating] = buckets.get(old_rating, 0) - 1
+
+    if new_rating is not None:
+        changes['review_count'] = changes.get('review_count', F('review_count')) + 1
+        changes['rating_sum'] = changes.get('rating_sum', F('rating_sum')) + new_rating
+        buckets[new_rating] = buckets.get(new_rating, 0) + 1
+
+    for rating, delta in buckets.items():
+        if delta and Review.MIN_RATING <= rating <= Review.MAX_RATING:
+            field = 'rating_%d' % rating
+            changes[field] = F(field) + delta
+
+    if changes:
+        Product.objects.filter(pk=product_id).update(**changes)
+
+
+def rating_average():
+    """
+    Returns an expression computing the average rating of a product from its aggregates
+    (0 for products without reviews), for annotating, filtering and sorting product querysets.
+    """
+    return Case(
+        When(review_count=0, then=Value(0.0)),
+        default=ExpressionWrapper(F('rating_sum') * 1.0 / F('review_count'), output_field=FloatField()),
+        output_field=FloatField(),
+    )
+
+
+def rebuild_aggregates(product_ids=None, batch_size=1000):
+    """
+    Recomputes the rating aggregates of products from their reviews.
+
+    The aggregates are computed with one grouped query over the reviews and written back with
+    bulk_update in batches; products without reviews are reset with a single UPDATE.
+
+    Args:
+        product_ids (list, optional): The products to rebuild. Defaults to every product.
+        batch_size (int, optional): Number of products written per query.
+
+    Returns:
+        int: The number of products with reviews.
+    """
+    stars = range(Review.MIN_RATING, Review.MAX_RATING + 1)
+    fields = ['review_count', 'rating_sum'] + ['rating_%d' % rating for rating in stars]
+
+    products = Product.objects.all()
+    reviews = Review.objects.order_by()
+
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        reviews = reviews.filter(product_id__in=product_ids)
+
+    rows = reviews.values('product_id').annotate(
+        review_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{'rating_%d' % rating: Count('id', filter=Q(rating=rating)) for rating in stars}
+    )
+
+    total = 0
+
+    with transaction.atomic():
+        products.update(**{field: 0 for field in fields})
+
+        batch = []
+
+        for row in rows.iterator():
+            batch.append(Product(pk=row.pop('product_id'), **row))
+
+            if len(batch) >= batch_size:
+                Product.objects.bulk_update(batch, fields)
+                total += len(batch)
+                batch = []
+
+        if batch:
+            Product.objects.bulk_update(batch, fields)
+            total += len(batch)
+
+    return total
@@ -0,0 +1,350 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from math import log
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.models import Case, FloatField, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+
+# The name of the SQLite FTS5 virtual table (created by migration 0006 when FTS5 is available).
+FTS_TABLE = 'product_search'
+
+# The maximum number of ranked IDs SearchBackend.search() returns. Shop searches on the FTS5 backend
+# are not capped: the match runs in the product query, after the other filters.
+MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+
+# How much more a match in the name counts than a match in the description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase word tokens.
+    """
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class SearchBackend(object):
+    """
+    The interface every search backend implements.
+
+    Backends return product IDs ranked by relevance; filtering (by category, availability, ...)
+    stays in the ORM, see `search_queryset`.
+    """
+
+    def filter(self, queryset, query):
+        """
+        Restricts a product queryset to the products matching the query, annotated with
+        `search_rank` (lower is better).
+
+        This default ranks the IDs returned by search(), so only the MAX_RESULTS best matches
+        are kept, before the filters of the queryset apply. Backends that can run the match in
+        the database override it.
+        """
+        product_ids = self.search(query)
+
+        if not product_ids:
+            return queryset.annotate(search_rank=Value(0, output_field=IntegerField())).none()
+
+        rank = Case(
+            *[When(pk=product_id, then=Value(position)) for position, product_id in enumerate(product_ids)],
+            output_field=IntegerField(),
+        )
+
+        return queryset.filter(pk__in=product_ids).annotate(search_rank=rank)
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Returns the IDs of the products matching every word of the query, best match first.
+        The last word also matches as a prefix.
+        """
+        raise NotImplementedError
+
+    def index(self, products):
+        """
+        Adds or replaces the given products in the index.
+        """
+        raise NotImplementedError
+
+    def remove(self, product_ids):
+        """
+        Removes the given product IDs from the index.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Removes everything from the index.
+        """
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    Searches an SQLite FTS5 virtual table ranked with bm25.
+    """
+
+    @classmethod
+    def is_available(cls):
+        """
+        Checks that the database is SQLite and that the FTS5 table exists.
+        """
+        if connection.vendor != 'sqlite':
+            return False
+
+        try:
+            return FTS_TABLE in connection.introspection.table_names()
+        except OperationalError:
+            return False
+
+    def build_match(self, tokens):
+        # Quote every token so that user input can never be parsed as FTS5 syntax.
+        terms = ['"%s"' % token for token in tokens]
+        terms[-1] += '*'
+        return ' AND '.join(terms)
+
+    def filter(self, queryset, query):
+        """
+        Joins the FTS5 table to the product query: the match, the bm25 rank and the filters of
+        the queryset run in one SQL query, so every match is found whatever its rank, and
+        keyset pagination and facet counts work on the whole result.
+        """
+        tokens = tokenize(query)
+
+        if not tokens:
+            return queryset.annotate(search_rank=Value(0, output_field=FloatField())).none()
+
+        opts = queryset.model._meta
+        quote = connection.ops.quote_name
+
+        return queryset.annotate(
+            search_rank=RawSQL('bm25(%s, %s, %s)' % (FTS_TABLE, NAME_WEIGHT, DESCRIPTION_WEIGHT), (), output_field=FloatField()),
+        ).extra(
+            tables=[FTS_TABLE],
+            where=[
+                '%s MATCH %%s' % FTS_TABLE,
+                '%s.rowid = %s.%s' % (FTS_TABLE, quote(opts.db_table), quote(opts.pk.column)),
+            ],
+            params=[self.build_match(tokens)],
+        )
+
+    def search(self, query, limit=MAX_RESULTS):
+        tokens = tokenize(query)
+
+        if not tokens:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY bm25(%s, %s, %s) LIMIT %%s'
+                % (FTS_TABLE, FTS_TABLE, FTS_TABLE, NAME_WEIGHT, DESCRIPTION_WEIGHT),
+                [self.build_match(tokens), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, products):
+        products = list(products)
+
+        if not products:
+            return
+
+        self.remove([product.pk for product in products])
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, name, description) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                [(product.pk, product.name, product.description or '') for product in products],
+            )
+
+    def remove(self, product_ids):
+        product_ids = list(product_ids)
+
+        if not product_ids:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, ', '.join(['%s'] * len(product_ids))),
+                product_ids,
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+
+
+class InMemoryBackend(SearchBackend):
+    """
+    A pure-Python inverted index, used when FTS5 is not available.
+
+    The index lives in the process: it is built from the database on the first search and kept
+    up to date by the product signals. Scores are tf-idf with name matches weighted higher.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None  # token -> {product_id: weight}
+        self.documents = {}  # product_id -> set of tokens
+        self.vocabulary = []  # sorted tokens, for prefix lookups
+
+    def ensure_built(self):
+        if self.postings is not None:
+            return
+
+        with self.lock:
+            if self.postings is None:
+                self.postings = defaultdict(dict)
+                self.documents = {}
+
+                for product in Product.objects.only('pk', 'name', 'description').iterator():
+                    self.add_document(product)
+
+                self.vocabulary = sorted(self.postings)
+
+    def add_document(self, product):
+        weights = defaultdict(float)
+
+        for token in tokenize(product.name):
+            weights[token] += NAME_WEIGHT
+
+        for token in tokenize(product.description):
+            weights[token] += DESCRIPTION_WEIGHT
+
+        for token, weight in weights.items():
+            self.postings[token][product.pk] = weight
+
+        self.documents[product.pk] = set(weights)
+
+    def remove_document(self, product_id):
+        for token in self.documents.pop(product_id, ()):
+            postings = self.postings.get(token)
+
+            if postings is not None:
+                postings.pop(product_id, None)
+
+                if not postings:
+                    del self.postings[token]
+
+    def expand(self, token):
+        # All the indexed tokens starting with `token`.
+        start = bisect_left(self.vocabulary, token)
+        end = start
+
+        while end < len(self.vocabulary) and self.vocabulary[end].startswith(token):
+            end += 1
+
+        return self.vocabulary[start:end]
+
+    def search(self, query, limit=MAX_RESULTS):
+        tokens = tokenize(query)
+
+        if not tokens:
+            return []
+
+        self.ensure_built()
+
+        with self.lock:
+            total = len(self.documents) or 1
+            scores = None
+
+            for position, token in enumerate(tokens):
+                candidates = self.expand(token) if position == len(tokens) - 1 else [token]
+                token_scores = defaultdict(float)
+
+                for candidate in candidates:
+                    postings = self.postings.get(candidate, {})
+                    idf = log(1 + total / (1 + len(postings)))
+
+                    for product_id, weight in postings.items():
+                        token_scores[product_id] += weight * idf
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pk: score + token_scores[pk] for pk, score in scores.items() if pk in token_scores}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [product_id for product_id, score in ranked[:limit]]
+
+    def index(self, products):
+        if self.postings is None:
+            # Not built yet: the first search loads everything from the database anyway.
+            return
+
+        with self.lock:
+            for product in products:
+                self.remove_document(product.pk)
+                self.add_document(product)
+
+            self.vocabulary = sorted(self.postings)
+
+    def remove(self, product_ids):
+        if self.postings is None:
+            return
+
+        with self.lock:
+            for product_id in product_ids:
+                self.remove_document(product_id)
+
+            self.vocabulary = sorted(self.postings)
+
+    def clear(self):
+        with self.lock:
+            self.postings = defaultdict(dict)
+            self.documents = {}
+            self.vocabulary = []
+
+
+_backend = None
+
+
+def get_backend():
+    """
+    Returns the search backend configured by the SEARCH_BACKEND setting.
+
+    With the default 'auto', the SQLite FTS5 backend is used when its table exists and the
+    in-memory inverted index otherwise. Any other value is the dotted path of a backend class.
+
+    Returns:
+        SearchBackend: The search backend of this process.
+    """
+    global _backend
+
+    if _backend is None:
+        path = getattr(settings, 'SEARCH_BACKEND', 'auto')
+
+        if path != 'auto':
+            _backend = import_string(path)()
+        elif SQLiteFTSBackend.is_available():
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = InMemoryBackend()
+
+    return _backend
+
+
+def search_queryset(queryset, query):
+    """
+    Restricts a product queryset to the products matching a search query, ordered by relevance.
+
+    The match is made by the search backend; any filter applied to the queryset, before or
+    after, is kept. Each product is annotated with `search_rank`, lower ranks matching better.
+
+    Args:
+        queryset (QuerySet): The products to search in.
+        query (str): The search query.
+
+    Returns:
+        QuerySet: The matching products, best match first.
+    """
+    return get_backend().filter(queryset, query).order_by('search_rank')
@@ -0,0 +1,109 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog, facets, ratings, search, thumbnails
+from .models import Category, Product, Review
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_catalog_version(sender, **kwargs):
+    """
+    Bumps the catalog version once a product or a category is saved or deleted and the
+    transaction commits. Bumping before the commit would let another worker rebuild an entry
+    from the old rows and store it under the new version.
+    """
+    transaction.on_commit(catalog.bump_version)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """
+    Adds or refreshes a saved product in the search index once the transaction commits.
+    """
+    transaction.on_commit(lambda: search.get_backend().index([instance]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """
+    Removes a deleted product from the search index once the transaction commits.
+    """
+    product_id = instance.pk
+    transaction.on_commit(lambda: search.get_backend().remove([product_id]))
+
+
+@receiver(post_save, sender=Product)
+def schedule_thumbnails(sender, instance, **kwargs):
+    """
+    Builds the thumbnail variants of a saved product's image in the background.
+    """
+    if instance.image:
+        thumbnails.schedule(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, created, **kwargs):
+    """
+    Moves a created or edited product into the facet count of its category, availability and price.
+    """
+    new_key = facets.facet_key(instance.category_id, instance.available, instance.price)
+    stored = getattr(instance, '_stored_facet', None)
+
+    if created:
+        facets.update_counts(new_key=new_key)
+    elif stored is None or new_key is None or None in stored:
+        # The previous facet is unknown (the product was not loaded from the database, or only partly).
+        transaction.on_commit(facets.rebuild_counts)
+    else:
+        facets.update_counts(facets.facet_key(*stored), new_key)
+
+    instance._stored_facet = (instance.category_id, instance.available, instance.price)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_facet_counts(sender, instance, **kwargs):
+    """
+    Removes a deleted product from its facet count.
+    """
+    stored = getattr(instance, '_stored_facet', None) or (instance.category_id, instance.available, instance.price)
+    facets.update_counts(old_key=facets.facet_key(*stored))
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_aggregates(sender, instance, created, **kwargs):
+    """
+    Updates the rating aggregates of the product when a review is created or edited.
+    """
+    rating = int(instance.rating)
+    stored_rating = getattr(instance, '_stored_rating', None)
+
+    if created:
+        ratings.update_aggregates(instance.product_id, new_rating=rating)
+    elif stored_rating is None:
+        # The previous rating is unknown (the review was not loaded from the database).
+        ratings.rebuild_aggregates([instance.product_id])
+    elif stored_rating != rating:
+        ratings.update_aggregates(instance.product_id, old_rating=stored_rating, new_rating=rating)
+    else:
+        return
+
+    instance._stored_rating = rating
+    transaction.on_commit(catalog.bump_version)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_aggregates(sender, instance, **kwargs):
+    """
+    Updates the rating aggregates of the product when a review is deleted.
+    """
+    rating = getattr(instance, '_stored_rating', None)
+
+    if rating is None:
+        rating = int(instance.rating)
+
+    ratings.update_aggregates(instance.product_id, old_rating=rating)
+    transaction.on_commit(catalog.bump_version)
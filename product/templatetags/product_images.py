@@ -0,0 +1,27 @@
+from django import template
+
+from product import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('product/partials/picture.html')
+def product_picture(product, size='listing', css_class=''):
+    """
+    Renders a <picture> element for a product image.
+
+    Browsers that support WebP get the WebP variants, the others the JPEG ones, and the srcset
+    lets them pick the variant that fits the rendered size and pixel density.
+
+    Usage:
+        {% load product_images %}
+        {% product_picture product 'listing' 'w-full rounded-xl' %}
+    """
+    return {
+        'product': product,
+        'src': product.get_thumbnail(size),
+        'srcset': product.get_srcset('jpeg'),
+        'webp_srcset': product.get_srcset('webp') if 'webp' in thumbnails.get_formats() else '',
+        'sizes': '%spx' % thumbnails.SIZES[size],
+        'css_class': css_class,
+    }
@@ -1,3 +1,679 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from . import catalog, facets, ratings, search, thumbnails
+from .importer import CatalogImporter, Checkpoint, read_rows
+from .models import Category, FacetCount, Product, Review
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.product = Product.objects.create(category=cls.category, name='Laptop', slug='laptop', price=100)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_are_cached(self):
+        catalog.get_product(self.product.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.get_product(self.product.pk), self.product)
+
+    def test_saves_invalidate_the_cache(self):
+        self.assertEqual(catalog.get_product(self.product.pk).price, 100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.get(pk=self.product.pk)
+            product.price = 150
+            product.save()
+
+        self.assertEqual(catalog.get_product(self.product.pk).price, 150)
+
+    def test_version_is_bumped_after_the_commit(self):
+        version = catalog.get_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Phones', slug='phones')
+            # Until the commit, an entry rebuilt by another worker would hold the old rows.
+            self.assertEqual(catalog.get_version(), version)
+
+        self.assertGreater(catalog.get_version(), version)
+        self.assertEqual([category.slug for category in catalog.get_categories()], ['laptops', 'phones'])
+
+    def test_rolled_back_changes_keep_the_version(self):
+        version = catalog.get_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.product.delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(catalog.get_version(), version)
+
+
+class HotQueryIndexTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        # --fail raises CommandError if a hot query scans a whole table.
+        call_command('explain_hot_queries', '--fail', stdout=io.StringIO())
+
+
+class MigrationTestMixin(object):
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+
+class IndexMigrationTests(MigrationTestMixin, TransactionTestCase):
+    before = [('product', '0008_product_rating_aggregates')]
+    after = [('product', '0009_indexes_and_constraints')]
+
+    def test_duplicate_reviews_are_kept(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('auth', 'User')
+        Category = apps.get_model('product', 'Category')
+        Product = apps.get_model('product', 'Product')
+        Review = apps.get_model('product', 'Review')
+
+        user = User.objects.create(username='reviewer')
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        product = Product.objects.create(category=category, name='Laptop', slug='laptop', price=100)
+        Review.objects.create(product=product, created_by=user, rating=2, content='First')
+        Review.objects.create(product=product, created_by=user, rating=5, content='Second')
+
+        apps = self.migrate(self.after)
+
+        Review = apps.get_model('product', 'Review')
+        self.assertEqual(Review.objects.filter(product_id=product.pk, created_by_id=user.pk).count(), 2)
+
+
+class FacetMigrationTests(MigrationTestMixin, TransactionTestCase):
+    before = [('product', '0009_indexes_and_constraints')]
+    after = [('product', '0010_facet_counts')]
+
+    def test_counts_are_filled(self):
+        apps = self.migrate(self.before)
+        Category = apps.get_model('product', 'Category')
+        Product = apps.get_model('product', 'Product')
+
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        for i, price in enumerate((10, 49, 120, 3000)):
+            Product.objects.create(category=category, name='Laptop', slug='laptop-%d' % i, price=price, available=i != 3)
+
+        apps = self.migrate(self.after)
+
+        FacetCount = apps.get_model('product', 'FacetCount')
+        self.assertEqual(
+            sorted(FacetCount.objects.values_list('category_id', 'available', 'price_bucket', 'count')),
+            [(category.pk, False, 6, 1), (category.pk, True, 0, 2), (category.pk, True, 2, 1)],
+        )
+
+
+class ImporterTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        media = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def write_csv(self, rows, name='catalog.csv'):
+        fields = ['slug', 'name', 'category', 'price', 'available', 'description', 'image']
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+        return self.write(name, output.getvalue())
+
+    def run_import(self, path, **kwargs):
+        kwargs.setdefault('workers', 0)
+        importer = CatalogImporter(images_dir=self.directory, **kwargs)
+        return importer, importer.run(read_rows(path))
+
+    def test_creates_and_updates_products_by_slug(self):
+        Product.objects.create(
+            category=Category.objects.create(name='Old', slug='old'), name='Laptop', slug='laptop', price=1,
+        )
+        path = self.write_csv([
+            {'slug': 'laptop', 'name': 'Laptop Pro', 'category': 'Laptops', 'price': '999.5', 'available': 'no'},
+            {'slug': 'phone', 'name': 'Phone', 'category': 'Phones', 'price': '300'},
+            {'slug': 'tablet', 'name': 'Tablet', 'category': 'Phones', 'price': '450', 'description': 'Big'},
+        ])
+
+        importer, stats = self.run_import(path, batch_size=2)
+
+        self.assertEqual((stats['rows'], stats['created'], stats['updated'], stats['invalid']), (3, 2, 1, 0))
+        laptop = Product.objects.get(slug='laptop')
+        self.assertEqual((laptop.name, laptop.category.slug, laptop.price, laptop.available), ('Laptop Pro', 'laptops', Decimal('999.50'), False))
+        self.assertEqual(Product.objects.get(slug='tablet').description, 'Big')
+        self.assertEqual(Category.objects.get(slug='phones').products.count(), 2)
+        # Bulk writes send no signals: the import rebuilds the facet counts itself.
+        self.assertEqual(sum(FacetCount.objects.values_list('count', flat=True)), 3)
+
+    def test_invalid_rows_are_reported(self):
+        path = self.write('catalog.jsonl', '\n'.join([
+            json.dumps({'slug': 'phone', 'name': 'Phone', 'category': 'Phones', 'price': '300'}),
+            '[1, 2]',
+            '42',
+            '"phone"',
+            'null',
+            '{not json',
+            json.dumps({'slug': 'bad slug', 'name': 'Phone', 'category': 'Phones', 'price': '300'}),
+            json.dumps({'slug': 'cheap', 'name': 'Cheap', 'category': 'Phones', 'price': 'free'}),
+            json.dumps({'slug': 'tablet', 'name': 'Tablet', 'category': 'Phones', 'price': '450'}),
+        ]))
+
+        importer, stats = self.run_import(path)
+
+        self.assertEqual((stats['rows'], stats['created'], stats['invalid']), (9, 2, 7))
+        self.assertEqual(importer.errors[0], 'row 2: expected an object, got list')
+        self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['phone', 'tablet'])
+
+    def test_resumes_after_the_checkpoint(self):
+        path = self.write_csv([
+            {'slug': 'product-%d' % i, 'name': 'Product %d' % i, 'category': 'Things', 'price': '10'} for i in range(5)
+        ])
+        checkpoint = Checkpoint(os.path.join(self.directory, 'catalog.checkpoint'), path)
+
+        def crashing_rows():
+            for number, row in enumerate(read_rows(path), 1):
+                if number == 4:
+                    raise RuntimeError('crash')
+                yield row
+
+        with self.assertRaises(RuntimeError):
+            CatalogImporter(batch_size=2, workers=0).run(crashing_rows(), checkpoint=checkpoint)
+
+        # The first batch was committed, the third row was lost with the crash.
+        self.assertEqual(checkpoint.load(), 2)
+        self.assertEqual(Product.objects.count(), 2)
+
+        stats = CatalogImporter(batch_size=2, workers=0).run(read_rows(path), checkpoint=checkpoint, skip=checkpoint.load())
+
+        self.assertEqual((stats['rows'], stats['created'], stats['updated']), (5, 3, 0))
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_images_get_their_thumbnails(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 200), 'red').save(buffer, 'PNG')
+        with open(os.path.join(self.directory, 'red.png'), 'wb') as f:
+            f.write(buffer.getvalue())
+
+        path = self.write_csv([
+            {'slug': 'red-%d' % i, 'name': 'Red %d' % i, 'category': 'Things', 'price': '10', 'image': 'red.png'} for i in range(2)
+        ])
+
+        importer, stats = self.run_import(path, workers=1)
+
+        digest = thumbnails.content_hash(buffer.getvalue())
+        self.assertEqual((stats['images'], stats['thumbnails']), (1, 1))
+        self.assertEqual(set(Product.objects.values_list('image_hash', flat=True)), {digest})
+        self.assertEqual(set(Product.objects.values_list('image', flat=True)), {'uploads/%s.png' % digest})
+        self.assertTrue(default_storage.exists(thumbnails.variant_name(digest, 'listing', 'jpeg')))
+
+
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Laptops', slug='laptops')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def image(self, size=(1600, 900), fmt='JPEG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, fmt)
+        return buffer.getvalue()
+
+    def create(self, data=None, slug='laptop'):
+        product = Product(category=self.category, name='Laptop', slug=slug, price=100)
+        if data is not None:
+            product.image.save('%s.jpg' % slug, ContentFile(data), save=False)
+        product.save()
+        return product
+
+    def test_render_variants(self):
+        variants = thumbnails.render_variants(self.image())
+
+        self.assertEqual(set(variants), {(size, fmt) for size in thumbnails.SIZES for fmt in thumbnails.get_formats()})
+        for (size, fmt), content in variants.items():
+            with self.subTest(size=size, fmt=fmt):
+                variant = Image.open(io.BytesIO(content))
+                width = thumbnails.SIZES[size]
+                # The variant fits the box and keeps the aspect ratio.
+                self.assertEqual(variant.size, (width, round(width * 9 / 16)))
+                self.assertEqual(variant.format, {'jpeg': 'JPEG', 'webp': 'WEBP'}[fmt])
+
+    def test_small_images_are_not_enlarged(self):
+        variants = thumbnails.render_variants(self.image((100, 50), 'PNG'))
+
+        self.assertEqual(Image.open(io.BytesIO(variants[('detail', 'jpeg')])).size, (100, 50))
+
+    def test_store_variants(self):
+        name = thumbnails.variant_name('0123456789abcdef', 'cart', 'jpeg')
+
+        thumbnails.store_variants('0123456789abcdef', {('cart', 'jpeg'): b'first'})
+        thumbnails.store_variants('0123456789abcdef', {('cart', 'jpeg'): b'second'})
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), b'first')
+
+        thumbnails.store_variants('0123456789abcdef', {('cart', 'jpeg'): b'second'}, overwrite=True)
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), b'second')
+        self.assertEqual(default_storage.listdir(thumbnails.THUMBNAIL_DIR)[1], ['0123456789abcdef-cart.jpg'])
+
+    def test_get_thumbnail_fallbacks(self):
+        data = self.image()
+        product = self.create(data)
+
+        # No variants yet: the full-size image, then the placeholder without an image.
+        self.assertEqual(product.get_thumbnail(), product.image.url)
+        self.assertEqual(product.get_srcset(), '')
+        self.assertEqual(self.create(slug='no-image').get_thumbnail(), thumbnails.PLACEHOLDER_URL)
+
+        digest = thumbnails.build_thumbnails(product.pk)
+        product.refresh_from_db()
+
+        self.assertEqual(digest, thumbnails.content_hash(data))
+        self.assertEqual(product.get_thumbnail('cart', 'webp'), thumbnails.variant_url(digest, 'cart', 'webp'))
+        self.assertEqual(
+            product.get_srcset(),
+            ', '.join('%s %dw' % (thumbnails.variant_url(digest, size, 'jpeg'), width) for size, width in (('cart', 120), ('listing', 240), ('detail', 800))),
+        )
+
+    def test_build_command(self):
+        product = self.create(self.image())
+        out = io.StringIO()
+
+        call_command('build_thumbnails', stdout=out)
+
+        digest = Product.objects.get(pk=product.pk).image_hash
+        name = thumbnails.variant_name(digest, 'listing', 'jpeg')
+        self.assertIn('Built thumbnails for 1 products.', out.getvalue())
+
+        # A damaged variant is only replaced by --all.
+        default_storage.delete(name)
+        default_storage.save(name, ContentFile(b'damaged'))
+        call_command('build_thumbnails', stdout=out)
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), b'damaged')
+
+        call_command('build_thumbnails', '--all', stdout=out)
+        self.assertEqual(Image.open(default_storage.path(name)).size, (240, 135))
+        self.assertIn('Built thumbnails for 0 products.', out.getvalue())
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptops = Category.objects.create(name='Laptops', slug='laptops')
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+
+    def create(self, category, price, available=True, slug=None):
+        return Product.objects.create(
+            category=category, name=slug or 'Product', slug=slug or 'product-%s-%s' % (category.slug, price),
+            price=price, available=available,
+        )
+
+    def stored_counts(self):
+        return sorted(FacetCount.objects.filter(count__gt=0).values_list('category_id', 'available', 'price_bucket', 'count'))
+
+    def assertCountsMatchARebuild(self):
+        counts = self.stored_counts()
+        facets.rebuild_counts()
+        self.assertEqual(counts, self.stored_counts())
+
+    def test_price_buckets(self):
+        prices = [0, Decimal('49.99'), 50, 99, 100, 2499, 2500, 100000]
+
+        for price in prices:
+            self.create(self.laptops, price)
+
+        in_python = [facets.price_bucket(price) for price in prices]
+        in_sql = list(
+            Product.objects.annotate(bucket=facets.price_bucket_expression()).order_by('price').values_list('bucket', flat=True)
+        )
+
+        self.assertEqual(in_python, [0, 0, 1, 1, 2, 5, 6, 6])
+        self.assertEqual(in_sql, in_python)
+
+    def test_price_labels_use_the_shop_currency(self):
+        self.assertEqual(facets.price_label(0), '0 - 50 ৳')
+        self.assertEqual(facets.price_label(len(facets.PRICE_BUCKETS) - 1), '2500+ ৳')
+
+    def test_saves_maintain_the_counts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            laptop = self.create(self.laptops, 120)
+            phone = self.create(self.phones, 30)
+            self.create(self.phones, 40, available=False)
+        self.assertCountsMatchARebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            laptop = Product.objects.get(pk=laptop.pk)
+            laptop.price = 20
+            laptop.category = self.phones
+            laptop.save()
+            Product.objects.get(pk=phone.pk).delete()
+        self.assertCountsMatchARebuild()
+
+        # A product not loaded from the database: its previous facet is unknown, the counts are rebuilt.
+        with self.captureOnCommitCallbacks(execute=True):
+            Product(pk=laptop.pk, category=self.laptops, name='Laptop', slug=laptop.slug, price=600, created_at=laptop.created_at).save()
+        self.assertCountsMatchARebuild()
+
+        self.assertEqual(self.stored_counts(), [
+            (self.laptops.pk, True, 4, 1),
+            (self.phones.pk, False, 0, 1),
+        ])
+
+    def test_summarize(self):
+        rows = [
+            (self.laptops.pk, True, 0, 2),
+            (self.laptops.pk, False, 1, 1),
+            (self.phones.pk, True, 1, 3),
+        ]
+
+        summary = facets.summarize(rows, category_id=self.laptops.pk)
+
+        # The other categories keep their counts when one is selected.
+        self.assertEqual(summary['category'], {self.laptops.pk: 3, self.phones.pk: 3})
+        self.assertEqual(summary['available'], {True: 2, False: 1})
+        self.assertEqual(summary['price'], {0: 2, 1: 1})
+
+    def test_shop_sidebar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create(self.laptops, 120)
+            self.create(self.phones, 30)
+            self.create(self.phones, 40, available=False)
+        cache.clear()
+
+        response = self.client.get(reverse('shop'), {'price': '0'})
+
+        sidebar = response.context['facets']
+        self.assertEqual(len(response.context['page']), 2)
+        self.assertEqual([(link['label'], link['count']) for link in sidebar['categories']], [('Laptops', 0), ('Phones', 2)])
+        self.assertEqual([(link['label'], link['count']) for link in sidebar['availability']], [('In stock', 1), ('Out of stock', 1)])
+        self.assertEqual(
+            [(link['label'], link['count'], link['selected']) for link in sidebar['prices']],
+            [('0 - 50 ৳', 2, True), ('100 - 250 ৳', 1, False)],
+        )
+        self.assertContains(response, '0 - 50 ৳')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptops = Category.objects.create(name='Laptops', slug='laptops')
+        cls.bags = Category.objects.create(name='Bags', slug='bags')
+        cls.gaming = cls.create(cls.laptops, 'Gaming Laptop', 'A fast machine', 'gaming-laptop')
+        cls.bag = cls.create(cls.bags, 'Laptop Bag', 'Fits a laptop up to 15 inches', 'laptop-bag')
+        cls.sleeve = cls.create(cls.bags, 'Sleeve', 'A soft sleeve for your laptop', 'sleeve')
+        cls.mouse = cls.create(cls.laptops, 'Wireless Mouse', 'Works with any computer', 'mouse')
+
+        # The signals index the products once the transaction commits, which never happens here.
+        if search.SQLiteFTSBackend.is_available():
+            search.SQLiteFTSBackend().index(Product.objects.all())
+
+    @classmethod
+    def create(cls, category, name, description, slug):
+        return Product.objects.create(category=category, name=name, description=description, slug=slug, price=100)
+
+    def setUp(self):
+        search._backend = None
+        self.addCleanup(setattr, search, '_backend', None)
+        cache.clear()
+
+    def backends(self):
+        backends = [search.InMemoryBackend()]
+
+        if search.SQLiteFTSBackend.is_available():
+            backends.append(search.SQLiteFTSBackend())
+
+        return backends
+
+    def test_ranking(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                # Name matches first, then description matches.
+                ranked = backend.search('laptop')
+                self.assertEqual(set(ranked[:2]), {self.gaming.pk, self.bag.pk})
+                self.assertEqual(ranked[2:], [self.sleeve.pk])
+                self.assertEqual(backend.search('gaming laptop'), [self.gaming.pk])
+                self.assertEqual(backend.search('tablet'), [])
+                self.assertEqual(backend.search('  '), [])
+
+    def test_last_word_matches_as_a_prefix(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(set(backend.search('lapt')), {self.gaming.pk, self.bag.pk, self.sleeve.pk})
+                self.assertEqual(backend.search('gaming lap'), [self.gaming.pk])
+                self.assertEqual(backend.search('gam laptop'), [])
+
+    def test_fts_syntax_is_not_interpreted(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.search('laptop OR "mouse'), [])
+                self.assertEqual(backend.search('wireless-mouse'), [self.mouse.pk])
+
+    def test_fallback_without_fts5(self):
+        with mock.patch.object(search.SQLiteFTSBackend, 'is_available', return_value=False):
+            backend = search.get_backend()
+
+        self.assertIsInstance(backend, search.InMemoryBackend)
+        products = search.search_queryset(Product.objects.filter(category=self.bags), 'laptop')
+        self.assertEqual([product.pk for product in products], [self.bag.pk, self.sleeve.pk])
+
+    def test_fts_filters_apply_before_any_limit(self):
+        if not search.SQLiteFTSBackend.is_available():
+            self.skipTest('SQLite was built without FTS5.')
+
+        # The ranked IDs of search() are not used: every match is ranked in the product query.
+        with mock.patch.object(search.SQLiteFTSBackend, 'search', side_effect=AssertionError):
+            products = search.search_queryset(Product.objects.filter(category=self.bags), 'laptop')
+            self.assertEqual([product.pk for product in products], [self.bag.pk, self.sleeve.pk])
+            self.assertEqual(products.count(), 2)
+            self.assertEqual(facets.grouped_counts(products), [(self.bags.pk, True, 2, 2)])
+
+    def test_shop_search_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                self.create(self.bags, 'Laptop Backpack %d' % i, '', 'backpack-%d' % i)
+
+        expected = [product.pk for product in search.search_queryset(Product.objects.filter(category=self.bags), 'laptop')]
+        seen = []
+        params = {'query': 'laptop', 'category': 'bags'}
+
+        with self.settings(SHOP_PAGE_SIZE=3):
+            while True:
+                page = self.client.get(reverse('shop'), params).context['page']
+                seen.extend(product.pk for product in page)
+                if not page.next_cursor:
+                    break
+                params['cursor'] = page.next_cursor
+
+        self.assertEqual(len(expected), 7)
+        self.assertEqual(seen, expected)
+
+    def test_signals_keep_the_index_up_to_date(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__), mock.patch.object(search, '_backend', backend):
+                backend.search('warmup')
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    tablet = self.create(self.laptops, 'Drawing Tablet', '', 'tablet-%s' % type(backend).__name__)
+                self.assertEqual(backend.search('tablet'), [tablet.pk])
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    tablet.name = 'Drawing Pad'
+                    tablet.save()
+                self.assertEqual(backend.search('tablet'), [])
+                self.assertEqual(backend.search('pad'), [tablet.pk])
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    tablet.delete()
+                self.assertEqual(backend.search('pad'), [])
+
+    def test_rebuild_command(self):
+        if not search.SQLiteFTSBackend.is_available():
+            self.skipTest('SQLite was built without FTS5.')
+
+        backend = search.get_backend()
+        backend.clear()
+        self.assertEqual(backend.search('laptop'), [])
+        out = io.StringIO()
+
+        call_command('rebuild_search_index', batch_size=3, stdout=out)
+
+        self.assertEqual(set(backend.search('laptop')), {self.gaming.pk, self.bag.pk, self.sleeve.pk})
+        self.assertIn('Search index rebuilt (4 products).', out.getvalue())
+
+    def test_rebuild_command_with_the_in_memory_index(self):
+        out = io.StringIO()
+
+        with self.settings(SEARCH_BACKEND='product.search.InMemoryBackend'):
+            call_command('rebuild_search_index', stdout=out)
+
+        self.assertIn('nothing to do here', out.getvalue())
+
+
+class RatingTests(TestCase):
+    FIELDS = ('review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Laptops', slug='laptops')
+        cls.products = [
+            Product.objects.create(category=category, name='Laptop %d' % i, slug='laptop-%d' % i, price=100)
+            for i in range(3)
+        ]
+        cls.users = [User.objects.create_user('user%d' % i, password='password') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def aggregates(self):
+        return list(Product.objects.order_by('pk').values_list(*self.FIELDS))
+
+    def assertAggregatesMatchARebuild(self):
+        stored = self.aggregates()
+        ratings.rebuild_aggregates()
+        self.assertEqual(stored, self.aggregates())
+
+    def review(self, product, user, rating):
+        return Review.objects.create(product=product, created_by=user, rating=rating, content='Review')
+
+    def test_created_edited_and_deleted_reviews(self):
+        first = self.review(self.products[0], self.users[0], 5)
+        self.review(self.products[0], self.users[1], 3)
+        self.assertEqual(self.aggregates()[0], (2, 8, 0, 0, 1, 0, 1))
+        self.assertAggregatesMatchARebuild()
+
+        first = Review.objects.get(pk=first.pk)
+        first.rating = 2
+        first.save()
+        self.assertEqual(self.aggregates()[0], (2, 5, 0, 1, 1, 0, 0))
+        self.assertAggregatesMatchARebuild()
+
+        # An unchanged rating leaves the aggregates alone.
+        with self.assertNumQueries(1):
+            first.content = 'Edited'
+            first.save()
+
+        first.delete()
+        self.assertEqual(self.aggregates()[0], (1, 3, 0, 0, 1, 0, 0))
+        self.assertAggregatesMatchARebuild()
+
+    def test_review_not_loaded_from_the_database(self):
+        review = self.review(self.products[1], self.users[0], 4)
+
+        # The stored rating is unknown: the aggregates of the product are rebuilt.
+        Review(pk=review.pk, product=self.products[1], created_by=self.users[0], rating=1, content='Edited',
+               created_at=review.created_at).save()
+
+        self.assertEqual(self.aggregates()[1], (1, 1, 1, 0, 0, 0, 0))
+
+    def test_reviews_from_the_product_page(self):
+        self.client.force_login(self.users[0])
+        url = reverse('product', args=[self.products[0].slug])
+
+        self.client.post(url, {'rating': '4', 'content': 'Good'})
+        # A second review by the same user replaces the first; out of range ratings are clamped.
+        self.client.post(url, {'rating': '9', 'content': 'Great'})
+
+        self.assertEqual(Review.objects.get(product=self.products[0]).rating, 5)
+        self.assertEqual(self.aggregates()[0], (1, 5, 0, 0, 0, 0, 1))
+
+    def test_rebuild_command(self):
+        # bulk_create sends no signals: the aggregates are left behind.
+        Review.objects.bulk_create([
+            Review(product=self.products[0], created_by=self.users[0], rating=5, content='Review'),
+            Review(product=self.products[0], created_by=self.users[1], rating=4, content='Review'),
+            Review(product=self.products[2], created_by=self.users[0], rating=1, content='Review'),
+        ])
+        Product.objects.filter(pk=self.products[1].pk).update(review_count=3, rating_sum=9)
+        out = io.StringIO()
+
+        call_command('rebuild_ratings', batch_size=1, stdout=out)
+
+        self.assertEqual(self.aggregates(), [
+            (2, 9, 0, 0, 0, 1, 1),
+            (0, 0, 0, 0, 0, 0, 0),
+            (1, 1, 1, 0, 0, 0, 0),
+        ])
+        self.assertIn('Rebuilt the rating aggregates of 2 reviewed products.', out.getvalue())
+
+    def test_shop_rating_sort_and_filter(self):
+        self.review(self.products[0], self.users[0], 3)
+        self.review(self.products[1], self.users[0], 5)
+        self.review(self.products[1], self.users[1], 4)
+        self.review(self.products[2], self.users[0], 5)
+
+        def shop(**params):
+            return [product.pk for product in self.client.get(reverse('shop'), params).context['page']]
+
+        first, second, third = self.products
+        self.assertEqual(shop(sort='rating'), [third.pk, second.pk, first.pk])
+        self.assertEqual(
+            sorted(Product.objects.annotate(average=ratings.rating_average()).values_list('pk', 'average')),
+            [(first.pk, 3.0), (second.pk, 4.5), (third.pk, 5.0)],
+        )
+        self.assertEqual(shop(min_rating='4.5', sort='rating'), [third.pk, second.pk])
+        self.assertEqual(len(shop(min_rating='many')), 3)
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+
+# The thumbnail sizes, as the width (and height) of the box each variant fits in.
+SIZES = {
+    'cart': 120,
+    'listing': 240,
+    'detail': 800,
+}
+
+# The formats every size is written in, with their file extension and encoder options.
+FORMATS = {
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# Where the variants are stored, relative to MEDIA_ROOT.
+THUMBNAIL_DIR = 'thumbnails'
+
+PLACEHOLDER_URL = 'https://via.placeholder.com/240x240.jpg'
+
+_executor = None
+
+
+def content_hash(data):
+    """
+    Returns the hash that names the variants of an image: the first 16 hex digits of its SHA-256.
+    """
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def get_formats():
+    """
+    Returns the formats this Pillow build can write (WebP support is optional).
+    """
+    return [fmt for fmt in FORMATS if fmt != 'webp' or features.check('webp')]
+
+
+def variant_name(digest, size, fmt):
+    """
+    Returns the storage name of one variant, e.g. 'thumbnails/0123456789abcdef-listing.webp'.
+    """
+    return '%s/%s-%s.%s' % (THUMBNAIL_DIR, digest, size, FORMATS[fmt][0])
+
+
+def variant_url(digest, size, fmt):
+    return default_storage.url(variant_name(digest, size, fmt))
+
+
+def render_variants(data):
+    """
+    Renders every size and format of an image.
+
+    This is a pure function of the image bytes, so it can run in a thread or a separate process.
+    JPEG sources are decoded in draft mode, which lets the decoder downscale by up to 8x while
+    decoding instead of decoding the full image and then resizing it.
+
+    Args:
+        data (bytes): The original image.
+
+    Returns:
+        dict: A mapping of (size, format) to the encoded variant bytes.
+    """
+    variants = {}
+
+    for size, width in SIZES.items():
+        img = Image.open(BytesIO(data))
+
+        if img.format == 'JPEG':
+            img.draft('RGB', (width, width))
+
+        img = img.convert('RGB')
+        img.thumbnail((width, width), Image.LANCZOS)
+
+        for fmt in get_formats():
+            buffer = BytesIO()
+            img.save(buffer, fmt.upper(), **FORMATS[fmt][1])
+            variants[(size, fmt)] = buffer.getvalue()
+
+    return variants
+
+
+def store_variants(digest, variants, overwrite=False):
+    """
+    Writes rendered variants to the default storage. Variants that already exist are kept
+    unless `overwrite` is set: their names are derived from the content, so they can only be
+    out of date if the rendering settings changed or a file was damaged.
+    """
+    for (size, fmt), content in variants.items():
+        name = variant_name(digest, size, fmt)
+
+        if default_storage.exists(name):
+            if not overwrite:
+                continue
+            default_storage.delete(name)
+
+        default_storage.save(name, ContentFile(content))
+
+
+def build_thumbnails(product_id, force=False):
+    """
+    Builds the variants of a product's image and records their hash on the product.
+
+    Args:
+        product_id (int): The ID of the product.
+        force (bool, optional): Render and write every variant again, even those that exist.
+
+    Returns:
+        str or None: The content hash of the image, or None if the product has no image.
+    """
+    # Imported here to keep this module importable from the models module.
+    from . import catalog
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).first()
+
+    if product is None or not product.image:
+        return None
+
+    with product.image.open('rb') as image:
+        data = image.read()
+
+    digest = content_hash(data)
+    names = [variant_name(digest, size, fmt) for size in SIZES for fmt in get_formats()]
+
+    if force or not all(default_storage.exists(name) for name in names):
+        store_variants(digest, render_variants(data), overwrite=force)
+
+    if product.image_hash != digest:
+        # A queryset update does not send post_save, so it does not schedule another build.
+        Product.objects.filter(pk=product_id).update(image_hash=digest)
+        catalog.bump_version()
+
+    return digest
+
+
+def _run(product_id):
+    try:
+        build_thumbnails(product_id)
+    except Exception:
+        logger.exception('Building the thumbnails of product %s failed', product_id)
+    finally:
+        # Worker threads have their own database connections; do not leak them.
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+            thread_name_prefix='thumbnails',
+        )
+
+    return _executor
+
+
+def schedule(product_id):
+    """
+    Builds the thumbnails of a product in the worker pool, after the current transaction commits,
+    so the request that saved the product never waits for the images.
+    """
+    transaction.on_commit(lambda: get_executor().submit(_run, product_id))
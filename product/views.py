@@ -1,8 +1,15 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from .models import Product, Review
+from django.http import Http404
+from django.shortcuts import render, redirect
+
+from core.cache import cache_anonymous_page
+
+from . import catalog
+from .models import Review
+from .ratings import clean_rating
 
 
 # Create your views here.
+@cache_anonymous_page
 def product(request, slug):
     """
     Renders the product page and handles the submission of a new review.
@@ -15,14 +22,16 @@ def product(request, slug):
         HttpResponse: The rendered product page if no review is submitted.
         HttpResponseRedirect: The product page with the new review if a review is submitted.
     """
-    product = get_object_or_404(Product, slug=slug)
+    product = catalog.get_product_by_slug(slug)
+    if product is None:
+        raise Http404('No Product matches the given query.')
     if request.method == 'POST':
-        rating = request.POST.get('rating', 4)
+        rating = clean_rating(request.POST.get('rating', 4))
         content  = request.POST.get('content', '')
         if content:
-            reviews = Review.objects.filter(product=product, created_by=request.user)
-            if reviews.count() > 0:
-                review = reviews.first()
+            # Saving the review updates the rating aggregates of the product (see product/signals.py).
+            review = Review.objects.filter(product=product, created_by=request.user).first()
+            if review is not None:
                 review.rating = rating
                 review.content = content
                 review.save()